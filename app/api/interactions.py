@@ -3,11 +3,16 @@ from sqlalchemy.orm import Session
 from sqlalchemy import and_, func
 from pydantic import BaseModel, Field
 from datetime import datetime, timezone, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from app.utils.database import get_db
 from app.models.schema import UserTourInteraction, UserProfile, Tour
 from app.services.scoring import get_interaction_score
+from app.services.model_registry import model_registry
+from app.services.data_version import bump_data_version
+from app.services.interaction_loader import tour_to_metadata
+from app.services.result_cache import result_cache
 from app.api.deps import verify_internal_key
+from app.utils.executors import run_db, run_model
 
 router = APIRouter(
     prefix="/interactions",
@@ -37,12 +42,12 @@ async def create_interaction(
     - **rating**: Rating từ 1-5 sao (chỉ cần khi interaction_type = 'rating')
     """
     # Kiểm tra user tồn tại
-    user = db.query(UserProfile).filter(UserProfile.id == interaction.user_id).first()
+    user = await run_db(lambda: db.query(UserProfile).filter(UserProfile.id == interaction.user_id).first())
     if not user:
         raise HTTPException(status_code=404, detail=f"User với ID {interaction.user_id} không tồn tại")
     
     # Kiểm tra tour tồn tại
-    tour = db.query(Tour).filter(Tour.id == interaction.tour_id).first()
+    tour = await run_db(lambda: db.query(Tour).filter(Tour.id == interaction.tour_id).first())
     if not tour:
         raise HTTPException(status_code=404, detail=f"Tour với ID {interaction.tour_id} không tồn tại")
     
@@ -68,17 +73,40 @@ async def create_interaction(
         score = interaction.score
     
     # Tạo interaction mới
+    interaction_type = interaction.interaction_type.lower()
+    created_at = datetime.now(timezone.utc)
     new_interaction = UserTourInteraction(
         user_id=interaction.user_id,
         tour_id=interaction.tour_id,
-        interaction_type=interaction.interaction_type.lower(),
+        interaction_type=interaction_type,
         score=score,  # Score đã được tính
-        created_at=datetime.now(timezone.utc)
+        created_at=created_at
     )
+    # Đọc metadata của tour trước commit (commit làm expire ORM objects của session)
+    tour_data = tour_to_metadata(tour)
     
-    db.add(new_interaction)
-    db.commit()
-    db.refresh(new_interaction)
+    def save() -> Optional[int]:
+        db.add(new_interaction)
+        data_version = bump_data_version(db)
+        db.commit()
+        db.refresh(new_interaction)
+        return data_version
+    
+    data_version = await run_db(save)
+    
+    # Cập nhật incremental các models dùng chung để recommendations phản ánh ngay
+    # (truyền giá trị thuần, không truyền ORM objects sang model_executor)
+    try:
+        await run_model(
+            model_registry.apply_interaction,
+            interaction.user_id, interaction.tour_id, score,
+            interaction_type, created_at, tour_data, data_version
+        )
+    except Exception:
+        pass  # Model sẽ được đồng bộ ở lần rebuild tiếp theo
+    
+    # Kết quả đã cache của user không còn phản ánh interaction mới
+    result_cache.invalidate_user(interaction.user_id)
     
     return {
         "success": True,
@@ -102,11 +130,13 @@ async def get_user_interactions(
     """
     Lấy tất cả interactions của một user
     """
-    interactions = db.query(UserTourInteraction)\
-        .filter(UserTourInteraction.user_id == user_id)\
-        .order_by(UserTourInteraction.created_at.desc())\
-        .limit(limit)\
+    interactions = await run_db(
+        lambda: db.query(UserTourInteraction)
+        .filter(UserTourInteraction.user_id == user_id)
+        .order_by(UserTourInteraction.created_at.desc())
+        .limit(limit)
         .all()
+    )
     
     return {
         "success": True,
@@ -133,11 +163,13 @@ async def get_tour_interactions(
     """
     Lấy tất cả interactions của một tour
     """
-    interactions = db.query(UserTourInteraction)\
-        .filter(UserTourInteraction.tour_id == tour_id)\
-        .order_by(UserTourInteraction.created_at.desc())\
-        .limit(limit)\
+    interactions = await run_db(
+        lambda: db.query(UserTourInteraction)
+        .filter(UserTourInteraction.tour_id == tour_id)
+        .order_by(UserTourInteraction.created_at.desc())
+        .limit(limit)
         .all()
+    )
     
     return {
         "success": True,
@@ -173,21 +205,25 @@ async def clean_all_interactions(
             detail="Phải set confirm=true để xác nhận xóa tất cả interactions"
         )
     
-    try:
+    def delete_all() -> int:
         # Đếm số lượng interactions trước khi xóa
         count_before = db.query(UserTourInteraction).count()
         
         # Xóa tất cả interactions
         db.query(UserTourInteraction).delete()
+        bump_data_version(db)
         db.commit()
+        return count_before
+    
+    try:
+        count_before = await run_db(delete_all)
         
-        # Invalidate cache của CollaborativeFiltering
+        # Bỏ các CollaborativeFiltering models dùng chung (không phục vụ tiếp data đã xóa)
         try:
-            from app.services.collaborative_filtering import CollaborativeFiltering
-            cf = CollaborativeFiltering(db)
-            cf.invalidate_cache()
+            model_registry.drop_all()
         except Exception:
             pass  # Ignore cache invalidation errors
+        result_cache.clear()
         
         return {
             "success": True,
@@ -195,7 +231,7 @@ async def clean_all_interactions(
             "deleted_count": count_before
         }
     except Exception as e:
-        db.rollback()
+        await run_db(db.rollback)
         raise HTTPException(status_code=500, detail=f"Lỗi khi xóa interactions: {str(e)}")
 
 @router.delete("/user/{user_id}/clean")
@@ -217,11 +253,11 @@ async def clean_user_interactions(
         )
     
     # Kiểm tra user tồn tại
-    user = db.query(UserProfile).filter(UserProfile.id == user_id).first()
+    user = await run_db(lambda: db.query(UserProfile).filter(UserProfile.id == user_id).first())
     if not user:
         raise HTTPException(status_code=404, detail=f"User với ID {user_id} không tồn tại")
     
-    try:
+    def delete_user_interactions() -> Tuple[int, Optional[int]]:
         # Đếm số lượng interactions trước khi xóa
         count_before = db.query(UserTourInteraction).filter(
             UserTourInteraction.user_id == user_id
@@ -231,15 +267,19 @@ async def clean_user_interactions(
         db.query(UserTourInteraction).filter(
             UserTourInteraction.user_id == user_id
         ).delete()
+        data_version = bump_data_version(db)
         db.commit()
+        return count_before, data_version
+    
+    try:
+        count_before, data_version = await run_db(delete_user_interactions)
         
-        # Invalidate cache
+        # Bỏ interactions đã xóa khỏi models dùng chung (incremental, models tiếp tục phục vụ)
         try:
-            from app.services.collaborative_filtering import CollaborativeFiltering
-            cf = CollaborativeFiltering(db)
-            cf.invalidate_cache()
+            await run_model(model_registry.remove_interactions, user_id=user_id, data_version=data_version)
         except Exception:
-            pass
+            model_registry.invalidate_all()  # Model được build lại trong background
+        result_cache.invalidate_user(user_id)
         
         return {
             "success": True,
@@ -248,7 +288,7 @@ async def clean_user_interactions(
             "deleted_count": count_before
         }
     except Exception as e:
-        db.rollback()
+        await run_db(db.rollback)
         raise HTTPException(status_code=500, detail=f"Lỗi khi xóa interactions: {str(e)}")
 
 @router.delete("/tour/{tour_id}/clean")
@@ -270,11 +310,11 @@ async def clean_tour_interactions(
         )
     
     # Kiểm tra tour tồn tại
-    tour = db.query(Tour).filter(Tour.id == tour_id).first()
+    tour = await run_db(lambda: db.query(Tour).filter(Tour.id == tour_id).first())
     if not tour:
         raise HTTPException(status_code=404, detail=f"Tour với ID {tour_id} không tồn tại")
     
-    try:
+    def delete_tour_interactions() -> Tuple[int, Optional[int]]:
         # Đếm số lượng interactions trước khi xóa
         count_before = db.query(UserTourInteraction).filter(
             UserTourInteraction.tour_id == tour_id
@@ -284,15 +324,19 @@ async def clean_tour_interactions(
         db.query(UserTourInteraction).filter(
             UserTourInteraction.tour_id == tour_id
         ).delete()
+        data_version = bump_data_version(db)
         db.commit()
+        return count_before, data_version
+    
+    try:
+        count_before, data_version = await run_db(delete_tour_interactions)
         
-        # Invalidate cache
+        # Bỏ interactions đã xóa khỏi models dùng chung (incremental, models tiếp tục phục vụ)
         try:
-            from app.services.collaborative_filtering import CollaborativeFiltering
-            cf = CollaborativeFiltering(db)
-            cf.invalidate_cache()
+            await run_model(model_registry.remove_interactions, tour_id=tour_id, data_version=data_version)
         except Exception:
-            pass
+            model_registry.invalidate_all()  # Model được build lại trong background
+        result_cache.clear()
         
         return {
             "success": True,
@@ -301,7 +345,7 @@ async def clean_tour_interactions(
             "deleted_count": count_before
         }
     except Exception as e:
-        db.rollback()
+        await run_db(db.rollback)
         raise HTTPException(status_code=500, detail=f"Lỗi khi xóa interactions: {str(e)}")
 
 @router.delete("/old")
@@ -329,9 +373,11 @@ async def clean_old_interactions(
         cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
         
         # Đếm số lượng interactions sẽ bị xóa
-        count_before = db.query(UserTourInteraction).filter(
-            UserTourInteraction.created_at < cutoff_date
-        ).count()
+        count_before = await run_db(
+            lambda: db.query(UserTourInteraction).filter(
+                UserTourInteraction.created_at < cutoff_date
+            ).count()
+        )
         
         if count_before == 0:
             return {
@@ -341,18 +387,18 @@ async def clean_old_interactions(
             }
         
         # Xóa interactions cũ
-        db.query(UserTourInteraction).filter(
-            UserTourInteraction.created_at < cutoff_date
-        ).delete()
-        db.commit()
+        def delete_old():
+            db.query(UserTourInteraction).filter(
+                UserTourInteraction.created_at < cutoff_date
+            ).delete()
+            bump_data_version(db)
+            db.commit()
         
-        # Invalidate cache
-        try:
-            from app.services.collaborative_filtering import CollaborativeFiltering
-            cf = CollaborativeFiltering(db)
-            cf.invalidate_cache()
-        except Exception:
-            pass
+        await run_db(delete_old)
+        
+        # Models dùng chung được build lại trong background, model hiện tại tiếp tục phục vụ
+        model_registry.invalidate_all()
+        result_cache.clear()
         
         return {
             "success": True,
@@ -361,7 +407,7 @@ async def clean_old_interactions(
             "deleted_count": count_before
         }
     except Exception as e:
-        db.rollback()
+        await run_db(db.rollback)
         raise HTTPException(status_code=500, detail=f"Lỗi khi xóa interactions: {str(e)}")
 
 @router.get("/stats")
@@ -375,7 +421,7 @@ async def get_interaction_stats(db: Session = Depends(get_db)):
     - Số interactions theo tour
     - Số interactions theo loại
     """
-    try:
+    def collect_stats() -> dict:
         # Tổng số interactions
         total_count = db.query(UserTourInteraction).count()
         
@@ -397,16 +443,19 @@ async def get_interaction_stats(db: Session = Depends(get_db)):
         oldest = db.query(UserTourInteraction).order_by(UserTourInteraction.created_at.asc()).first()
         newest = db.query(UserTourInteraction).order_by(UserTourInteraction.created_at.desc()).first()
         
+        return {
+            "total_interactions": total_count,
+            "unique_users": unique_users,
+            "unique_tours": unique_tours,
+            "by_type": type_stats,
+            "oldest_interaction": oldest.created_at.isoformat() if oldest else None,
+            "newest_interaction": newest.created_at.isoformat() if newest else None
+        }
+    
+    try:
         return {
             "success": True,
-            "stats": {
-                "total_interactions": total_count,
-                "unique_users": unique_users,
-                "unique_tours": unique_tours,
-                "by_type": type_stats,
-                "oldest_interaction": oldest.created_at.isoformat() if oldest else None,
-                "newest_interaction": newest.created_at.isoformat() if newest else None
-            }
+            "stats": await run_db(collect_stats)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy thống kê: {str(e)}")
@@ -1,10 +1,14 @@
+import os
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List
 from app.utils.database import get_db
-from app.services.collaborative_filtering import CollaborativeFiltering
-from app.models.schema import UserProfile, Tour
+from app.services.model_registry import model_registry
+from app.services.result_cache import result_cache
+from app.services.popularity_index import popularity_index
+from app.models.schema import UserProfile
 from app.api.deps import verify_internal_key
+from app.utils.executors import run_db, run_model
 
 router = APIRouter(
     prefix="/recommendations",
@@ -12,30 +16,62 @@ router = APIRouter(
     dependencies=[Depends(verify_internal_key)],
 )
 
+# Số users tối đa mỗi request batch
+# (job cho toàn bộ users chạy bằng scripts/parallel_batch.py trên process pool)
+BATCH_MAX_USERS = int(os.getenv("CF_BATCH_MAX_USERS", "100"))
+
+def _popular_fallback(db: Session, user_interactions_count: int, limit: int) -> List[Dict]:
+    """
+    Fallback khi không có recommendations: nếu user đã tương tác với >= 80% tours
+    thì trả về top tours phổ biến nhất, ngược lại trả về danh sách rỗng
+    (đọc từ popularity index, db chỉ dùng khi index chưa được build)
+    """
+    popularity_index.ensure_fresh(db)
+    
+    # Nếu user đã tương tác với >= 80% tours, trả về top tours phổ biến
+    if user_interactions_count < popularity_index.n_tours * 0.8:
+        return []
+    
+    return [{
+        "tour_id": tour["id"],
+        "tour_title": tour["title"],
+        "tour_slug": tour["slug"],
+        "predicted_score": score,
+        "method": "popular_fallback",
+        "reason": "User đã tương tác với hầu hết tours, trả về tours phổ biến nhất"
+    } for tour, score in popularity_index.top_tours(limit, "popular", db)]
+
 @router.get("/collaborative/{user_id}")
 async def get_collaborative_recommendations(
     user_id: int,
-    method: str = Query("hybrid", regex="^(user_based|tour_based|hybrid)$"),
+    method: str = Query("hybrid", regex="^(user_based|tour_based|hybrid|als)$"),
     limit: int = Query(10, ge=1, le=50),
+    serving_mode: str = Query("live", regex="^(live|precomputed)$"),
     db: Session = Depends(get_db)
 ):
     """
     Lấy gợi ý dựa trên Collaborative Filtering
     
     - **user_id**: ID của người dùng
-    - **method**: Phương pháp CF (user_based, tour_based, hybrid)
+    - **method**: Phương pháp CF (user_based, tour_based, hybrid, als)
     - **limit**: Số lượng gợi ý (1-50)
+    - **serving_mode**: live (tính điểm theo request) hoặc precomputed (đọc top-N
+      đã tính trước, tự dùng live nếu store chưa có user)
     """
     # Kiểm tra user tồn tại
-    user = db.query(UserProfile).filter(UserProfile.id == user_id).first()
+    user = await run_db(lambda: db.query(UserProfile).filter(UserProfile.id == user_id).first())
     if not user:
         raise HTTPException(
             status_code=404, 
             detail=f"User với ID {user_id} không tồn tại. Vui lòng kiểm tra lại user_id."
         )
     
-    # Tạo CF instance với preprocessing và advanced features enabled
-    cf = CollaborativeFiltering(
+    # Lấy CF model dùng chung với preprocessing và advanced features enabled
+    # (chỉ build lại khi cache hết hạn hoặc data thay đổi). Kiểm tra data version
+    # và lần build đầu đọc database qua session của request nên chạy trên db_executor;
+    # model_executor chỉ nhận model và các giá trị thuần (user_id, method, limit)
+    cf = await run_db(
+        model_registry.get_model,
         db, 
         normalize=True,  # Mean centering để giảm user bias
         handle_sparse=True,  # Xử lý sparse data
@@ -48,62 +84,76 @@ async def get_collaborative_recommendations(
     )
     
     try:
+        # Fast path: đọc top-N đã tính trước, chỉ lọc lại tours đã tương tác/không còn active
+        if serving_mode == "precomputed":
+            # Điểm ALS đã có trong store, chỉ cần similarity cho diversity / explanations
+            store = await run_model(model_registry.get_recommendation_store)
+            precomputed_methods = () if method == "als" else (method,)
+            recommendations = await run_model(
+                cf.serve, precomputed_methods, [user_id], cf.precomputed_recommendations, store, user_id, method, limit
+            ) if store else None
+            if recommendations is not None:
+                return {
+                    "success": True,
+                    "user_id": user_id,
+                    "method": method,
+                    "serving_mode": serving_mode,
+                    "recommendations": recommendations,
+                    "count": len(recommendations),
+                    "message": "Không có recommendations phù hợp" if len(recommendations) == 0 else None
+                }
+        
+        # Kết quả đã tính cho đúng user/method/limit trên model hiện tại
+        cache_key = (user_id, method, limit, cf.model_version)
+        cache_generation = result_cache.generation()
+        recommendations = result_cache.get(cache_key)
+        if recommendations is not None:
+            return {
+                "success": True,
+                "user_id": user_id,
+                "method": method,
+                "serving_mode": "live",
+                "recommendations": recommendations,
+                "count": len(recommendations),
+                "message": "Không có recommendations phù hợp" if len(recommendations) == 0 else None
+            }
+        
         # Kiểm tra cold start (user chưa có interactions)
         from app.models.schema import UserTourInteraction
-        user_interactions_count = db.query(UserTourInteraction).filter(
-            UserTourInteraction.user_id == user_id
-        ).count()
+        user_interactions_count = await run_db(
+            lambda: db.query(UserTourInteraction).filter(UserTourInteraction.user_id == user_id).count()
+        )
         
         # Nếu user chưa có interactions, dùng cold start
-        if user_interactions_count == 0:
-            recommendations = cf.handle_cold_start_user(user_id, limit)
-        elif method == "user_based":
-            recommendations = cf.user_based_recommendations(user_id, limit)
-        elif method == "tour_based":
-            recommendations = cf.tour_based_recommendations(user_id, limit)
-        else:  # hybrid
-            recommendations = cf.hybrid_recommendations(user_id, limit)
+        # (không cache: phải đổi ngay khi user có interaction đầu tiên)
+        cacheable = user_interactions_count > 0
+        if not cacheable:
+            recommendations = await run_db(cf.handle_cold_start_user, user_id, limit, db)
+        else:
+            if method == "user_based":
+                recommend = cf.user_based_recommendations
+            elif method == "tour_based":
+                recommend = cf.tour_based_recommendations
+            elif method == "als":
+                recommend = cf.als_recommendations
+            else:  # hybrid
+                recommend = cf.hybrid_recommendations
+            recommendations = await run_model(cf.serve, (method,), [user_id], recommend, user_id, limit)
         
         # Nếu không có recommendations và user đã tương tác với nhiều tours,
         # có thể user đã xem hết tours. Trả về top tours phổ biến nhất làm fallback
         if len(recommendations) == 0:
-            # Kiểm tra số tours user đã tương tác
-            from app.models.schema import UserTourInteraction
-            user_interactions_count = db.query(UserTourInteraction).filter(
-                UserTourInteraction.user_id == user_id
-            ).count()
-            
-            total_tours = db.query(Tour).filter(
-                Tour.is_active == True,
-                Tour.is_approved == True,
-                Tour.is_banned == False
-            ).count()
-            
-            # Nếu user đã tương tác với >= 80% tours, trả về top tours phổ biến
-            if user_interactions_count >= total_tours * 0.8:
-                # Lấy top tours phổ biến nhất (dựa trên view_count hoặc booked_count)
-                popular_tours = db.query(Tour).filter(
-                    Tour.is_active == True,
-                    Tour.is_approved == True,
-                    Tour.is_banned == False
-                ).order_by(
-                    Tour.view_count.desc(),
-                    Tour.booked_count.desc()
-                ).limit(limit).all()
-                
-                recommendations = [{
-                    "tour_id": tour.id,
-                    "tour_title": tour.title,
-                    "tour_slug": tour.slug,
-                    "predicted_score": float(tour.view_count + tour.booked_count * 2),
-                    "method": "popular_fallback",
-                    "reason": "User đã tương tác với hầu hết tours, trả về tours phổ biến nhất"
-                } for tour in popular_tours]
+            recommendations = await run_db(_popular_fallback, db, user_interactions_count, limit)
+            cacheable = cacheable and len(recommendations) == 0
+        
+        if cacheable:
+            result_cache.put(cache_key, recommendations, cache_generation)
         
         return {
             "success": True,
             "user_id": user_id,
             "method": method,
+            "serving_mode": "live",
             "recommendations": recommendations,
             "count": len(recommendations),
             "message": "Không có recommendations phù hợp" if len(recommendations) == 0 else None
@@ -115,7 +165,7 @@ async def get_collaborative_recommendations(
 @router.post("/collaborative/batch")
 async def get_batch_recommendations(
     user_ids: List[int],
-    method: str = Query("hybrid", regex="^(user_based|tour_based|hybrid)$"),
+    method: str = Query("hybrid", regex="^(user_based|tour_based|hybrid|als)$"),
     limit: int = Query(10, ge=1, le=50),
     db: Session = Depends(get_db)
 ):
@@ -124,17 +174,18 @@ async def get_batch_recommendations(
     Tối ưu performance bằng cách tính similarity một lần
     
     - **user_ids**: Danh sách user IDs (trong request body)
-    - **method**: Phương pháp CF (user_based, tour_based, hybrid)
+    - **method**: Phương pháp CF (user_based, tour_based, hybrid, als)
     - **limit**: Số lượng gợi ý mỗi user (1-50)
     """
     if not user_ids or len(user_ids) == 0:
         raise HTTPException(status_code=400, detail="user_ids không được rỗng")
     
-    if len(user_ids) > 100:
-        raise HTTPException(status_code=400, detail="Tối đa 100 users mỗi lần")
+    if len(user_ids) > BATCH_MAX_USERS:
+        raise HTTPException(status_code=400, detail=f"Tối đa {BATCH_MAX_USERS} users mỗi lần")
     
-    # Tạo CF instance
-    cf = CollaborativeFiltering(
+    # Lấy CF model dùng chung (đọc database, chạy trên db_executor)
+    cf = await run_db(
+        model_registry.get_model,
         db, 
         normalize=True,
         handle_sparse=True,
@@ -145,8 +196,8 @@ async def get_batch_recommendations(
     )
     
     try:
-        # Batch processing
-        results = cf.batch_recommendations(user_ids, method, limit)
+        # Batch processing (từng chunk users chạy qua serve riêng)
+        results = await run_model(cf.serve_batch_recommendations, user_ids, method, limit)
         
         return {
             "success": True,
@@ -158,12 +209,11 @@ async def get_batch_recommendations(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/collaborative/cache/stats")
-async def get_cache_stats(db: Session = Depends(get_db)):
+async def get_cache_stats():
     """
-    Lấy thống kê về cache performance
+    Lấy thống kê về cache performance của các models dùng chung
     """
-    cf = CollaborativeFiltering(db)
-    stats = cf.get_cache_stats()
+    stats = await run_model(model_registry.get_cache_stats)
     
     return {
         "success": True,
@@ -171,13 +221,13 @@ async def get_cache_stats(db: Session = Depends(get_db)):
     }
 
 @router.post("/collaborative/cache/invalidate")
-async def invalidate_cache(db: Session = Depends(get_db)):
+async def invalidate_cache():
     """
     Invalidate cache (force rebuild)
     Sử dụng khi data thay đổi
     """
-    cf = CollaborativeFiltering(db)
-    cf.invalidate_cache()
+    model_registry.invalidate_all()
+    result_cache.clear()
     
     return {
         "success": True,
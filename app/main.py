@@ -2,7 +2,11 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from app.api import recommendations, interactions
+from app.services.model_registry import model_registry
+from app.services.popularity_index import popularity_index
+from app.utils.executors import run_db, run_model
 import os
+import warnings
 
 load_dotenv()
 
@@ -25,6 +29,25 @@ app.add_middleware(
 app.include_router(recommendations.router)
 app.include_router(interactions.router)
 
+@app.on_event("startup")
+async def load_model_snapshot():
+    # Load snapshot của model (nếu có) để phục vụ ngay, không cần quét database
+    await run_model(model_registry.load_snapshot)
+
+@app.on_event("startup")
+async def build_popularity_index():
+    # Tính sẵn bảng xếp hạng tours phổ biến / trending cho cold start và fallback
+    try:
+        await run_db(popularity_index.ensure_fresh)
+    except Exception as e:
+        warnings.warn(f"Lỗi khi build popularity index: {e}")
+    # Tính lại định kỳ trong thread nền (kể cả khi build lần đầu lỗi)
+    popularity_index.start_periodic_refresh()
+
+@app.on_event("shutdown")
+async def stop_popularity_index():
+    popularity_index.stop_periodic_refresh()
+
 @app.get("/")
 async def root():
     return {"message": "Recommend Server API"}
@@ -1,6 +1,6 @@
-from app.models.schema import UserProfile, Tour, UserTourInteraction
+from app.models.schema import UserProfile, Tour, UserTourInteraction, DataVersion
 
-__all__ = ["UserProfile", "Tour", "UserTourInteraction"]
+__all__ = ["UserProfile", "Tour", "UserTourInteraction", "DataVersion"]
 
 # Alias để tương thích với code cũ
 User = UserProfile
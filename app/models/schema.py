@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Boolean, Text
 from sqlalchemy.orm import relationship, foreign
 from datetime import datetime, timezone
 from app.utils.database import Base
@@ -89,3 +89,14 @@ class UserTourInteraction(Base):
         back_populates="interactions"
     )
 
+class DataVersion(Base):
+    """
+    Version của dữ liệu interactions (một hàng duy nhất, id = 1)
+    Tăng mỗi khi interactions được thêm / xóa, model registry chỉ cần đọc một hàng
+    theo primary key để biết model có cần build lại không
+    """
+    __tablename__ = "cf_data_version"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -1,5 +1,7 @@
 from app.services.collaborative_filtering import CollaborativeFiltering
+from app.services.model_registry import ModelRegistry, model_registry
+from app.services.neighbor_index import NeighborIndex
 from app.services.scoring import get_interaction_score, get_rating_score, BEHAVIOR_SCORES
 
-__all__ = ["CollaborativeFiltering", "get_interaction_score", "get_rating_score", "BEHAVIOR_SCORES"]
+__all__ = ["CollaborativeFiltering", "ModelRegistry", "model_registry", "NeighborIndex", "get_interaction_score", "get_rating_score", "BEHAVIOR_SCORES"]
 
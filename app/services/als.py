@@ -0,0 +1,229 @@
+"""
+Implicit-feedback Matrix Factorization (ALS) cho Collaborative Filtering
+Phân rã ma trận User-Tour thành user factors (N × F) và tour factors (M × F),
+điểm dự đoán của một user = một phép nhân vector với tour factors.
+Bộ nhớ tỉ lệ tuyến tính theo số users và tours thay vì N × N / M × M như similarity.
+
+Theo Hu, Koren & Volinsky (2008): preference p = 1 nếu rating > 0, ngược lại 0,
+confidence c = 1 + alpha · |rating|. Mỗi nửa vòng ALS giải
+(YᵀCᵤY + λI) xᵤ = YᵀCᵤpᵤ cho mọi hàng cùng lúc bằng vài bước Conjugate Gradient
+(warm start từ factors của vòng trước), không tạo ma trận F × F cho từng user.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+
+def _rowwise_dot(
+    weights: sp.csr_matrix,
+    targets: np.ndarray,
+    fixed: np.ndarray,
+    chunk_size: int
+) -> np.ndarray:
+    """
+    Với mỗi phần tử khác 0 (u, i) của weights, tính targets[u] · fixed[i]
+    (chia theo chunk để giới hạn bộ nhớ chunk_size × F)
+    """
+    rows = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+    dots = np.empty(weights.nnz, dtype=targets.dtype)
+    for start in range(0, weights.nnz, chunk_size):
+        stop = min(start + chunk_size, weights.nnz)
+        dots[start:stop] = np.einsum(
+            "ij,ij->i", targets[rows[start:stop]], fixed[weights.indices[start:stop]]
+        )
+    return dots
+
+
+def _conjugate_gradient_step(
+    targets: np.ndarray,
+    fixed: np.ndarray,
+    confidence: sp.csr_matrix,
+    preference_confidence: sp.csr_matrix,
+    regularization: float,
+    cg_steps: int,
+    chunk_size: int
+) -> np.ndarray:
+    """
+    Một nửa vòng ALS: cập nhật targets khi giữ cố định fixed
+
+    Args:
+        targets: Factors cần cập nhật (warm start)
+        fixed: Factors giữ cố định
+        confidence: Ma trận c - 1 = alpha · |rating| (cùng số hàng với targets)
+        preference_confidence: Ma trận c · p (chỉ các ô rating > 0)
+        regularization: λ
+        cg_steps: Số bước Conjugate Gradient
+        chunk_size: Số phần tử khác 0 xử lý mỗi lần khi tính dot theo hàng
+
+    Returns:
+        Factors đã cập nhật
+    """
+    gram = fixed.T @ fixed + regularization * np.eye(fixed.shape[1], dtype=fixed.dtype)
+
+    def apply_system(vectors: np.ndarray) -> np.ndarray:
+        # (YᵀY + λI) x + Yᵀ (Cᵤ - I) Y x cho mọi hàng
+        dots = _rowwise_dot(confidence, vectors, fixed, chunk_size)
+        weighted = sp.csr_matrix(
+            (confidence.data * dots, confidence.indices, confidence.indptr), shape=confidence.shape
+        )
+        return vectors @ gram + np.asarray(weighted @ fixed)
+
+    targets = targets.copy()
+    residuals = np.asarray(preference_confidence @ fixed) - apply_system(targets)
+    directions = residuals.copy()
+    residual_norms = np.einsum("ij,ij->i", residuals, residuals)
+
+    for _ in range(cg_steps):
+        system_directions = apply_system(directions)
+        curvature = np.einsum("ij,ij->i", directions, system_directions)
+        step = np.divide(
+            residual_norms, curvature, out=np.zeros_like(residual_norms), where=curvature > 1e-12
+        )
+        targets += step[:, None] * directions
+        residuals -= step[:, None] * system_directions
+
+        new_residual_norms = np.einsum("ij,ij->i", residuals, residuals)
+        beta = np.divide(
+            new_residual_norms, residual_norms,
+            out=np.zeros_like(residual_norms), where=residual_norms > 1e-12
+        )
+        directions = residuals + beta[:, None] * directions
+        residual_norms = new_residual_norms
+
+    return targets
+
+
+class ALSModel:
+    """
+    User factors và tour factors đã train bằng implicit ALS
+
+    - scores(user_idx): điểm dự đoán cho mọi tours = user_factors[u] · tour_factorsᵀ
+    - Factors lưu float32, bộ nhớ (N + M) × F
+    """
+
+    def __init__(self, user_factors: np.ndarray, tour_factors: np.ndarray, regularization: float, alpha: float):
+        self.user_factors = user_factors
+        self.tour_factors = tour_factors
+        self.regularization = regularization
+        self.alpha = alpha
+        # YᵀY + λI của tour factors, tính một lần cho mọi lần fold-in
+        self._tour_gram = None
+
+    @property
+    def n_factors(self) -> int:
+        return self.user_factors.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.user_factors.nbytes + self.tour_factors.nbytes
+
+    @classmethod
+    def fit(
+        cls,
+        ratings: sp.csr_matrix,
+        n_factors: int = 32,
+        regularization: float = 0.1,
+        alpha: float = 5.0,
+        n_iter: int = 15,
+        cg_steps: int = 3,
+        chunk_size: int = 1 << 16,
+        seed: int = 42
+    ) -> "ALSModel":
+        """
+        Train implicit ALS trên ma trận ratings (User × Tour)
+
+        Args:
+            ratings: Ma trận ratings (đã time decay), rating > 0 là thích, < 0 là không thích
+            n_factors: Số latent factors F
+            regularization: Hệ số regularization λ
+            alpha: Hệ số confidence, c = 1 + alpha · |rating|
+            n_iter: Số vòng ALS (mỗi vòng cập nhật users rồi tours)
+            cg_steps: Số bước Conjugate Gradient mỗi nửa vòng
+            chunk_size: Số phần tử khác 0 xử lý mỗi lần (giới hạn bộ nhớ chunk_size × F)
+            seed: Random seed khởi tạo factors
+
+        Returns:
+            ALSModel
+        """
+        confidence, preference_confidence = cls._confidence_matrices(ratings, alpha)
+        confidence_t = confidence.T.tocsr()
+        preference_confidence_t = preference_confidence.T.tocsr()
+
+        n_users, n_tours = ratings.shape
+        rng = np.random.default_rng(seed)
+        user_factors = (rng.standard_normal((n_users, n_factors)) * 0.01).astype(np.float32)
+        tour_factors = (rng.standard_normal((n_tours, n_factors)) * 0.01).astype(np.float32)
+
+        for _ in range(n_iter):
+            user_factors = _conjugate_gradient_step(
+                user_factors, tour_factors, confidence, preference_confidence,
+                regularization, cg_steps, chunk_size
+            )
+            tour_factors = _conjugate_gradient_step(
+                tour_factors, user_factors, confidence_t, preference_confidence_t,
+                regularization, cg_steps, chunk_size
+            )
+
+        return cls(user_factors, tour_factors, regularization, alpha)
+
+    @staticmethod
+    def _confidence_matrices(ratings: sp.csr_matrix, alpha: float):
+        """
+        Tạo ma trận (c - 1) và c · p từ ratings (float32, bỏ các ô 0)
+
+        Returns:
+            (confidence, preference_confidence)
+        """
+        ratings = sp.csr_matrix(ratings, dtype=np.float32)
+        ratings.eliminate_zeros()
+
+        confidence = ratings.copy()
+        confidence.data = alpha * np.abs(confidence.data)
+
+        preference_confidence = ratings.copy()
+        preference_confidence.data = np.where(
+            ratings.data > 0, 1 + confidence.data, 0
+        ).astype(np.float32)
+        preference_confidence.eliminate_zeros()
+        return confidence, preference_confidence
+
+    def scores(self, user_idx: int) -> np.ndarray:
+        """Điểm dự đoán của một user cho mọi tours (một phép nhân vector-ma trận)"""
+        return self.tour_factors @ self.user_factors[user_idx]
+
+    def fold_in(self, user_idx: int, tours_idx: np.ndarray, ratings: np.ndarray) -> np.ndarray:
+        """
+        Giải lại latent vector của một user với tour factors giữ cố định
+        (một hệ F × F: (YᵀCᵤY + λI) xᵤ = YᵀCᵤpᵤ), không cần train lại toàn bộ
+
+        Args:
+            user_idx: Index của user
+            tours_idx: Index các tours user đã tương tác
+            ratings: Ratings tương ứng (đã time decay)
+
+        Returns:
+            Latent vector mới của user (đã ghi vào user_factors)
+        """
+        if self._tour_gram is None:
+            tour_factors = self.tour_factors.astype(np.float64)
+            self._tour_gram = tour_factors.T @ tour_factors + self.regularization * np.eye(self.n_factors)
+
+        factors = self.tour_factors[tours_idx].astype(np.float64)
+        confidence = self.alpha * np.abs(ratings)
+        positive = ratings > 0
+
+        system = self._tour_gram + factors.T @ (confidence[:, None] * factors)
+        target = factors[positive].T @ (1 + confidence[positive])
+        self.user_factors[user_idx] = np.linalg.solve(system, target)
+        return self.user_factors[user_idx]
+
+    def add_users(self, n_new_users: int):
+        """Thêm users mới với factors 0 (điểm 0 cho mọi tours đến lần train sau)"""
+        self.user_factors = np.vstack([
+            self.user_factors, np.zeros((n_new_users, self.n_factors), dtype=self.user_factors.dtype)
+        ])
+
+    def add_tours(self, n_new_tours: int):
+        """Thêm tours mới với factors 0 (không làm thay đổi YᵀY đã cache)"""
+        self.tour_factors = np.vstack([
+            self.tour_factors, np.zeros((n_new_tours, self.n_factors), dtype=self.tour_factors.dtype)
+        ])
@@ -0,0 +1,204 @@
+"""
+Approximate Nearest Neighbour (IVF) cho User Similarity
+Chia users thành các cụm (spherical k-means trên vectors đã chuẩn hoá),
+khi tìm láng giềng chỉ tính cosine với users trong n_probe cụm gần nhất
+thay vì toàn bộ N users
+"""
+import numpy as np
+import scipy.sparse as sp
+from typing import List, Optional, Tuple
+from app.services.neighbor_index import Vectors, cosine_similarity_rows
+
+
+def _normalize_rows(vectors: Vectors, norms: np.ndarray) -> Vectors:
+    """Chia mỗi hàng cho L2 norm của nó (hàng 0 giữ nguyên)"""
+    inverse_norms = np.divide(1.0, norms, out=np.zeros(len(norms)), where=norms > 0)
+    if sp.issparse(vectors):
+        return sp.diags(inverse_norms) @ vectors
+    return vectors * inverse_norms[:, None]
+
+
+class IVFIndex:
+    """
+    Inverted File Index cho cosine similarity
+
+    - Build: spherical k-means với n_lists centroids, mỗi hàng thuộc cụm có centroid gần nhất
+    - Search: chọn n_probe cụm gần query nhất, tính cosine chính xác với các hàng trong đó
+
+    n_probe càng lớn thì recall càng cao nhưng chậm hơn (n_probe = n_lists là tìm chính xác).
+    Index chỉ lưu centroids và danh sách hàng của mỗi cụm, vectors được đọc từ ma trận gốc.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray, n_probe: int = 8):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.n_probe = n_probe
+        self._lists: List[np.ndarray] = [
+            np.flatnonzero(assignments == list_idx) for list_idx in range(len(centroids))
+        ]
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes + self.assignments.nbytes
+
+    @classmethod
+    def build(
+        cls,
+        vectors: Vectors,
+        norms: np.ndarray,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        n_iter: int = 10,
+        block_size: int = 4096,
+        seed: int = 42
+    ) -> "IVFIndex":
+        """
+        Build index bằng spherical k-means
+
+        Args:
+            vectors: Ma trận vectors (N × D), mỗi hàng là một user
+            norms: L2 norms của từng hàng
+            n_lists: Số cụm (default: sqrt(N))
+            n_probe: Số cụm được quét mỗi lần search
+            n_iter: Số vòng lặp k-means
+            block_size: Số hàng gán cụm mỗi lần (giới hạn bộ nhớ block_size × n_lists)
+            seed: Random seed để chọn centroids ban đầu
+
+        Returns:
+            IVFIndex
+        """
+        n_rows = vectors.shape[0]
+        normalized = _normalize_rows(vectors, norms)
+        nonzero_rows = np.flatnonzero(norms > 0)
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(nonzero_rows)))
+        n_lists = max(1, min(n_lists, len(nonzero_rows)))
+
+        if len(nonzero_rows) == 0:
+            centroids = np.zeros((1, vectors.shape[1]))
+            return cls(centroids, np.full(n_rows, -1, dtype=np.int32), n_probe)
+
+        rng = np.random.default_rng(seed)
+        initial_rows = rng.choice(nonzero_rows, size=n_lists, replace=False)
+        centroids = cls._dense_rows(normalized, initial_rows)
+
+        assignments = np.zeros(n_rows, dtype=np.int32)
+        for _ in range(n_iter):
+            assignments = cls._assign(normalized, centroids, block_size)
+
+            # Centroid mới = tổng các vectors trong cụm, chuẩn hoá lại (cụm rỗng giữ centroid cũ)
+            membership = sp.csr_matrix(
+                (np.ones(len(nonzero_rows)), (assignments[nonzero_rows], nonzero_rows)),
+                shape=(n_lists, n_rows)
+            )
+            sums = membership @ normalized
+            sums = sums.toarray() if sp.issparse(sums) else np.asarray(sums)
+            sum_norms = np.linalg.norm(sums, axis=1)
+            non_empty = sum_norms > 0
+            centroids[non_empty] = sums[non_empty] / sum_norms[non_empty, None]
+
+        assignments = cls._assign(normalized, centroids, block_size)
+        # Hàng 0 có cosine 0 với mọi hàng, không đưa vào cụm nào
+        assignments[norms == 0] = -1
+        return cls(centroids, assignments, n_probe)
+
+    @staticmethod
+    def _dense_rows(vectors: Vectors, rows: np.ndarray) -> np.ndarray:
+        selected = vectors[rows]
+        return selected.toarray() if sp.issparse(selected) else np.array(selected, dtype=np.float64)
+
+    @staticmethod
+    def _assign(normalized: Vectors, centroids: np.ndarray, block_size: int) -> np.ndarray:
+        """Gán mỗi hàng (đã chuẩn hoá) vào cụm có centroid gần nhất theo cosine"""
+        n_rows = normalized.shape[0]
+        assignments = np.empty(n_rows, dtype=np.int32)
+        for start in range(0, n_rows, block_size):
+            stop = min(start + block_size, n_rows)
+            similarities = np.asarray(normalized[start:stop] @ centroids.T)
+            assignments[start:stop] = np.argmax(similarities, axis=1)
+        return assignments
+
+    def search(
+        self,
+        vectors: Vectors,
+        norms: np.ndarray,
+        row_idx: int,
+        k: int,
+        n_probe: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tìm K hàng tương tự nhất với một hàng (không gồm chính nó)
+
+        Args:
+            vectors: Ma trận vectors hiện tại (cùng ma trận đã build index)
+            norms: L2 norms của từng hàng
+            row_idx: Index của hàng query
+            k: Số láng giềng cần tìm
+            n_probe: Số cụm cần quét (default: self.n_probe)
+
+        Returns:
+            (indices, similarities), sắp xếp theo similarity giảm dần
+        """
+        if norms[row_idx] == 0 or k <= 0:
+            return np.array([], dtype=np.int64), np.array([])
+
+        query = vectors[row_idx]
+        query_dense = query.toarray().ravel() if sp.issparse(query) else np.asarray(query).ravel()
+
+        # Chọn n_probe cụm có centroid gần query nhất
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        centroid_similarities = self.centroids @ query_dense
+        probe_lists = np.argpartition(-centroid_similarities, n_probe - 1)[:n_probe]
+
+        candidates = np.concatenate([self._lists[list_idx] for list_idx in probe_lists])
+        candidates = candidates[(candidates != row_idx) & (norms[candidates] > 0)]
+        if len(candidates) == 0:
+            return np.array([], dtype=np.int64), np.array([])
+
+        similarities = cosine_similarity_rows(
+            vectors[[row_idx]], vectors[candidates], norms[[row_idx]], norms[candidates]
+        ).ravel()
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return candidates[top].astype(np.int64), similarities[top]
+
+    def add_rows(self, n_new_rows: int):
+        """Thêm các hàng mới (vector 0, chưa thuộc cụm nào được quét)"""
+        self.assignments = np.append(self.assignments, np.full(n_new_rows, -1, dtype=np.int32))
+
+    def add_columns(self, n_new_columns: int):
+        """Thêm chiều mới cho centroids (cột của tours mới, giá trị 0 ở mọi centroid)"""
+        self.centroids = np.hstack([
+            self.centroids, np.zeros((self.centroids.shape[0], n_new_columns), dtype=self.centroids.dtype)
+        ])
+
+    def update(self, vectors: Vectors, norms: np.ndarray, rows: np.ndarray):
+        """
+        Gán lại cụm cho các hàng đã thay đổi (centroids giữ nguyên đến lần build sau)
+
+        Args:
+            vectors: Ma trận vectors sau khi thay đổi
+            norms: L2 norms đã cập nhật
+            rows: Index các hàng đã thay đổi
+        """
+        if len(rows) == 0:
+            return
+
+        normalized = _normalize_rows(vectors[rows], norms[rows])
+        new_assignments = self._assign(normalized, self.centroids, len(rows))
+        new_assignments[norms[rows] == 0] = -1
+
+        changed = new_assignments != self.assignments[rows]
+        for row_idx, old_list, new_list in zip(rows[changed], self.assignments[rows][changed], new_assignments[changed]):
+            if old_list >= 0:
+                self._lists[old_list] = self._lists[old_list][self._lists[old_list] != row_idx]
+            if new_list >= 0:
+                self._lists[new_list] = np.append(self._lists[new_list], row_idx)
+        self.assignments[rows] = new_assignments
@@ -0,0 +1,609 @@
+"""
+Tính recommendations theo batch cho Collaborative Filtering
+Điểm của cả batch users được tính bằng phép nhân ma trận (B × M) thay vì từng user,
+và materialize top-N của mọi users vào RecommendationStore.
+Hậu xử lý (hybrid, diversity, explanation) dùng chung với recommendations từ store
+qua _finalize_method.
+"""
+import warnings
+import numpy as np
+import scipy.sparse as sp
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.services.recommendation_store import (
+    RecommendationStore, PRECOMPUTED_METHODS, PRECOMPUTED_TOP_N
+)
+
+# Tên method ghi vào kết quả recommendations
+METHOD_LABELS = {
+    "user_based": "user_based_cf",
+    "tour_based": "tour_based_cf",
+    "hybrid": "hybrid_cf",
+    "als": "als_mf",
+}
+
+# Hybrid kết hợp danh sách của các methods thành phần (mỗi danh sách lấy 2N tours)
+HYBRID_COMPONENTS = ("user_based", "tour_based")
+
+
+class BatchScoringMixin:
+    """
+    batch_recommendations, materialize_recommendations và precomputed_recommendations
+    của CollaborativeFiltering (dùng state và scoring helpers của CollaborativeFiltering)
+    """
+
+    def serve_batch_recommendations(
+        self,
+        user_ids: List[int],
+        method: str = "hybrid",
+        n_recommendations: int = 10
+    ) -> Dict[int, List[Dict]]:
+        """
+        batch_recommendations qua serve theo từng chunk batch_size users,
+        giữa các chunks writers (apply_interaction) được chạy
+
+        Args:
+            user_ids: Danh sách user IDs
+            method: Phương pháp CF
+            n_recommendations: Số lượng recommendations mỗi user
+
+        Returns:
+            Dictionary: {user_id: [recommendations]}
+        """
+        results = {}
+        for i in range(0, len(user_ids), self.batch_size):
+            chunk = user_ids[i:i + self.batch_size]
+            results.update(self.serve(
+                (method,), chunk, self.batch_recommendations, chunk, method, n_recommendations
+            ))
+        return results
+
+
+    @staticmethod
+    def _select_top_indices_rows(scores: np.ndarray, top_n: int) -> np.ndarray:
+        """
+        Giống _select_top_indices cho từng hàng của ma trận điểm (B × M)
+        bằng một lần argpartition theo axis 1
+        
+        Returns:
+            Ma trận B × top_n index, mỗi hàng sắp xếp theo điểm giảm dần
+        """
+        top_n = min(top_n, scores.shape[1])
+        if top_n <= 0:
+            return np.zeros((scores.shape[0], 0), dtype=np.int64)
+        
+        top_indices = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        order = np.argsort(-np.take_along_axis(scores, top_indices, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(top_indices, order, axis=1)
+    
+    def batch_recommendations(
+        self,
+        user_ids: List[int],
+        method: str = "hybrid",
+        n_recommendations: int = 10
+    ) -> Dict[int, List[Dict]]:
+        """
+        Batch processing: Tính recommendations cho nhiều users cùng lúc
+        
+        Mỗi batch (batch_size users) tính điểm cho mọi users bằng một phép nhân ma trận
+        với similarity / factors, lấy top tours của từng hàng bằng argpartition theo axis 1
+        và hydrate tours một lần cho các tours xuất hiện trong batch.
+        Chỉ diversity và explanations còn chạy theo từng user.
+        
+        Args:
+            user_ids: Danh sách user IDs
+            method: Phương pháp CF (user_based, tour_based, hybrid, als)
+            n_recommendations: Số lượng recommendations mỗi user
+            
+        Returns:
+            Dictionary: {user_id: [recommendations]}
+        """
+        # Đảm bảo matrix và similarities đã được tính
+        if self.user_tour_matrix is None:
+            self.build_user_tour_matrix()
+        
+        if method in ["user_based", "hybrid"]:
+            self._ensure_user_similarity()
+        
+        if method in ["tour_based", "hybrid"]:
+            self._ensure_tour_similarity()
+        
+        if method == "als":
+            self.train_als()
+        
+        # User không có trong model (hoặc chưa train ALS) nhận danh sách rỗng như single-user path
+        results = {user_id: [] for user_id in user_ids}
+        if not self.user_ids or (method == "als" and self.als_model is None):
+            return results
+        known_user_ids = [user_id for user_id in results if user_id in self.user_id_to_idx]
+        
+        # Chia users thành batches
+        for i in range(0, len(known_user_ids), self.batch_size):
+            batch_user_ids = known_user_ids[i:i + self.batch_size]
+            user_indices = np.array([self.user_id_to_idx[user_id] for user_id in batch_user_ids], dtype=np.int64)
+            
+            try:
+                batch_results = self._batch_recommend(method, batch_user_ids, user_indices, n_recommendations)
+            except Exception as e:
+                warnings.warn(f"Lỗi khi tính recommendations cho batch users {batch_user_ids}: {e}")
+                continue
+            results.update(zip(batch_user_ids, batch_results))
+        
+        return results
+    
+    def _batch_recommend(
+        self,
+        method: str,
+        user_ids: List[int],
+        user_indices: np.ndarray,
+        n_recommendations: int
+    ) -> List[List[Dict]]:
+        """Recommendations cho một batch users (kết quả giống gọi method cho từng user)"""
+        # Hybrid: mỗi danh sách con lấy 2N tours (từ 4N ứng viên) giống hybrid_recommendations
+        component_methods = HYBRID_COMPONENTS if method == "hybrid" else (method,)
+        n_candidates = n_recommendations * (4 if method == "hybrid" else 2)
+        candidates = {
+            component: self._batch_candidates(
+                user_ids, user_indices, self._batch_scores(component, user_indices),
+                n_candidates, METHOD_LABELS[component], denormalize=component != "als"
+            )
+            for component in component_methods
+        }
+        return [
+            self._finalize_method(
+                method, user_id,
+                {component: component_candidates[row] for component, component_candidates in candidates.items()},
+                n_recommendations
+            )
+            for row, user_id in enumerate(user_ids)
+        ]
+    
+    def _batch_scores(self, method: str, user_indices: np.ndarray) -> np.ndarray:
+        """Điểm dự đoán của một batch users cho method user_based, tour_based hoặc als"""
+        if method == "user_based":
+            return self._batch_user_based_scores(user_indices, 5)
+        if method == "tour_based":
+            return self._batch_tour_based_scores(user_indices)
+        return self._batch_als_scores(user_indices)
+    
+    def _finalize_method(
+        self,
+        method: str,
+        user_id: int,
+        candidates: Dict[str, List[Dict]],
+        n_recommendations: int
+    ) -> List[Dict]:
+        """
+        Các bước sau khi tính điểm giống live path: diversity, kết hợp hybrid, explanations
+        
+        Args:
+            method: Phương pháp CF
+            user_id: ID của user
+            candidates: Ứng viên đã sắp xếp theo điểm của từng method thành phần
+                (hybrid: user_based và tour_based, 4N mỗi method; còn lại: chính method, 2N)
+            n_recommendations: Số lượng recommendations
+        """
+        if method != "hybrid":
+            return self._finalize_recommendations(candidates[method], user_id, n_recommendations)
+        
+        n_candidates = n_recommendations * 2
+        user_based, tour_based = (
+            self._finalize_recommendations(candidates[component], user_id, n_candidates, explain=False)
+            for component in HYBRID_COMPONENTS
+        )
+        return self._finalize_recommendations(
+            self._combine_hybrid(user_based, tour_based, 0.5), user_id, n_recommendations
+        )
+    
+    def _batch_candidates(
+        self,
+        user_ids: List[int],
+        user_indices: np.ndarray,
+        predicted_scores: np.ndarray,
+        n_candidates: int,
+        method: str,
+        denormalize: bool = True
+    ) -> List[List[Dict]]:
+        """
+        Giống _build_recommendations (trước bước diversity/explanations) cho cả batch:
+        top n_candidates (2N) tours điểm dương của mỗi hàng, tours được hydrate một lần cho cả batch
+        
+        Returns:
+            Danh sách ứng viên của từng user
+        """
+        top_tours_idx = self._select_top_indices_rows(predicted_scores, n_candidates)
+        top_scores = np.take_along_axis(predicted_scores, top_tours_idx, axis=1)
+        
+        # Denormalize score nếu đã normalize
+        if self.normalize and denormalize and self.user_means is not None:
+            final_scores = top_scores + np.asarray(self.user_means)[user_indices][:, None]
+        else:
+            final_scores = top_scores
+        
+        tours = {
+            tour_idx: self._get_available_tour(self.tour_ids[tour_idx])
+            for tour_idx in np.unique(top_tours_idx[top_scores > 0]).tolist()
+        }
+        
+        candidates = []
+        for row in range(len(user_ids)):
+            recommendations = []
+            for tour_idx, score, final_score in zip(
+                top_tours_idx[row].tolist(), top_scores[row].tolist(), final_scores[row].tolist()
+            ):
+                tour = tours.get(tour_idx) if score > 0 else None
+                if tour:
+                    recommendations.append({
+                        "tour_id": tour["id"],
+                        "tour_title": tour["title"],
+                        "tour_slug": tour["slug"],
+                        "predicted_score": final_score,
+                        "method": method
+                    })
+            candidates.append(recommendations)
+        return candidates
+    
+    def _batch_user_based_scores(self, user_indices: np.ndarray, n_similar_users: int) -> np.ndarray:
+        """
+        _user_based_scores cho một batch users: điểm = W · R / sum(W) với W (B × N)
+        chứa similarities của top-k users tương tự của từng user
+        
+        Returns:
+            Ma trận điểm B × M (0 cho tours user đã tương tác)
+        """
+        neighbors_idx, neighbors_sim = self._batch_top_similar_users(user_indices, n_similar_users)
+        n_batch, n_users = len(user_indices), len(self.user_ids)
+        
+        valid = neighbors_idx >= 0
+        weights = sp.csr_matrix(
+            (neighbors_sim[valid], (np.nonzero(valid)[0], neighbors_idx[valid])),
+            shape=(n_batch, n_users)
+        )
+        weighted_sums = weights @ self.user_tour_matrix
+        if sp.issparse(weighted_sums):
+            weighted_sums = weighted_sums.toarray()
+        weighted_sums = np.asarray(weighted_sums, dtype=np.float64)
+        
+        user_ratings = self._get_rows(self.user_tour_matrix, user_indices)
+        candidate_mask = user_ratings == 0
+        similarity_sums = np.where(valid, neighbors_sim, 0).sum(axis=1)
+        
+        predicted_scores = np.zeros((n_batch, len(self.tour_ids)))
+        has_similarity = similarity_sums > 0
+        predicted_scores[has_similarity] = np.where(
+            candidate_mask[has_similarity],
+            weighted_sums[has_similarity] / similarity_sums[has_similarity][:, None],
+            0
+        )
+        
+        # Fallback: Co-occurrence cho users không có similarity
+        fallback_rows = np.flatnonzero(~has_similarity)
+        if len(fallback_rows) > 0:
+            co_occurrence_scores, n_raw_interacted = self._batch_co_occurrence_scores(
+                user_indices[fallback_rows], candidate_mask[fallback_rows]
+            )
+            for position, row in enumerate(fallback_rows):
+                if n_raw_interacted[position] > 0:
+                    candidates = candidate_mask[row]
+                    predicted_scores[row, candidates] = co_occurrence_scores[position, candidates] / n_raw_interacted[position]
+        
+        return predicted_scores
+    
+    def _batch_top_similar_users(self, user_indices: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        _get_top_similar_users cho một batch users
+        
+        Returns:
+            (indices, similarities) dạng B × top_n, ô trống có index -1
+        """
+        n_batch = len(user_indices)
+        
+        if self.user_ann_index is not None:
+            neighbors_idx = np.full((n_batch, top_n), -1, dtype=np.int64)
+            neighbors_sim = np.zeros((n_batch, top_n))
+            for row, user_idx in enumerate(user_indices.tolist()):
+                indices, similarities = self._get_top_similar_users(user_idx, top_n)
+                neighbors_idx[row, :len(indices)] = indices
+                neighbors_sim[row, :len(similarities)] = similarities
+            return neighbors_idx, neighbors_sim
+        
+        if self.user_neighbors is not None:
+            neighbors_idx = np.asarray(self.user_neighbors.indices[user_indices, :top_n], dtype=np.int64)
+            neighbors_sim = np.asarray(self.user_neighbors.scores[user_indices, :top_n], dtype=np.float64)
+            return neighbors_idx, np.where(neighbors_idx >= 0, neighbors_sim, 0)
+        
+        similarities = np.array(self.user_similarity[user_indices], dtype=np.float64)
+        similarities[np.arange(n_batch), user_indices] = -np.inf
+        
+        top_n = min(top_n, similarities.shape[1] - 1)
+        if top_n <= 0:
+            return np.zeros((n_batch, 0), dtype=np.int64), np.zeros((n_batch, 0))
+        
+        top_indices = self._select_top_indices_rows(similarities, top_n)
+        return top_indices, np.take_along_axis(similarities, top_indices, axis=1)
+    
+    def _batch_tour_based_scores(self, user_indices: np.ndarray) -> np.ndarray:
+        """
+        _tour_based_scores cho một batch users:
+        similarity sums = I · Sᵀ, weighted sums = (R ∘ I) · Sᵀ với I là mask tours đã tương tác
+        
+        Returns:
+            Ma trận điểm B × M (0 cho tours user đã tương tác)
+        """
+        user_ratings = self._get_rows(self.user_tour_matrix, user_indices)
+        interacted = user_ratings > 0
+        n_interacted = interacted.sum(axis=1)
+        candidate_mask = user_ratings == 0
+        interacted_ratings = np.where(interacted, user_ratings, 0)
+        
+        if self.tour_neighbors is not None:
+            # Ma trận thưa M × M (Sᵀ): cột i chứa similarity của các láng giềng của tour i
+            neighbors_idx = np.asarray(self.tour_neighbors.indices, dtype=np.int64)
+            valid = neighbors_idx >= 0
+            similarity_t = sp.csr_matrix(
+                (np.asarray(self.tour_neighbors.scores, dtype=np.float64)[valid],
+                 (neighbors_idx[valid], np.nonzero(valid)[0])),
+                shape=(len(self.tour_ids), len(self.tour_ids))
+            )
+            similarity_sums = np.asarray(similarity_t @ interacted.T.astype(np.float64)).T
+            weighted_sums = np.asarray(similarity_t @ interacted_ratings.T).T
+        else:
+            similarity = np.asarray(self.tour_similarity, dtype=np.float64)
+            similarity_sums = interacted.astype(np.float64) @ similarity.T
+            weighted_sums = interacted_ratings @ similarity.T
+        
+        has_similarity = candidate_mask & (similarity_sums > 0) & (n_interacted > 0)[:, None]
+        predicted_scores = np.zeros(user_ratings.shape)
+        predicted_scores[has_similarity] = weighted_sums[has_similarity] / similarity_sums[has_similarity]
+        
+        # Fallback: Co-occurrence cho các tours có similarity = 0
+        fallback_mask = candidate_mask & (similarity_sums <= 0) & (n_interacted > 0)[:, None]
+        fallback_rows = np.flatnonzero(fallback_mask.any(axis=1))
+        if len(fallback_rows) > 0:
+            fallback = fallback_mask[fallback_rows]
+            co_occurrence_scores, _ = self._batch_co_occurrence_scores(user_indices[fallback_rows], fallback)
+            predicted_rows = predicted_scores[fallback_rows]
+            predicted_rows[fallback] = (co_occurrence_scores / n_interacted[fallback_rows][:, None])[fallback]
+            predicted_scores[fallback_rows] = predicted_rows
+        
+        return predicted_scores
+    
+    def _batch_co_occurrence_scores(
+        self,
+        user_indices: np.ndarray,
+        candidate_mask: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        _co_occurrence_scores cho một batch users
+        
+        Với tour ứng viên user chưa tương tác, đóng góp của chính user bằng 0 nên điểm
+        = I · Q (I: mask tours đã tương tác, Q = positive ∘ [sum > 0] không phụ thuộc user).
+        Chỉ các tours ứng viên user đã có rating (raw ≠ 0) được tính lại theo từng cặp.
+        
+        Args:
+            user_indices: Index các users
+            candidate_mask: Mask B × M các tours ứng viên (điểm ngoài mask không dùng được)
+        
+        Returns:
+            (ma trận điểm B × M, số tours mỗi user đã tương tác theo raw matrix)
+        """
+        raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
+        if self.tour_cooccurrence_positive is None:
+            self._build_tour_cooccurrence(raw_matrix)
+        
+        raw_rows = np.asarray(self._get_rows(raw_matrix, user_indices), dtype=np.float64)
+        interacted = raw_rows > 0
+        n_raw_interacted = interacted.sum(axis=1)
+        
+        scores = np.asarray(
+            (sp.csr_matrix(interacted, dtype=np.float64) @ self._cooccurrence_contributions()).todense()
+        )
+        
+        # Tours có rating của user: mỗi (user, tour c) ghép với mọi tour i user đã tương tác
+        own_rows, own_tours = np.nonzero((raw_rows != 0) & candidate_mask)
+        if len(own_rows) == 0:
+            return scores, n_raw_interacted
+        
+        interacted_tours = np.nonzero(interacted)[1]
+        interacted_starts = np.concatenate([[0], np.cumsum(n_raw_interacted)[:-1]])
+        pair_counts = n_raw_interacted[own_rows]
+        pair_owner = np.repeat(np.arange(len(own_rows)), pair_counts)
+        pair_offsets = np.arange(len(pair_owner)) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+        pair_tours = interacted_tours[np.repeat(interacted_starts[own_rows], pair_counts) + pair_offsets]
+        pair_columns = own_tours[pair_owner]
+        
+        own_ratings = raw_rows[own_rows, own_tours][pair_owner]
+        positive_sums = np.asarray(self.tour_cooccurrence_positive[pair_tours, pair_columns]).ravel() - np.maximum(own_ratings, 0)
+        rating_sums = np.asarray(self.tour_cooccurrence_sum[pair_tours, pair_columns]).ravel() - own_ratings
+        scores[own_rows, own_tours] = np.bincount(
+            pair_owner, weights=np.where(rating_sums > 0, positive_sums, 0), minlength=len(own_rows)
+        )
+        return scores, n_raw_interacted
+    
+    def _cooccurrence_contributions(self) -> sp.csr_matrix:
+        """
+        Q = positive ∘ [sum > 0] của các ma trận co-occurrence hiện tại
+        (cache đến khi ma trận co-occurrence được build lại hoặc cập nhật incremental)
+        """
+        cached = self._cooccurrence_contributions_cache
+        if (
+            cached is None
+            or cached[0] is not self.tour_cooccurrence_positive
+            or cached[1] is not self.tour_cooccurrence_sum
+        ):
+            contributions = sp.csr_matrix(
+                self.tour_cooccurrence_positive.multiply(self.tour_cooccurrence_sum > 0)
+            )
+            cached = (self.tour_cooccurrence_positive, self.tour_cooccurrence_sum, contributions)
+            self._cooccurrence_contributions_cache = cached
+        return cached[2]
+    
+    def _batch_als_scores(self, user_indices: np.ndarray) -> np.ndarray:
+        """
+        _als_scores cho một batch users: một phép nhân (B × F) · (F × M)
+        
+        Returns:
+            Ma trận điểm B × M (0 cho tours user đã tương tác)
+        """
+        for user_idx in self._als_stale_users.intersection(user_indices.tolist()):
+            self._fold_in_user(user_idx)
+        
+        predicted_scores = (
+            self.als_model.user_factors[user_indices] @ self.als_model.tour_factors.T
+        ).astype(np.float64)
+        raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
+        predicted_scores[self._get_rows(raw_matrix, user_indices) != 0] = 0
+        return predicted_scores
+    
+    def materialize_recommendations(
+        self,
+        methods: Tuple[str, ...] = PRECOMPUTED_METHODS,
+        top_n: int = PRECOMPUTED_TOP_N
+    ) -> RecommendationStore:
+        """
+        Tính trước top N ứng viên cho mọi users với từng method (chạy sau mỗi lần build model)
+        
+        Ứng viên được tính bằng batch path (_batch_scores, _batch_candidates), lưu điểm
+        đã denormalize trước bước diversity/explanations; precomputed_recommendations chạy
+        các bước còn lại giống live path (_finalize_method) nên kết quả giống live.
+        Hybrid không có hàng riêng: kết hợp từ ứng viên của user_based và tour_based.
+        Không gọi trong serve: mỗi chunk batch_size users chạy qua serve riêng,
+        writers không phải đợi cả job. Users được thêm trong lúc tính không có trong store.
+        
+        Args:
+            methods: Các methods cần tính trước
+            top_n: Số tours lưu cho mỗi user
+            
+        Returns:
+            RecommendationStore (chưa ghi ra disk)
+        """
+        if not self._matrix_built:
+            with self.rw_lock.write():
+                if not self._matrix_built:
+                    self.build_user_tour_matrix()
+        
+        with self.rw_lock.read():
+            user_ids = list(self.user_ids or [])
+            meta = {
+                "top_n": top_n,
+                "matrix_hash": self._matrix_hash,
+                "built_at": self._last_matrix_build_time.isoformat() if self._last_matrix_build_time else None,
+            }
+        n_users = len(user_ids)
+        
+        stored_methods = {
+            method: (
+                np.full((n_users, top_n), -1, dtype=np.int64),
+                np.zeros((n_users, top_n), dtype=np.float64)
+            )
+            for method in self._stored_methods(methods)
+        }
+        for start in range(0, n_users, self.batch_size):
+            chunk = user_ids[start:start + self.batch_size]
+            chunk_results = self.serve(methods, chunk, self._materialize_chunk, methods, chunk, top_n)
+            for method, (chunk_tour_ids, chunk_scores) in chunk_results.items():
+                stored_methods[method][0][start:start + len(chunk)] = chunk_tour_ids
+                stored_methods[method][1][start:start + len(chunk)] = chunk_scores
+        
+        return RecommendationStore(np.array(user_ids, dtype=np.int64), stored_methods, meta)
+    
+    @staticmethod
+    def _stored_methods(methods: Sequence[str]) -> List[str]:
+        """Methods có hàng riêng trong store (hybrid thay bằng các methods thành phần)"""
+        stored = []
+        for method in methods:
+            for component in (HYBRID_COMPONENTS if method == "hybrid" else (method,)):
+                if component not in stored:
+                    stored.append(component)
+        return stored
+    
+    def _materialize_chunk(
+        self,
+        methods: Sequence[str],
+        user_ids: List[int],
+        top_n: int
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Top N ứng viên của một chunk users cho từng method trong store (chạy trong serve)
+        
+        Returns:
+            {method: (tour IDs, scores)} mỗi array có shape (len(user_ids), top_n), -1 / 0 ở ô trống
+        """
+        user_indices = np.array([self.user_id_to_idx[user_id] for user_id in user_ids], dtype=np.int64)
+        results = {}
+        for method in self._stored_methods(methods):
+            method_tour_ids = np.full((len(user_ids), top_n), -1, dtype=np.int64)
+            method_scores = np.zeros((len(user_ids), top_n), dtype=np.float64)
+            
+            candidates = self._batch_candidates(
+                user_ids, user_indices, self._batch_scores(method, user_indices),
+                top_n, METHOD_LABELS[method], denormalize=method != "als"
+            )
+            for row, recommendations in enumerate(candidates):
+                method_tour_ids[row, :len(recommendations)] = [rec["tour_id"] for rec in recommendations]
+                method_scores[row, :len(recommendations)] = [rec["predicted_score"] for rec in recommendations]
+            
+            results[method] = (method_tour_ids, method_scores)
+        return results
+    
+    def precomputed_recommendations(
+        self,
+        store: RecommendationStore,
+        user_id: int,
+        method: str = "hybrid",
+        n_recommendations: int = 10
+    ) -> Optional[List[Dict]]:
+        """
+        Lấy recommendations từ ứng viên đã tính trước (không tính lại điểm), chạy
+        diversity / hybrid / explanations giống live path. Chỉ lọc bỏ tours user đã
+        tương tác sau lần materialize và tours không còn active
+        
+        Args:
+            store: RecommendationStore đã load
+            user_id: ID của user
+            method: Phương pháp CF
+            n_recommendations: Số lượng recommendations
+            
+        Returns:
+            Danh sách recommendations, None nếu store không có user, không đủ ứng viên
+            cho n_recommendations hoặc không có ứng viên nào (dùng live path)
+        """
+        component_methods = HYBRID_COMPONENTS if method == "hybrid" else (method,)
+        n_candidates = n_recommendations * (4 if method == "hybrid" else 2)
+        
+        raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
+        raw_row = None
+        if self.user_id_to_idx and user_id in self.user_id_to_idx and raw_matrix is not None:
+            raw_row = self._get_row(raw_matrix, self.user_id_to_idx[user_id])
+        
+        candidates = {}
+        for component in component_methods:
+            entry = store.lookup(component, user_id)
+            if entry is None:
+                return None
+            # Hàng đầy (có thể đã bị cắt ở top_n) nhưng ít hơn số ứng viên live path cần
+            if len(entry[0]) >= store.top_n and store.top_n < n_candidates:
+                return None
+            
+            recommendations = []
+            for tour_id, score in zip(entry[0].tolist(), entry[1].tolist()):
+                tour = self._get_available_tour(tour_id)
+                if not tour:
+                    continue
+                tour_idx = self.tour_id_to_idx.get(tour_id)
+                if raw_row is not None and tour_idx is not None and raw_row[tour_idx] != 0:
+                    continue
+                
+                recommendations.append({
+                    "tour_id": tour["id"],
+                    "tour_title": tour["title"],
+                    "tour_slug": tour["slug"],
+                    "predicted_score": score,
+                    "method": METHOD_LABELS[component]
+                })
+                if len(recommendations) >= n_candidates:
+                    break
+            candidates[component] = recommendations
+        
+        if not any(candidates.values()):
+            return None
+        return self._finalize_method(method, user_id, candidates, n_recommendations)
@@ -0,0 +1,434 @@
+"""
+Cập nhật incremental cho Collaborative Filtering
+Ghi từng interaction mới vào ma trận User-Tour tại chỗ (apply_interaction).
+Với ma trận sparse, các hàng thay đổi và phần thay đổi của co-occurrence được giữ
+trong buffer rồi ghép vào CSR trong một lần (_flush_row_updates) thay vì ghép lại
+data/indices/indptr sau mỗi interaction.
+"""
+import os
+import numpy as np
+import scipy.sparse as sp
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Số hàng CSR tối đa giữ trong buffer của apply_interaction trước khi ghép vào ma trận
+# (buffer cũng được ghép ở lần prepare tiếp theo)
+ROW_BUFFER_MAX_ROWS = int(os.getenv("CF_ROW_BUFFER_MAX_ROWS", "1000"))
+
+
+class IncrementalUpdateMixin:
+    """
+    apply_interaction và buffer hàng / co-occurrence của CollaborativeFiltering
+    (dùng state và helpers ma trận của CollaborativeFiltering)
+    """
+
+    @staticmethod
+    def _set_rows(matrix: sp.csr_matrix, rows: Dict[int, np.ndarray]) -> sp.csr_matrix:
+        """
+        Ghi đè nhiều hàng của ma trận CSR trong một lần ghép data/indices/indptr
+        (O(nnz + số hàng), không tạo explicit zeros)
+        
+        Args:
+            matrix: Ma trận CSR
+            rows: {row_idx: giá trị mới của hàng (dense)}
+            
+        Returns:
+            Ma trận CSR mới
+        """
+        counts = np.diff(matrix.indptr)
+        new_counts = counts.copy()
+        new_entries = {}
+        for row_idx, values in rows.items():
+            new_indices = np.flatnonzero(values)
+            new_entries[row_idx] = (new_indices, values[new_indices])
+            new_counts[row_idx] = len(new_indices)
+        
+        kept_rows = np.ones(matrix.shape[0], dtype=bool)
+        kept_rows[list(rows)] = False
+        indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+        np.cumsum(new_counts, out=indptr[1:])
+        
+        data = np.empty(indptr[-1], dtype=matrix.data.dtype)
+        indices = np.empty(indptr[-1], dtype=matrix.indices.dtype)
+        kept_source = np.repeat(kept_rows, counts)
+        kept_target = np.repeat(kept_rows, new_counts)
+        data[kept_target] = matrix.data[kept_source]
+        indices[kept_target] = matrix.indices[kept_source]
+        for row_idx, (new_indices, new_data) in new_entries.items():
+            data[indptr[row_idx]:indptr[row_idx + 1]] = new_data
+            indices[indptr[row_idx]:indptr[row_idx + 1]] = new_indices
+        
+        return sp.csr_matrix((data, indices, indptr), shape=matrix.shape)
+    
+    def _matrix_row(self, name: str, row_idx: int) -> np.ndarray:
+        """Bản copy dense của một hàng (gồm thay đổi còn trong buffer) của ma trận theo tên"""
+        pending = self._pending_rows[name].get(row_idx)
+        if pending is not None:
+            return pending.copy()
+        return np.array(self._get_row(getattr(self, name), row_idx), dtype=np.float64)
+    
+    def _matrix_column(self, name: str, col_idx: int) -> np.ndarray:
+        """Một cột dense (gồm thay đổi còn trong buffer) của ma trận theo tên"""
+        column = getattr(self, name)[:, col_idx]
+        column = column.toarray().ravel() if sp.issparse(column) else np.array(column, dtype=np.float64)
+        for row_idx, values in self._pending_rows[name].items():
+            column[row_idx] = values[col_idx]
+        return column
+    
+    def _write_row(self, name: str, row_idx: int, values: np.ndarray):
+        """
+        Ghi một hàng của ma trận theo tên: dense ghi in-place,
+        CSR giữ trong buffer đến lần _flush_row_updates tiếp theo
+        """
+        matrix = getattr(self, name)
+        if sp.issparse(matrix):
+            self._pending_rows[name][row_idx] = values
+        else:
+            matrix[row_idx] = values
+    
+    def _has_pending_updates(self) -> bool:
+        return bool(
+            self._pending_rows["user_tour_matrix_raw"] or self._pending_rows["user_tour_matrix"]
+            or self._pending_cooccurrence
+        )
+    
+    def _clear_pending_updates(self):
+        self._pending_rows = {"user_tour_matrix_raw": {}, "user_tour_matrix": {}}
+        self._pending_cooccurrence = []
+    
+    def _merged_pending_updates(self) -> Dict[str, Any]:
+        """
+        Các ma trận sau khi ghép buffer (không thay đổi model, dùng dưới read lock)
+        
+        Returns:
+            {tên thuộc tính: ma trận đã ghép} cho các ma trận có thay đổi trong buffer
+        """
+        merged = {}
+        for name, rows in self._pending_rows.items():
+            if rows:
+                merged[name] = self._set_rows(getattr(self, name), rows)
+        if self._pending_cooccurrence:
+            positive_delta, sum_delta = self._cooccurrence_deltas()
+            merged["tour_cooccurrence_positive"] = (self.tour_cooccurrence_positive + positive_delta).tocsr()
+            merged["tour_cooccurrence_sum"] = (self.tour_cooccurrence_sum + sum_delta).tocsr()
+        return merged
+    
+    def _flush_row_updates(self):
+        """
+        Ghép các thay đổi trong buffer vào ma trận (gọi khi đang giữ write lock
+        hoặc không có requests song song): một lần ghép O(nnz) cho mọi interactions
+        từ lần ghép trước thay vì một lần cho mỗi interaction
+        """
+        if not self._has_pending_updates():
+            return
+        for name, matrix in self._merged_pending_updates().items():
+            setattr(self, name, matrix)
+        self._clear_pending_updates()
+    
+    def apply_interaction(
+        self,
+        user_id: int,
+        tour_id: int,
+        score: float,
+        interaction_type: Optional[str] = None,
+        created_at: Optional[datetime] = None,
+        tour: Optional[Dict] = None
+    ) -> bool:
+        """
+        Cập nhật model với một interaction mới mà không cần rebuild toàn bộ ma trận
+        
+        - Cập nhật ô (user, tour) của raw matrix theo cùng rule max + time decay
+        - Tính lại các hàng đã preprocess bị ảnh hưởng (mean của user, sparse handling)
+          dựa trên thống kê của lần build gần nhất (outlier bound, số interactions)
+        - Mở rộng ID maps nếu user/tour chưa có trong model
+        - Cập nhật ma trận co-occurrence và đánh dấu similarities cần tính lại
+        - Chạy dưới write lock: đợi các requests đang đọc model hoàn tất
+        
+        Nhận giá trị thuần (không nhận ORM objects): hàm chạy trên thread của model,
+        đọc attributes của ORM object ở đây có thể lazy-load qua session của request.
+        
+        Args:
+            user_id: ID của user
+            tour_id: ID của tour
+            score: Điểm của interaction (chưa time decay)
+            interaction_type: Loại interaction (cho explanation)
+            created_at: Thời điểm tạo interaction
+            tour: Metadata của tour (tour_to_metadata), cần khi tour chưa có trong model
+            
+        Returns:
+            True nếu model đã được cập nhật, False nếu bỏ qua
+            (model chưa build hoặc tour không được phép recommend)
+        """
+        if not self._matrix_built or self._is_empty(self.user_tour_matrix_raw):
+            return False
+        
+        with self.rw_lock.write(), self._cache_lock:
+            self._detach_snapshot()
+            self.state_revision += 1
+            
+            if tour_id not in self.tour_id_to_idx:
+                # Chỉ thêm tours được phép recommend (giống filter khi build)
+                if tour is None or not (tour["is_active"] and tour["is_approved"] and not tour["is_banned"]):
+                    return False
+                self._add_tour(tour)
+            
+            if user_id not in self.user_id_to_idx:
+                self._add_user(user_id)
+            
+            user_idx = self.user_id_to_idx[user_id]
+            tour_idx = self.tour_id_to_idx[tour_id]
+            
+            # Tính score với time decay nếu enabled
+            base_score = float(score)
+            if self.use_time_decay and created_at:
+                score = base_score * self._calculate_time_decay(created_at)
+            else:
+                score = base_score
+            
+            # Cập nhật raw matrix: giữ interaction quan trọng nhất (max)
+            old_raw_row = self._matrix_row("user_tour_matrix_raw", user_idx)
+            new_raw_row = old_raw_row.copy()
+            if old_raw_row[tour_idx] > 0:
+                new_raw_row[tour_idx] = max(old_raw_row[tour_idx], score)
+            else:
+                new_raw_row[tour_idx] = score
+            
+            # Lưu interaction type cho explanation
+            self._pending_interaction_history.setdefault((user_id, tour_id), []).append(
+                interaction_type
+            )
+            
+            self._replace_raw_row(user_idx, old_raw_row, new_raw_row)
+            
+            if len(self._pending_rows["user_tour_matrix_raw"]) >= ROW_BUFFER_MAX_ROWS:
+                self._flush_row_updates()
+        
+        return True
+    
+    def remove_interactions(self, user_id: Optional[int] = None, tour_id: Optional[int] = None) -> bool:
+        """
+        Bỏ các interactions của một user hoặc với một tour khỏi model (sau khi đã xoá
+        trong database) mà không cần rebuild: hàng của user / cột của tour trong raw
+        matrix về 0, các hàng bị ảnh hưởng được cập nhật giống apply_interaction.
+        User / tour vẫn nằm trong ID maps (build lại cũng load mọi users và tours active)
+        
+        Args:
+            user_id: Bỏ mọi interactions của user này
+            tour_id: Bỏ mọi interactions với tour này
+            
+        Returns:
+            True nếu model đã được cập nhật, False nếu bỏ qua (model chưa build)
+        """
+        if not self._matrix_built or self._is_empty(self.user_tour_matrix_raw):
+            return False
+        
+        with self.rw_lock.write(), self._cache_lock:
+            self._detach_snapshot()
+            self.state_revision += 1
+            
+            if user_id in self.user_id_to_idx:
+                user_idx = self.user_id_to_idx[user_id]
+                old_raw_row = self._matrix_row("user_tour_matrix_raw", user_idx)
+                self._replace_raw_row(user_idx, old_raw_row, np.zeros_like(old_raw_row))
+            
+            if tour_id in self.tour_id_to_idx:
+                tour_idx = self.tour_id_to_idx[tour_id]
+                tour_column = self._matrix_column("user_tour_matrix_raw", tour_idx)
+                for user_idx in np.flatnonzero(tour_column).tolist():
+                    old_raw_row = self._matrix_row("user_tour_matrix_raw", user_idx)
+                    new_raw_row = old_raw_row.copy()
+                    new_raw_row[tour_idx] = 0
+                    self._replace_raw_row(user_idx, old_raw_row, new_raw_row)
+            
+            self._remove_interaction_history(user_id, tour_id)
+            
+            if len(self._pending_rows["user_tour_matrix_raw"]) >= ROW_BUFFER_MAX_ROWS:
+                self._flush_row_updates()
+        
+        return True
+    
+    def _replace_raw_row(self, user_idx: int, old_raw_row: np.ndarray, new_raw_row: np.ndarray):
+        """
+        Ghi hàng mới của raw matrix rồi cập nhật co-occurrence, số interactions và các
+        hàng đã preprocess bị ảnh hưởng (gọi khi đang giữ write lock)
+        """
+        self._write_row("user_tour_matrix_raw", user_idx, new_raw_row)
+        
+        # Latent vector ALS của user cần fold-in lại (kể cả khi ALS đang train
+        # bên ngoài lock trên bản copy của ma trận, xem build_missing_state)
+        self._als_stale_users.add(user_idx)
+        
+        self._update_tour_cooccurrence(old_raw_row, new_raw_row)
+        
+        # Cập nhật số interactions, xác định các hàng cần preprocess lại
+        affected_users = {user_idx}
+        changed_tours_idx = np.flatnonzero((old_raw_row != 0) != (new_raw_row != 0))
+        if len(changed_tours_idx) > 0:
+            delta = np.where(new_raw_row[changed_tours_idx] != 0, 1, -1)
+            self._user_interaction_counts[user_idx] += delta.sum()
+            old_tour_counts = self._tour_interaction_counts[changed_tours_idx].copy()
+            self._tour_interaction_counts[changed_tours_idx] += delta
+            
+            # Tour vượt qua ngưỡng sparse → cột của tour thay đổi ở mọi user đã tương tác
+            if self.handle_sparse:
+                new_tour_counts = self._tour_interaction_counts[changed_tours_idx]
+                for tour_idx in changed_tours_idx[(old_tour_counts < 2) != (new_tour_counts < 2)]:
+                    tour_column = self._matrix_column("user_tour_matrix_raw", tour_idx)
+                    affected_users.update(np.flatnonzero(tour_column).tolist())
+        
+        # Đánh dấu users/tours có vector thay đổi để cập nhật similarity khi cần
+        for affected_user_idx in affected_users:
+            changed_tours_idx = self._refresh_processed_row(affected_user_idx)
+            if len(changed_tours_idx) > 0:
+                self._dirty_user_indices.add(affected_user_idx)
+                self._dirty_tour_indices.update(changed_tours_idx.tolist())
+    
+    def _remove_interaction_history(self, user_id: Optional[int], tour_id: Optional[int]):
+        """Bỏ interaction types (cho explanation) của user / tour đã bị xoá"""
+        self._pending_interaction_history = {
+            (key_user_id, key_tour_id): types
+            for (key_user_id, key_tour_id), types in self._pending_interaction_history.items()
+            if key_user_id != user_id and key_tour_id != tour_id
+        }
+        if self._interaction_history_keys is not None:
+            keys = self._interaction_history_keys
+            keep = np.ones(len(keys), dtype=bool)
+            if user_id is not None:
+                keep &= (keys >> 32) != user_id
+            if tour_id is not None:
+                keep &= (keys & 0xFFFFFFFF) != tour_id
+            self._interaction_history_keys = keys[keep]
+            self._interaction_history_type_codes = self._interaction_history_type_codes[keep]
+    
+    def _add_user(self, user_id: int):
+        """Thêm user mới (chưa có interactions) vào cuối ID maps và ma trận"""
+        self.user_id_to_idx[user_id] = len(self.user_ids)
+        self.user_ids.append(user_id)
+        n_users, n_tours = len(self.user_ids), len(self.tour_ids)
+        
+        self.user_tour_matrix_raw = self._grow_matrix(self.user_tour_matrix_raw, n_users, n_tours)
+        self.user_tour_matrix = self._grow_matrix(self.user_tour_matrix, n_users, n_tours)
+        self._user_interaction_counts = np.append(self._user_interaction_counts, 0)
+        if self.user_means is not None:
+            self.user_means = np.append(self.user_means, 0.0)
+        
+        # User mới có vector 0 → similarity 0 với mọi users
+        if self._user_norms is not None:
+            self._user_norms = np.append(self._user_norms, 0.0)
+        if self.user_similarity is not None:
+            self.user_similarity = self._grow_matrix(self.user_similarity, n_users, n_users)
+        if self.user_neighbors is not None:
+            self.user_neighbors.add_rows(1)
+        if self.user_ann_index is not None:
+            self.user_ann_index.add_rows(1)
+        if self.als_model is not None:
+            self.als_model.add_users(1)
+    
+    def _add_tour(self, tour: Dict):
+        """Thêm tour mới (chưa có interactions) vào cuối ID maps, ma trận và metadata"""
+        self.tour_id_to_idx[tour["id"]] = len(self.tour_ids)
+        self.tour_ids.append(tour["id"])
+        n_users, n_tours = len(self.user_ids), len(self.tour_ids)
+        
+        self.user_tour_matrix_raw = self._grow_matrix(self.user_tour_matrix_raw, n_users, n_tours)
+        self.user_tour_matrix = self._grow_matrix(self.user_tour_matrix, n_users, n_tours)
+        self._tour_interaction_counts = np.append(self._tour_interaction_counts, 0)
+        if self.tour_metadata is not None:
+            self.tour_metadata[tour["id"]] = dict(tour)
+        
+        if self.tour_cooccurrence_positive is not None:
+            self.tour_cooccurrence_positive.resize((n_tours, n_tours))
+            self.tour_cooccurrence_sum.resize((n_tours, n_tours))
+        
+        # Hàng trong buffer có thêm cột của tour mới
+        for rows in self._pending_rows.values():
+            for row_idx, values in rows.items():
+                rows[row_idx] = np.append(values, 0.0)
+        
+        # Tour mới có vector 0 → similarity 0 với mọi tours
+        if self._tour_norms is not None:
+            self._tour_norms = np.append(self._tour_norms, 0.0)
+        if self.tour_similarity is not None:
+            self.tour_similarity = self._grow_matrix(self.tour_similarity, n_tours, n_tours)
+        if self.tour_neighbors is not None:
+            self.tour_neighbors.add_rows(1)
+        if self.user_ann_index is not None:
+            self.user_ann_index.add_columns(1)
+        if self.als_model is not None:
+            self.als_model.add_tours(1)
+    
+    def _update_tour_cooccurrence(self, old_raw_row: np.ndarray, new_raw_row: np.ndarray):
+        """
+        Cập nhật ma trận co-occurrence khi một hàng của raw matrix thay đổi
+        C = B^T · R nên chỉ cần trừ outer product của hàng cũ và cộng của hàng mới:
+        delta chỉ khác 0 trên các hàng (tours đã tương tác) và cột (tours có rating)
+        của user, được giữ trong buffer và cộng vào C ở lần _flush_row_updates tiếp theo
+        """
+        if self.tour_cooccurrence_positive is None:
+            return
+        
+        old_interacted, new_interacted = old_raw_row > 0, new_raw_row > 0
+        rows = np.flatnonzero(old_interacted | new_interacted)
+        cols = np.flatnonzero((old_raw_row != 0) | (new_raw_row != 0))
+        if len(rows) == 0 or len(cols) == 0:
+            return
+        
+        def delta(values_old: np.ndarray, values_new: np.ndarray) -> np.ndarray:
+            return (
+                np.outer(new_interacted[rows], values_new[cols])
+                - np.outer(old_interacted[rows], values_old[cols])
+            )
+        
+        self._pending_cooccurrence.append((
+            rows, cols,
+            delta(np.maximum(old_raw_row, 0), np.maximum(new_raw_row, 0)),
+            delta(old_raw_row, new_raw_row)
+        ))
+    
+    def _cooccurrence_deltas(self) -> Tuple[sp.csr_matrix, sp.csr_matrix]:
+        """Tổng các khối delta trong buffer dưới dạng hai ma trận CSR Tour × Tour"""
+        n_tours = self.tour_cooccurrence_positive.shape[0]
+        row_indices = np.concatenate([np.repeat(rows, len(cols)) for rows, cols, _, _ in self._pending_cooccurrence])
+        col_indices = np.concatenate([np.tile(cols, len(rows)) for rows, cols, _, _ in self._pending_cooccurrence])
+        
+        def to_csr(values: List[np.ndarray]) -> sp.csr_matrix:
+            return sp.csr_matrix(
+                (np.concatenate([block.ravel() for block in values]), (row_indices, col_indices)),
+                shape=(n_tours, n_tours)
+            )
+        
+        return (
+            to_csr([positive for _, _, positive, _ in self._pending_cooccurrence]),
+            to_csr([total for _, _, _, total in self._pending_cooccurrence])
+        )
+    
+    def _refresh_processed_row(self, user_idx: int) -> np.ndarray:
+        """
+        Preprocess lại một hàng từ raw matrix với thống kê của lần build gần nhất
+        (outlier bound, số interactions của users/tours), rồi normalize theo mean mới của user
+        
+        Returns:
+            Index các tours có giá trị đã preprocess thay đổi
+        """
+        old_row = self._matrix_row("user_tour_matrix", user_idx)
+        row = self._matrix_row("user_tour_matrix_raw", user_idx)
+        
+        if self.remove_outliers and self._outlier_upper_bound is not None:
+            row[row > self._outlier_upper_bound] = self._outlier_upper_bound
+        
+        if self.handle_sparse:
+            if self._user_interaction_counts[user_idx] < 2:
+                row[:] = 0
+            row[self._tour_interaction_counts < 2] = 0
+        
+        if self.normalize:
+            positive = row > 0
+            user_mean = np.mean(row[positive]) if np.any(positive) else 0
+            if self.user_means is not None:
+                self.user_means[user_idx] = user_mean
+            if user_mean > 0:
+                row[positive] -= user_mean
+        
+        self._write_row("user_tour_matrix", user_idx, row)
+        return np.flatnonzero(old_row != row)
+    
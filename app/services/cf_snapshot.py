@@ -0,0 +1,253 @@
+"""
+Snapshot của model Collaborative Filtering
+Lưu / load / remap toàn bộ state đã tính (ma trận, similarity, neighbor index, ANN, ALS)
+qua write_snapshot / read_snapshot của model_snapshot.
+"""
+import os
+import numpy as np
+import scipy.sparse as sp
+from datetime import datetime
+from typing import Dict, Optional
+from app.services.neighbor_index import NeighborIndex
+from app.services.ann_index import IVFIndex
+from app.services.als import ALSModel
+from app.services.model_snapshot import SNAPSHOT_DIR, write_snapshot, read_snapshot, read_snapshot_meta
+
+# Các tham số quyết định nội dung ma trận/similarity, snapshot chỉ được load
+# khi các tham số này khớp với model hiện tại
+SNAPSHOT_CONFIG_KEYS = (
+    "normalize", "handle_sparse", "remove_outliers", "use_time_decay",
+    "time_decay_half_life_days", "use_sparse", "use_neighbor_index", "n_neighbors",
+    "use_ann", "ann_n_lists", "ann_n_probe",
+    "als_factors", "als_regularization", "als_alpha", "als_iterations",
+)
+
+
+class ModelSnapshotMixin:
+    """
+    save_snapshot / load_snapshot / remap_snapshot của CollaborativeFiltering
+    (dùng state của CollaborativeFiltering)
+    """
+
+    def save_snapshot(self, directory: str = SNAPSHOT_DIR, remap: bool = False) -> bool:
+        """
+        Lưu snapshot của model (ID maps, raw/preprocessed matrices, thống kê preprocessing,
+        similarity / neighbor index / ANN index / ALS factors đã tính, build timestamp, data hash)
+        
+        Args:
+            directory: Thư mục snapshot
+            remap: Sau khi lưu, thay arrays trong bộ nhớ bằng bản memory-map của snapshot
+                (dùng chung page cache với các workers khác)
+            
+        Returns:
+            True nếu đã lưu, False nếu model chưa build
+        """
+        with self._cache_lock:
+            if not self._matrix_built or self._is_empty(self.user_tour_matrix):
+                return False
+            
+            # Ghép buffer của apply_interaction vào bản ghi (không đổi model: có thể đang giữ read lock)
+            merged = self._merged_pending_updates()
+            arrays = {
+                "user_ids": np.array(self.user_ids, dtype=np.int64),
+                "tour_ids": np.array(self.tour_ids, dtype=np.int64),
+                "user_tour_matrix_raw": merged.get("user_tour_matrix_raw", self.user_tour_matrix_raw),
+                "user_tour_matrix": merged.get("user_tour_matrix", self.user_tour_matrix),
+                "user_means": self.user_means,
+                "user_interaction_counts": self._user_interaction_counts,
+                "tour_interaction_counts": self._tour_interaction_counts,
+                "tour_cooccurrence_positive": merged.get("tour_cooccurrence_positive", self.tour_cooccurrence_positive),
+                "tour_cooccurrence_sum": merged.get("tour_cooccurrence_sum", self.tour_cooccurrence_sum),
+                "interaction_history_keys": self._interaction_history_keys,
+                "interaction_history_type_codes": self._interaction_history_type_codes,
+                "user_similarity": self.user_similarity,
+                "tour_similarity": self.tour_similarity,
+                "user_norms": self._user_norms,
+                "tour_norms": self._tour_norms,
+                "dirty_user_indices": np.array(sorted(self._dirty_user_indices), dtype=np.int64),
+                "dirty_tour_indices": np.array(sorted(self._dirty_tour_indices), dtype=np.int64),
+            }
+            if self.user_neighbors is not None:
+                arrays["user_neighbors_indices"] = self.user_neighbors.indices
+                arrays["user_neighbors_scores"] = self.user_neighbors.scores
+            if self.tour_neighbors is not None:
+                arrays["tour_neighbors_indices"] = self.tour_neighbors.indices
+                arrays["tour_neighbors_scores"] = self.tour_neighbors.scores
+            if self.user_ann_index is not None:
+                arrays["user_ann_centroids"] = self.user_ann_index.centroids
+                arrays["user_ann_assignments"] = self.user_ann_index.assignments
+            if self.als_model is not None:
+                arrays["als_user_factors"] = self.als_model.user_factors
+                arrays["als_tour_factors"] = self.als_model.tour_factors
+                arrays["als_stale_users"] = np.array(sorted(self._als_stale_users), dtype=np.int64)
+            
+            meta = {
+                "config": {key: getattr(self, key) for key in SNAPSHOT_CONFIG_KEYS},
+                "matrix_hash": self._matrix_hash,
+                "built_at": self._last_matrix_build_time.isoformat() if self._last_matrix_build_time else None,
+                "outlier_upper_bound": self._outlier_upper_bound,
+                "global_mean": self.global_mean,
+                "interaction_types": self._interaction_types,
+                "pending_interaction_history": [
+                    [user_id, tour_id, types]
+                    for (user_id, tour_id), types in self._pending_interaction_history.items()
+                ],
+                "tour_metadata": list(self.tour_metadata.values()) if self.tour_metadata else [],
+                "user_similarity_calculated": self._user_similarity_calculated,
+                "tour_similarity_calculated": self._tour_similarity_calculated,
+            }
+            write_snapshot(directory, arrays, meta)
+            
+            if remap:
+                self._apply_snapshot(*read_snapshot(directory))
+        
+        return True
+    
+    def remap_snapshot(self, directory: str = SNAPSHOT_DIR, state_revision: Optional[int] = None) -> bool:
+        """
+        Thay arrays trong bộ nhớ bằng bản memory-map của snapshot vừa lưu
+        (dùng chung page cache với các workers khác), gọi khi đang giữ write lock
+        
+        Args:
+            directory: Thư mục snapshot
+            state_revision: state_revision lúc lưu snapshot; model đã thay đổi sau đó
+                thì giữ nguyên arrays hiện tại (remap sẽ làm mất thay đổi)
+            
+        Returns:
+            True nếu đã remap
+        """
+        with self._cache_lock:
+            if state_revision is not None and state_revision != self.state_revision:
+                return False
+            snapshot = read_snapshot(directory)
+            if snapshot is None:
+                return False
+            self._apply_snapshot(*snapshot)
+        return True
+    
+    def load_snapshot(self, directory: str = SNAPSHOT_DIR) -> bool:
+        """
+        Load snapshot đã lưu bằng save_snapshot thay vì build từ database
+        Cache TTL / data hash vẫn được kiểm tra như sau một lần build bình thường
+        
+        Args:
+            directory: Thư mục snapshot
+            
+        Returns:
+            True nếu đã load, False nếu không có snapshot hoặc snapshot
+            được tạo với cấu hình preprocessing khác
+        """
+        snapshot = read_snapshot(directory)
+        if snapshot is None:
+            return False
+        
+        arrays, meta = snapshot
+        if meta["config"] != {key: getattr(self, key) for key in SNAPSHOT_CONFIG_KEYS}:
+            return False
+        
+        with self._cache_lock:
+            self._apply_snapshot(arrays, meta)
+        
+        return True
+    
+    def _load_matching_snapshot(self, data_hash: str) -> bool:
+        """Load snapshot trong snapshot_dir nếu nó được build cho đúng data_hash"""
+        meta = read_snapshot_meta(os.path.realpath(self.snapshot_dir))
+        if meta is None or meta.get("matrix_hash") != data_hash:
+            return False
+        return self.load_snapshot(self.snapshot_dir)
+    
+    def _apply_snapshot(self, arrays: Dict, meta: Dict):
+        """Gán state của model từ arrays/meta của snapshot (gọi khi đang giữ _cache_lock)"""
+        self.user_ids = arrays["user_ids"].tolist()
+        self.tour_ids = arrays["tour_ids"].tolist()
+        self.user_id_to_idx = {uid: idx for idx, uid in enumerate(self.user_ids)}
+        self.tour_id_to_idx = {tid: idx for idx, tid in enumerate(self.tour_ids)}
+        self.user_tour_matrix_raw = arrays["user_tour_matrix_raw"]
+        self.user_tour_matrix = arrays["user_tour_matrix"]
+        self._clear_pending_updates()
+        self.user_means = arrays.get("user_means")
+        self._user_interaction_counts = arrays["user_interaction_counts"]
+        self._tour_interaction_counts = arrays["tour_interaction_counts"]
+        self._outlier_upper_bound = meta["outlier_upper_bound"]
+        self.global_mean = meta["global_mean"]
+        self.tour_cooccurrence_positive = arrays.get("tour_cooccurrence_positive")
+        self.tour_cooccurrence_sum = arrays.get("tour_cooccurrence_sum")
+        self.tour_metadata = {tour["id"]: tour for tour in meta["tour_metadata"]}
+        
+        self._interaction_history_keys = arrays.get("interaction_history_keys")
+        self._interaction_history_type_codes = arrays.get("interaction_history_type_codes")
+        self._interaction_types = meta["interaction_types"]
+        self._pending_interaction_history = {
+            (user_id, tour_id): types for user_id, tour_id, types in meta["pending_interaction_history"]
+        }
+        
+        self.user_similarity = arrays.get("user_similarity")
+        self.tour_similarity = arrays.get("tour_similarity")
+        self._user_norms = arrays.get("user_norms")
+        self._tour_norms = arrays.get("tour_norms")
+        self.user_neighbors = None
+        self.tour_neighbors = None
+        self.user_ann_index = None
+        self.als_model = None
+        if "user_neighbors_indices" in arrays:
+            self.user_neighbors = NeighborIndex(arrays["user_neighbors_indices"], arrays["user_neighbors_scores"])
+        if "tour_neighbors_indices" in arrays:
+            self.tour_neighbors = NeighborIndex(arrays["tour_neighbors_indices"], arrays["tour_neighbors_scores"])
+        if "user_ann_centroids" in arrays:
+            self.user_ann_index = IVFIndex(arrays["user_ann_centroids"], arrays["user_ann_assignments"], self.ann_n_probe)
+        if "als_user_factors" in arrays:
+            self.als_model = ALSModel(
+                arrays["als_user_factors"], arrays["als_tour_factors"],
+                self.als_regularization, self.als_alpha
+            )
+        
+        self._dirty_user_indices = set(arrays["dirty_user_indices"].tolist())
+        self._dirty_tour_indices = set(arrays["dirty_tour_indices"].tolist())
+        self._als_stale_users = set(arrays["als_stale_users"].tolist()) if "als_stale_users" in arrays else set()
+        self._user_similarity_calculated = meta["user_similarity_calculated"]
+        self._tour_similarity_calculated = meta["tour_similarity_calculated"]
+        
+        self._matrix_hash = meta["matrix_hash"]
+        self._last_matrix_build_time = datetime.fromisoformat(meta["built_at"]) if meta["built_at"] else None
+        self._last_cache_check_time = None
+        self._matrix_built = True
+        self.model_version = self._next_model_version()
+        
+        # Arrays read-only (mmap_mode='r') chỉ copy khi có cập nhật incremental;
+        # snapshot còn state incremental đang chờ xử lý thì copy ngay
+        self._snapshot_mapped = True
+        if self._dirty_user_indices or self._dirty_tour_indices or self._als_stale_users:
+            self._detach_snapshot()
+    
+    def _detach_snapshot(self):
+        """
+        Copy các arrays đang memory-map read-only sang bộ nhớ riêng của process
+        (trước khi cập nhật in-place: apply_interaction, cập nhật similarity, fold-in)
+        """
+        if not self._snapshot_mapped:
+            return
+        
+        def writable(array):
+            if array is None:
+                return None
+            if sp.issparse(array):
+                return array.copy() if not array.data.flags.writeable else array
+            return np.array(array) if not array.flags.writeable else array
+        
+        for name in (
+            "user_tour_matrix_raw", "user_tour_matrix", "user_means",
+            "_user_interaction_counts", "_tour_interaction_counts",
+            "tour_cooccurrence_positive", "tour_cooccurrence_sum",
+            "user_similarity", "tour_similarity", "_user_norms", "_tour_norms",
+        ):
+            setattr(self, name, writable(getattr(self, name)))
+        for index in (self.user_neighbors, self.tour_neighbors):
+            if index is not None:
+                index.indices, index.scores = writable(index.indices), writable(index.scores)
+        if self.user_ann_index is not None:
+            self.user_ann_index.assignments = writable(self.user_ann_index.assignments)
+        if self.als_model is not None:
+            self.als_model.user_factors = writable(self.als_model.user_factors)
+        
+        self._snapshot_mapped = False
@@ -1,20 +1,44 @@
 import numpy as np
+import scipy.sparse as sp
 from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Dict, Optional, Tuple
+from typing import Any, Callable, Iterator, List, Dict, Optional, Sequence, Tuple, Union
 from sqlalchemy.orm import Session
 from app.models.schema import UserTourInteraction, UserProfile, Tour
-from app.services.scoring import get_interaction_score
-from datetime import datetime, timezone, timedelta
+from app.services.neighbor_index import NeighborIndex, cosine_similarity_rows
+from app.services.ann_index import IVFIndex
+from app.services.als import ALSModel
+from app.services.cf_incremental import IncrementalUpdateMixin
+from app.services.cf_batch import BatchScoringMixin
+from app.services.cf_snapshot import ModelSnapshotMixin
+from app.services.interaction_loader import (
+    load_interaction_arrays, load_user_ids, load_available_tours, to_epoch_seconds, tour_to_metadata
+)
+from app.services.data_version import get_data_version, get_catalog_fingerprint, data_version_hash
+from app.services.popularity_index import popularity_index, COLD_START_RANKING
+from app.utils.rwlock import ReadWriteLock
+from datetime import datetime, timezone
+from contextlib import contextmanager
 import warnings
 import hashlib
-import pickle
-from functools import lru_cache
+import itertools
 import threading
 
-class CollaborativeFiltering:
+# Ma trận User-Tour có thể là dense (np.ndarray) hoặc sparse (CSR)
+Matrix = Union[np.ndarray, sp.csr_matrix]
+
+# Explanation của recommendations cold start theo bảng xếp hạng
+COLD_START_EXPLANATIONS = {
+    "popular": "Tour phổ biến nhất - phù hợp cho người dùng mới",
+    "trending": "Tour đang được quan tâm nhiều gần đây - phù hợp cho người dùng mới",
+}
+
+# Sinh model_version duy nhất trong process cho mỗi lần build / load snapshot
+_model_versions = itertools.count(1)
+
+class CollaborativeFiltering(IncrementalUpdateMixin, BatchScoringMixin, ModelSnapshotMixin):
     def __init__(
         self, 
-        db: Session, 
+        db: Optional[Session], 
         normalize: bool = True, 
         handle_sparse: bool = True, 
         remove_outliers: bool = True,
@@ -24,13 +48,26 @@ class CollaborativeFiltering:
         diversity_weight: float = 0.3,
         enable_explanation: bool = True,
         enable_caching: bool = True,
-        cache_ttl_seconds: int = 3600
+        cache_ttl_seconds: int = 3600,
+        use_sparse: bool = False,
+        use_neighbor_index: bool = False,
+        n_neighbors: int = 50,
+        use_ann: bool = False,
+        ann_n_lists: Optional[int] = None,
+        ann_n_probe: int = 8,
+        als_factors: int = 32,
+        als_regularization: float = 0.1,
+        als_alpha: float = 5.0,
+        als_iterations: int = 15,
+        snapshot_dir: Optional[str] = None,
+        session_factory: Optional[Callable[[], Session]] = None
     ):
         """
         Collaborative Filtering với Data Preprocessing và Advanced Features
         
         Args:
-            db: Database session
+            db: Database session (None với model dùng chung giữa các requests,
+                khi đó database được đọc qua session_factory hoặc session truyền vào từng lần gọi)
             normalize: Có normalize matrix không (mean centering)
             handle_sparse: Có xử lý sparse data không
             remove_outliers: Có loại bỏ outliers không
@@ -41,21 +78,72 @@ class CollaborativeFiltering:
             enable_explanation: Có tạo explanation không
             enable_caching: Có enable caching không (default: True)
             cache_ttl_seconds: Cache TTL trong giây (default: 3600 = 1 hour)
+            use_sparse: Lưu ma trận User-Tour dạng sparse (CSR) thay vì dense,
+                bộ nhớ tỉ lệ theo số interactions thay vì users × tours
+            use_neighbor_index: Chỉ lưu top K láng giềng của mỗi user/tour (NeighborIndex)
+                thay vì ma trận similarity dense N × N
+            n_neighbors: Số láng giềng K giữ lại cho mỗi user/tour (default: 50)
+            use_ann: Tìm users tương tự bằng IVF index (approximate) thay vì tính
+                similarity chính xác với mọi users, dùng cho số users rất lớn
+            ann_n_lists: Số cụm của IVF index (default: sqrt(số users))
+            ann_n_probe: Số cụm quét mỗi lần tìm, lớn hơn → recall cao hơn nhưng chậm hơn
+            als_factors: Số latent factors của method ALS (default: 32)
+            als_regularization: Hệ số regularization λ của ALS
+            als_alpha: Hệ số confidence của ALS, c = 1 + alpha · |rating|
+            als_iterations: Số vòng train ALS
+            snapshot_dir: Thư mục snapshot dùng chung giữa các workers; khi data thay đổi,
+                map snapshot do worker khác vừa build cho đúng data hiện tại thay vì build lại
+            session_factory: Tạo session riêng (đóng ngay sau khi dùng) khi model cần đọc
+                database mà không có db; model sống lâu không giữ session của request
         """
         self.db = db
+        self.session_factory = session_factory
         self.user_tour_matrix = None  # Ma trận User-Tour
         self.user_tour_matrix_raw = None  # Ma trận gốc (chưa normalize)
         self.user_similarity = None
         self.tour_similarity = None  # Item similarity -> Tour similarity
+        # Top K láng giềng (khi use_neighbor_index), thay cho user_similarity/tour_similarity
+        self.user_neighbors = None
+        self.tour_neighbors = None
+        # IVF index tìm users tương tự gần đúng (khi use_ann)
+        self.user_ann_index = None
+        # User/tour latent factors của method ALS (train lazy ở request ALS đầu tiên)
+        self.als_model = None
+        # Users có interactions thay đổi sau lần train ALS, latent vector được
+        # fold-in (giải lại với tour factors cố định) ở request tiếp theo của user
+        self._als_stale_users = set()
+        # Ma trận co-occurrence Tour × Tour (sparse) cho fallback khi similarity = 0:
+        # [i, t] = tổng ratings dương / tổng ratings cho tour t của các users đã tương tác với tour i
+        self.tour_cooccurrence_positive = None
+        self.tour_cooccurrence_sum = None
+        # Thay đổi của apply_interaction chưa ghép vào ma trận (sparse mode ghi lại
+        # CSR tốn O(nnz) nên gom nhiều interactions rồi ghép một lần, xem _flush_row_updates):
+        # hàng mới theo tên ma trận, các khối delta (rows, cols, positive, sum) của co-occurrence
+        self._pending_rows = {"user_tour_matrix_raw": {}, "user_tour_matrix": {}}
+        self._pending_cooccurrence = []
         self.user_ids = None
         self.tour_ids = None  # item_ids -> tour_ids
         self.user_id_to_idx = None
         self.tour_id_to_idx = None  # item_id_to_idx -> tour_id_to_idx
+        # Metadata của tours (title, slug, flags, category) load cùng ma trận,
+        # dùng để hydrate kết quả mà không cần query từng tour
+        self.tour_metadata = None
         
         # Preprocessing flags
         self.normalize = normalize
         self.handle_sparse = handle_sparse
         self.remove_outliers = remove_outliers
+        self.use_sparse = use_sparse
+        self.use_neighbor_index = use_neighbor_index
+        self.n_neighbors = n_neighbors
+        self.use_ann = use_ann
+        self.ann_n_lists = ann_n_lists
+        self.ann_n_probe = ann_n_probe
+        self.als_factors = als_factors
+        self.als_regularization = als_regularization
+        self.als_alpha = als_alpha
+        self.als_iterations = als_iterations
+        self.snapshot_dir = snapshot_dir
         
         # Advanced Features flags
         self.use_time_decay = use_time_decay
@@ -69,16 +157,47 @@ class CollaborativeFiltering:
         self.tour_means = None  # Mean của mỗi tour
         self.global_mean = None  # Global mean
         self.sparsity_threshold = 0.95  # Nếu > 95% là 0, coi là quá sparse
-        
-        # Cache for interactions with timestamps
-        self.interactions_cache = None
+        # Thống kê của lần build gần nhất, dùng lại khi apply interaction mới (incremental)
+        self._outlier_upper_bound = None
+        self._user_interaction_counts = None
+        self._tour_interaction_counts = None
+        # Users/tours có vector thay đổi sau lần tính similarity gần nhất,
+        # cùng norms đã cache để cập nhật similarity theo từng hàng/cột
+        self._dirty_user_indices = set()
+        self._dirty_tour_indices = set()
+        self._user_norms = None
+        self._tour_norms = None
+        # Q = positive ∘ [sum > 0] của co-occurrence cho batch path (kèm cặp ma trận nguồn)
+        self._cooccurrence_contributions_cache = None
+        
+        # Lịch sử interaction types theo cặp (user_id, tour_id) cho explanation:
+        # keys đã sắp xếp + type codes tương ứng, interactions mới sau lần build ở pending
+        self._interaction_history_keys = None
+        self._interaction_history_type_codes = None
+        self._interaction_types = None
+        self._pending_interaction_history = {}
         
         # Performance Optimization
         self.enable_caching = enable_caching
         self.cache_ttl_seconds = cache_ttl_seconds
         self._matrix_hash = None  # Hash của matrix để invalidate cache
+        # Đổi sau mỗi lần build / load snapshot (cập nhật incremental giữ nguyên),
+        # dùng trong key của cache kết quả recommendations
+        self.model_version = None
         self._last_matrix_build_time = None
+        self._last_cache_check_time = None  # Lần cuối xác nhận data chưa thay đổi
         self._cache_lock = threading.Lock()  # Thread-safe cache
+        # Requests đọc model song song (read), cập nhật incremental / tính lazy state (write)
+        self.rw_lock = ReadWriteLock()
+        # Chỉ một thread tính state lazy bên ngoài rw_lock tại một thời điểm (build_missing_state)
+        self._state_build_lock = threading.Lock()
+        # Tăng mỗi khi state của model thay đổi (interaction mới, gắn state vừa tính),
+        # dùng để biết model có đổi trong lúc ghi snapshot không
+        self.state_revision = 0
+        
+        # Arrays đang memory-map read-only từ snapshot (dùng chung giữa workers),
+        # phải copy sang bộ nhớ riêng trước khi cập nhật incremental
+        self._snapshot_mapped = False
         
         # Lazy loading flags
         self._matrix_built = False
@@ -87,8 +206,31 @@ class CollaborativeFiltering:
         
         # Batch processing
         self.batch_size = 100  # Số users xử lý cùng lúc
+
+    @staticmethod
+    def _next_model_version() -> int:
+        """model_version mới cho lần build / load snapshot (duy nhất trong process)"""
+        return next(_model_versions)
+
+    @contextmanager
+    def _db_session(self, db: Optional[Session] = None) -> Iterator[Optional[Session]]:
+        """
+        Session để đọc database: db truyền vào, self.db, hoặc session mới từ
+        session_factory (đóng khi xong); None nếu không có cách nào
+        """
+        if db is not None or self.db is not None:
+            yield db if db is not None else self.db
+            return
+        if self.session_factory is None:
+            yield None
+            return
+        session = self.session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
     
-    def build_user_tour_matrix(self, force_rebuild: bool = False) -> np.ndarray:
+    def build_user_tour_matrix(self, force_rebuild: bool = False, db: Optional[Session] = None) -> Matrix:
         """
         Xây dựng ma trận User-Tour từ database
         Rows: Users, Columns: Tours, Values: Ratings/Interactions
@@ -101,122 +243,425 @@ class CollaborativeFiltering:
         
         Args:
             force_rebuild: Force rebuild matrix ngay cả khi đã có cache
+            db: Session dùng cho lần build này (default: self.db / session_factory)
             
         Returns:
             User-Tour matrix
         """
         # Lazy loading: Nếu đã build và không force rebuild, trả về cached
         if not force_rebuild and self._matrix_built and self.user_tour_matrix is not None:
-            # Kiểm tra cache TTL
-            if self._last_matrix_build_time:
-                elapsed = (datetime.now(timezone.utc) - self._last_matrix_build_time).total_seconds()
-                if elapsed < self.cache_ttl_seconds:
-                    return self.user_tour_matrix
+            if self._cache_ttl_valid():
+                return self.user_tour_matrix
         
+        with self._db_session(db) as session:
+            return self._build_user_tour_matrix(force_rebuild, session)
+    
+    def _build_user_tour_matrix(self, force_rebuild: bool, db: Optional[Session]) -> Matrix:
+        """Phần build của build_user_tour_matrix với session đã chọn"""
         # Check if data has changed (simple hash-based invalidation)
         if self.enable_caching and not force_rebuild:
-            current_hash = self._get_data_hash()
+            current_hash = self._get_data_hash(db)
             if current_hash == self._matrix_hash and self.user_tour_matrix is not None:
+                # Data chưa đổi: gia hạn cache để không phải hash lại ở mỗi request
+                self._last_cache_check_time = datetime.now(timezone.utc)
                 return self.user_tour_matrix
             self._matrix_hash = current_hash
-        # Lấy tất cả interactions
-        interactions = self.db.query(UserTourInteraction).all()
-        
-        # Lấy danh sách unique users và tours
-        users = self.db.query(UserProfile).all()
-        tours = self.db.query(Tour).filter(
-            Tour.is_active == True, 
-            Tour.is_approved == True, 
-            Tour.is_banned == False
-        ).all()
-        
-        if not users or not tours:
+            
+            # Worker khác đã build snapshot cho đúng data hiện tại: map snapshot đó
+            if self.snapshot_dir and current_hash and self._load_matching_snapshot(current_hash):
+                return self.user_tour_matrix
+        # Load interactions, users và tours theo cột (không tạo ORM objects)
+        interactions = load_interaction_arrays(db)
+        user_ids_array = load_user_ids(db)
+        tours = load_available_tours(db)
+        
+        if len(user_ids_array) == 0 or not tours:
             return np.array([])
         
-        user_ids = [u.id for u in users]
+        user_ids = user_ids_array.tolist()
         tour_ids = [t.id for t in tours]
         
-        # Tạo ma trận
-        matrix = np.zeros((len(user_ids), len(tour_ids)))
         user_id_to_idx = {uid: idx for idx, uid in enumerate(user_ids)}
         tour_id_to_idx = {tid: idx for idx, tid in enumerate(tour_ids)}
         
-        # Lưu interactions để dùng cho time decay và explanation
-        self.interactions_cache = {}
-        
-        # Điền dữ liệu vào ma trận
-        for interaction in interactions:
-            if interaction.user_id in user_id_to_idx and interaction.tour_id in tour_id_to_idx:
-                user_idx = user_id_to_idx[interaction.user_id]
-                tour_idx = tour_id_to_idx[interaction.tour_id]
-                
-                # Tính score với time decay nếu enabled
-                base_score = float(interaction.score)
-                
-                if self.use_time_decay and interaction.created_at:
-                    time_decay_factor = self._calculate_time_decay(interaction.created_at)
-                    score = base_score * time_decay_factor
-                else:
-                    score = base_score
-                
-                # Nếu đã có interaction trước đó, lấy max (giữ interaction quan trọng nhất)
-                if matrix[user_idx, tour_idx] > 0:
-                    matrix[user_idx, tour_idx] = max(matrix[user_idx, tour_idx], score)
-                else:
-                    matrix[user_idx, tour_idx] = score
-                
-                # Lưu interaction info cho explanation
-                key = (interaction.user_id, interaction.tour_id)
-                if key not in self.interactions_cache:
-                    self.interactions_cache[key] = []
-                self.interactions_cache[key].append({
-                    'type': interaction.interaction_type,
-                    'score': base_score,
-                    'created_at': interaction.created_at
-                })
-        
-        # Lưu ma trận gốc
-        self.user_tour_matrix_raw = matrix.copy()
+        # Map IDs → index trong ma trận (-1 nếu user/tour không có trong ma trận)
+        interaction_users_idx = self._map_ids(interactions["user_ids"], user_ids_array)
+        interaction_tours_idx = self._map_ids(interactions["tour_ids"], np.array(tour_ids, dtype=np.int64))
+        valid = (interaction_users_idx >= 0) & (interaction_tours_idx >= 0)
+        
+        # Lưu interaction types để dùng cho explanation
+        self._build_interaction_history(
+            interactions["user_ids"][valid], interactions["tour_ids"][valid],
+            interactions["type_codes"][valid], interactions["types"]
+        )
+        
+        # Tính score với time decay nếu enabled (một lần cho cả cột timestamps)
+        scores = interactions["scores"][valid]
+        if self.use_time_decay:
+            scores = scores * self._calculate_time_decay_array(interactions["created_at"][valid])
+        
+        # Gom điểm theo ô (user_idx, tour_idx), giữ interaction quan trọng nhất (max)
+        rows, cols, values = self._reduce_cells(
+            interaction_users_idx[valid], interaction_tours_idx[valid], scores, len(tour_ids)
+        )
+        
+        # Tạo ma trận (dense hoặc sparse CSR)
+        matrix = self._create_matrix(rows, cols, values, (len(user_ids), len(tour_ids)))
+        
+        # Lưu ma trận gốc, preprocessing chạy in-place trên bản copy
+        self.user_tour_matrix_raw = matrix
+        matrix = matrix.copy()
+        self._build_tour_cooccurrence(self.user_tour_matrix_raw)
+        self._user_interaction_counts = self._count_nonzero(self.user_tour_matrix_raw, axis=1)
+        self._tour_interaction_counts = self._count_nonzero(self.user_tour_matrix_raw, axis=0)
         self.user_ids = user_ids
         self.tour_ids = tour_ids
         self.user_id_to_idx = user_id_to_idx
         self.tour_id_to_idx = tour_id_to_idx
+        self.tour_metadata = {tour.id: tour_to_metadata(tour) for tour in tours}
         
         # Apply preprocessing
         matrix = self._preprocess_matrix(matrix)
         
         self.user_tour_matrix = matrix
+        self._clear_pending_updates()
         self._matrix_built = True
+        self.model_version = self._next_model_version()
         self._last_matrix_build_time = datetime.now(timezone.utc)
+        self._last_cache_check_time = None
+        self._dirty_user_indices = set()
+        self._dirty_tour_indices = set()
         
         # Invalidate similarity caches khi matrix thay đổi
         self._user_similarity_calculated = False
         self._tour_similarity_calculated = False
         self.user_similarity = None
         self.tour_similarity = None
+        self.user_neighbors = None
+        self.tour_neighbors = None
+        self.user_ann_index = None
+        self.als_model = None
+        self._als_stale_users = set()
+        self._snapshot_mapped = False
+        
+        return matrix
+    
+    @staticmethod
+    def _reduce_cells(
+        users_idx: np.ndarray,
+        tours_idx: np.ndarray,
+        scores: np.ndarray,
+        n_tours: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Gom các interactions theo ô (user_idx, tour_idx) bằng sort + reduceat
+        
+        Giống việc duyệt interactions theo thứ tự load: nếu ô đã có điểm > 0 thì lấy max,
+        ngược lại ghi đè. Kết quả là max của ô nếu có điểm dương, nếu không là điểm cuối cùng.
+        
+        Args:
+            users_idx: Index user của từng interaction
+            tours_idx: Index tour của từng interaction
+            scores: Điểm (đã time decay) của từng interaction
+            n_tours: Số tours (để tạo key của ô)
+            
+        Returns:
+            (rows, cols, values) của các ô
+        """
+        if len(scores) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+        
+        keys = users_idx.astype(np.int64) * n_tours + tours_idx
+        order = np.argsort(keys, kind="stable")  # stable: giữ thứ tự interactions trong mỗi ô
+        sorted_keys, sorted_scores = keys[order], scores[order]
+        
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], len(sorted_keys)]
+        
+        cell_max = np.maximum.reduceat(sorted_scores, starts)
+        values = np.where(cell_max > 0, cell_max, sorted_scores[ends - 1])
+        cell_keys = sorted_keys[starts]
+        return cell_keys // n_tours, cell_keys % n_tours, values
+    
+    def _create_matrix(
+        self,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        values: np.ndarray,
+        shape: Tuple[int, int]
+    ) -> Matrix:
+        """
+        Tạo ma trận User-Tour từ các ô đã gom
         
+        Args:
+            rows: Index user của từng ô
+            cols: Index tour của từng ô
+            values: Điểm của từng ô
+            shape: (số users, số tours)
+            
+        Returns:
+            Ma trận dense hoặc CSR (nếu use_sparse)
+        """
+        if self.use_sparse:
+            matrix = sp.csr_matrix((values, (rows, cols)), shape=shape)
+            matrix.eliminate_zeros()
+            return matrix
+        
+        matrix = np.zeros(shape)
+        matrix[rows, cols] = values
         return matrix
     
-    def _get_data_hash(self) -> Optional[str]:
+    @staticmethod
+    def _map_ids(values: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """
+        Map IDs sang index trong danh sách ids bằng searchsorted (không loop)
+        
+        Returns:
+            Array index, -1 cho các giá trị không có trong ids
+        """
+        if len(ids) == 0:
+            return np.full(len(values), -1, dtype=np.int64)
+        sorter = np.argsort(ids, kind="stable")
+        positions = np.clip(np.searchsorted(ids, values, sorter=sorter), 0, len(ids) - 1)
+        found = ids[sorter[positions]] == values
+        return np.where(found, sorter[positions], -1)
+    
+    @staticmethod
+    def _interaction_key(user_ids: np.ndarray, tour_ids: np.ndarray) -> np.ndarray:
+        """Key int64 duy nhất cho cặp (user_id, tour_id)"""
+        return (np.asarray(user_ids, dtype=np.int64) << 32) | np.asarray(tour_ids, dtype=np.int64)
+    
+    def _build_interaction_history(
+        self,
+        user_ids: np.ndarray,
+        tour_ids: np.ndarray,
+        type_codes: np.ndarray,
+        types: List[Optional[str]]
+    ):
+        """Sắp xếp interaction types theo key (user_id, tour_id) để tra bằng searchsorted"""
+        keys = self._interaction_key(user_ids, tour_ids)
+        order = np.argsort(keys, kind="stable")
+        self._interaction_history_keys = keys[order]
+        self._interaction_history_type_codes = type_codes[order]
+        self._interaction_types = types
+        self._pending_interaction_history = {}
+    
+    def _get_interaction_history(self, user_id: int, tour_id: int) -> List[Optional[str]]:
+        """
+        Lấy interaction types của user với tour (theo thứ tự load, gồm cả interactions mới)
+        
+        Returns:
+            List interaction_type (có thể chứa None)
+        """
+        history = []
+        if self._interaction_history_keys is not None:
+            key = self._interaction_key(user_id, tour_id)
+            start = np.searchsorted(self._interaction_history_keys, key, side="left")
+            end = np.searchsorted(self._interaction_history_keys, key, side="right")
+            history = [self._interaction_types[code] for code in self._interaction_history_type_codes[start:end]]
+        return history + self._pending_interaction_history.get((user_id, tour_id), [])
+    
+    def _get_available_tour(self, tour_id: int) -> Optional[Dict]:
+        """
+        Lấy metadata của tour nếu tour còn được phép recommend
+        (active, approved và không bị banned)
+        
+        Args:
+            tour_id: ID của tour
+            
+        Returns:
+            Metadata của tour hoặc None
+        """
+        if not self.tour_metadata:
+            return None
+        
+        tour = self.tour_metadata.get(tour_id)
+        if tour and tour["is_active"] and tour["is_approved"] and not tour["is_banned"]:
+            return tour
+        return None
+    
+    def _build_tour_cooccurrence(self, raw_matrix: Matrix):
+        """
+        Tính trước ma trận co-occurrence Tour × Tour và gắn vào model
+        
+        Args:
+            raw_matrix: Ma trận User-Tour gốc (chưa preprocess)
+        """
+        self.tour_cooccurrence_positive, self.tour_cooccurrence_sum = self._compute_tour_cooccurrence(raw_matrix)
+    
+    @staticmethod
+    def _compute_tour_cooccurrence(raw_matrix: Matrix) -> Tuple[sp.csr_matrix, sp.csr_matrix]:
+        """
+        Ma trận co-occurrence Tour × Tour bằng sparse matrix products
+        
+        Với B = (raw > 0) và P = max(raw, 0):
+        - tour_cooccurrence_positive = B^T · P
+        - tour_cooccurrence_sum = B^T · raw
+        
+        Args:
+            raw_matrix: Ma trận User-Tour gốc (chưa preprocess)
+            
+        Returns:
+            (tour_cooccurrence_positive, tour_cooccurrence_sum) dạng CSR
+        """
+        raw_csr = sp.csr_matrix(raw_matrix)
+        interacted = (raw_csr > 0).astype(np.float64)
+        positive = raw_csr.multiply(raw_csr > 0).tocsr()
+        return (interacted.T @ positive).tocsr(), (interacted.T @ raw_csr).tocsr()
+    
+    @staticmethod
+    def _is_empty(matrix: Optional[Matrix]) -> bool:
+        """Kiểm tra ma trận rỗng (không có users hoặc tours), dùng được cho cả dense và sparse"""
+        return matrix is None or matrix.shape[0] == 0 or len(matrix.shape) < 2 or matrix.shape[1] == 0
+    
+    @staticmethod
+    def _get_row(matrix: Matrix, row_idx: int) -> np.ndarray:
+        """Lấy một hàng của ma trận dưới dạng dense 1D array"""
+        if sp.issparse(matrix):
+            return matrix.getrow(row_idx).toarray().ravel()
+        return matrix[row_idx]
+    
+    @staticmethod
+    def _get_rows(matrix: Matrix, row_indices: np.ndarray) -> np.ndarray:
+        """Lấy nhiều hàng của ma trận dưới dạng dense 2D array"""
+        if sp.issparse(matrix):
+            return matrix[row_indices].toarray()
+        return matrix[row_indices]
+    
+    @staticmethod
+    def _count_nonzero(matrix: Matrix, axis: int) -> np.ndarray:
+        """Đếm số phần tử khác 0 theo axis, dùng được cho cả dense và sparse"""
+        if sp.issparse(matrix):
+            return np.asarray(matrix.getnnz(axis=axis))
+        return np.count_nonzero(matrix, axis=axis)
+    
+    @staticmethod
+    def _grow_matrix(matrix: Matrix, n_rows: int, n_cols: int) -> Matrix:
+        """
+        Mở rộng ma trận thành (n_rows, n_cols), các ô mới bằng 0
+        Dùng khi có users/tours mới xuất hiện giữa hai lần build
+        """
+        if sp.issparse(matrix):
+            extra_rows = n_rows - matrix.shape[0]
+            indptr = np.concatenate([matrix.indptr, np.full(extra_rows, matrix.indptr[-1], dtype=matrix.indptr.dtype)])
+            return sp.csr_matrix((matrix.data, matrix.indices, indptr), shape=(n_rows, n_cols))
+        
+        grown = np.zeros((n_rows, n_cols), dtype=matrix.dtype)
+        grown[:matrix.shape[0], :matrix.shape[1]] = matrix
+        return grown
+    
+    @staticmethod
+    def _matrix_nbytes(matrix: Matrix) -> int:
+        """Dung lượng bộ nhớ của ma trận (dense hoặc sparse)"""
+        if sp.issparse(matrix):
+            return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+        return matrix.nbytes
+    
+    def _cache_ttl_valid(self) -> bool:
+        """Cache TTL còn hiệu lực (tính từ lần build hoặc lần xác nhận data chưa đổi gần nhất)"""
+        last_check_time = self._last_cache_check_time or self._last_matrix_build_time
+        if not last_check_time:
+            return False
+        elapsed = (datetime.now(timezone.utc) - last_check_time).total_seconds()
+        return elapsed < self.cache_ttl_seconds
+    
+    def refresh_needed(self, db: Optional[Session] = None) -> bool:
+        """
+        Kiểm tra model có cần build lại không (giống build_user_tour_matrix nhưng không build),
+        dùng để build model mới ở bên cạnh trong khi model này vẫn tiếp tục phục vụ
+        
+        Args:
+            db: Session dùng để tính data hash (default: self.db / session_factory)
+            
+        Returns:
+            True nếu model chưa build, hoặc cache hết hạn và data đã thay đổi
+        """
+        if not self._matrix_built or self.user_tour_matrix is None:
+            return True
+        if self._cache_ttl_valid():
+            return False
+        if not self.enable_caching:
+            return True
+        
+        current_hash = self._get_data_hash(db)
+        if current_hash != self._matrix_hash:
+            return True
+        # Data chưa đổi: gia hạn cache để không phải hash lại ở mỗi request
+        self._last_cache_check_time = datetime.now(timezone.utc)
+        return False
+    
+    def mark_stale(self):
+        """
+        Đánh dấu model cần build lại ở lần refresh tiếp theo,
+        khác invalidate_cache: state hiện tại vẫn phục vụ được cho đến khi bị thay thế
+        """
+        self._matrix_hash = None
+        self._last_cache_check_time = None
+        self._last_matrix_build_time = None
+        self.state_revision += 1
+    
+    def advance_data_version(self, data_version: Optional[int]) -> bool:
+        """
+        Chuyển model sang data version mới sau khi đã áp dụng incremental thay đổi
+        làm tăng version đó (chỉ khi model đang ở đúng version liền trước, catalog
+        fingerprint giữ nguyên), nhờ vậy interactions đã áp dụng không kích hoạt
+        rebuild ở lần kiểm tra sau
+        
+        Args:
+            data_version: Version trả về khi lưu interaction (None: bỏ qua)
+            
+        Returns:
+            True nếu model đã chuyển sang data_version
+        """
+        if data_version is None:
+            return False
+        with self._cache_lock:
+            previous = data_version_hash(data_version - 1)
+            if not self._matrix_hash or not self._matrix_hash.startswith(previous):
+                return False
+            catalog = self._matrix_hash[len(previous):]
+            self._matrix_hash = data_version_hash(data_version, catalog)
+            self.state_revision += 1
+            return True
+    
+    def _get_data_hash(self, db: Optional[Session] = None) -> Optional[str]:
         """
         Tính hash của dữ liệu để detect changes
         Sử dụng để invalidate cache khi data thay đổi
         
+        Dùng data version (một lần đọc theo primary key) kèm catalog fingerprint
+        (tours / users do service khác ghi, không tăng version) nếu có bảng version,
+        ngược lại hash counts và timestamp interaction mới nhất
+        
+        Args:
+            db: Session dùng để query (default: self.db / session_factory)
+        
         Returns:
             Hash string của dữ liệu
         """
+        with self._db_session(db) as session:
+            return self._compute_data_hash(session)
+    
+    def _compute_data_hash(self, db: Optional[Session]) -> Optional[str]:
+        """Phần tính hash của _get_data_hash với session đã chọn"""
+        if db is None:
+            return None
+        data_version = get_data_version(db)
+        if data_version is not None:
+            return data_version_hash(data_version, get_catalog_fingerprint(db))
+        
         try:
             # Lấy count của interactions và tours để tạo hash
-            interactions_count = self.db.query(UserTourInteraction).count()
-            tours_count = self.db.query(Tour).filter(
+            interactions_count = db.query(UserTourInteraction).count()
+            tours_count = db.query(Tour).filter(
                 Tour.is_active == True,
                 Tour.is_approved == True,
                 Tour.is_banned == False
             ).count()
-            users_count = self.db.query(UserProfile).count()
+            users_count = db.query(UserProfile).count()
             
             # Lấy latest interaction timestamp
-            latest_interaction = self.db.query(UserTourInteraction).order_by(
+            latest_interaction = db.query(UserTourInteraction).order_by(
                 UserTourInteraction.created_at.desc()
             ).first()
             latest_timestamp = latest_interaction.created_at.isoformat() if latest_interaction and latest_interaction.created_at else ""
@@ -227,17 +672,21 @@ class CollaborativeFiltering:
         except Exception:
             return None
     
-    def _preprocess_matrix(self, matrix: np.ndarray) -> np.ndarray:
+    def _preprocess_matrix(self, matrix: Matrix) -> Matrix:
         """
         Áp dụng các bước preprocessing lên matrix
+        Hỗ trợ cả dense và sparse (CSR), sparse không bị densify
+        
+        Các bước thao tác in-place trên matrix truyền vào (caller giữ bản gốc nếu cần),
+        không tạo thêm bản copy nào cho từng bước.
         
         Args:
-            matrix: Ma trận User-Tour gốc
+            matrix: Ma trận User-Tour gốc (sẽ bị thay đổi)
             
         Returns:
             Ma trận đã được preprocess
         """
-        if matrix.size == 0:
+        if self._is_empty(matrix):
             return matrix
         
         # 1. Remove outliers
@@ -254,10 +703,25 @@ class CollaborativeFiltering:
         
         return matrix
     
-    def _remove_outliers(self, matrix: np.ndarray) -> np.ndarray:
+    def _iqr_bounds(self, values: np.ndarray) -> Optional[Tuple[float, float]]:
         """
-        Loại bỏ outliers trong matrix
-        Sử dụng IQR (Interquartile Range) method
+        Tính bounds theo IQR (Interquartile Range) trên các giá trị > 0
+        
+        Returns:
+            (lower_bound, upper_bound), None nếu không có giá trị > 0
+        """
+        positive_values = values[values > 0]
+        if len(positive_values) == 0:
+            return None
+        
+        q1, q3 = np.percentile(positive_values, [25, 75])
+        iqr = q3 - q1
+        return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+    
+    def _remove_outliers(self, matrix: Matrix) -> Matrix:
+        """
+        Loại bỏ outliers trong matrix (in-place)
+        Sử dụng IQR (Interquartile Range) method, cap các giá trị vượt upper bound
         
         Args:
             matrix: Ma trận User-Tour
@@ -265,89 +729,127 @@ class CollaborativeFiltering:
         Returns:
             Ma trận đã loại bỏ outliers
         """
-        # Chỉ xử lý các giá trị > 0 (có interactions)
-        non_zero_values = matrix[matrix > 0]
+        if sp.issparse(matrix):
+            return self._remove_outliers_sparse(matrix)
         
-        if len(non_zero_values) == 0:
+        # Chỉ xử lý các giá trị > 0 (có interactions)
+        bounds = self._iqr_bounds(matrix.ravel())
+        if bounds is None:
+            self._outlier_upper_bound = None
             return matrix
         
-        # Tính Q1, Q3, IQR
-        q1 = np.percentile(non_zero_values, 25)
-        q3 = np.percentile(non_zero_values, 75)
-        iqr = q3 - q1
+        lower_bound, upper_bound = bounds
+        self._outlier_upper_bound = upper_bound
         
-        # Tính bounds
-        lower_bound = q1 - 1.5 * iqr
-        upper_bound = q3 + 1.5 * iqr
+        # Log số outliers (đếm trước khi cap); giá trị dưới lower bound được giữ nguyên
+        outliers_count = np.count_nonzero(matrix > upper_bound) + np.count_nonzero(matrix < lower_bound)
         
         # Cap outliers (thay vì xóa, giới hạn giá trị)
-        matrix_cleaned = matrix.copy()
-        matrix_cleaned[matrix_cleaned > upper_bound] = upper_bound
-        matrix_cleaned[matrix_cleaned < lower_bound] = matrix_cleaned[matrix_cleaned < lower_bound]  # Giữ nguyên giá trị âm nếu có
+        np.minimum(matrix, upper_bound, out=matrix)
         
-        # Log số outliers đã xử lý
-        outliers_count = np.sum((matrix > upper_bound) | (matrix < lower_bound))
         if outliers_count > 0:
             warnings.warn(f"Đã xử lý {outliers_count} outliers (bounds: [{lower_bound:.2f}, {upper_bound:.2f}])")
         
-        return matrix_cleaned
+        return matrix
     
-    def _handle_sparse_data(self, matrix: np.ndarray) -> np.ndarray:
+    def _remove_outliers_sparse(self, matrix: sp.csr_matrix) -> sp.csr_matrix:
         """
-        Xử lý sparse data
-        - Loại bỏ users/tours quá sparse (ít interactions)
-        - Impute missing values nếu cần
+        Phiên bản sparse của _remove_outliers, chỉ thao tác trên các phần tử đã lưu
         
         Args:
-            matrix: Ma trận User-Tour
+            matrix: Ma trận User-Tour dạng CSR
             
         Returns:
-            Ma trận đã xử lý sparse data
+            Ma trận CSR đã cap outliers
         """
-        if matrix.size == 0:
+        bounds = self._iqr_bounds(matrix.data)
+        if bounds is None:
+            self._outlier_upper_bound = None
             return matrix
         
-        matrix_processed = matrix.copy()
+        lower_bound, upper_bound = bounds
+        self._outlier_upper_bound = upper_bound
+        
+        # Đếm giống bản dense: các ô 0 không lưu cũng là outlier nếu lower_bound > 0
+        outliers_count = np.count_nonzero(matrix.data > upper_bound) + np.count_nonzero(matrix.data < lower_bound)
+        if lower_bound > 0:
+            outliers_count += matrix.shape[0] * matrix.shape[1] - matrix.nnz
         
-        # Tính sparsity
-        total_elements = matrix.size
-        non_zero_elements = np.count_nonzero(matrix)
-        sparsity = 1 - (non_zero_elements / total_elements)
+        np.minimum(matrix.data, upper_bound, out=matrix.data)
+        
+        if outliers_count > 0:
+            warnings.warn(f"Đã xử lý {outliers_count} outliers (bounds: [{lower_bound:.2f}, {upper_bound:.2f}])")
         
-        # Nếu quá sparse (> 95%), cảnh báo
+        return matrix
+    
+    def _warn_if_too_sparse(self, n_nonzero: int, shape: Tuple[int, int]):
+        """Cảnh báo nếu tỉ lệ ô 0 vượt sparsity_threshold"""
+        sparsity = 1 - (n_nonzero / (shape[0] * shape[1]))
         if sparsity > self.sparsity_threshold:
             warnings.warn(
                 f"Matrix rất sparse ({sparsity*100:.1f}% là 0). "
                 f"Chất lượng recommendations có thể bị ảnh hưởng."
             )
+    
+    def _handle_sparse_data(self, matrix: Matrix) -> Matrix:
+        """
+        Xử lý sparse data (in-place)
+        - Users/tours quá sparse (ít hơn 2 interactions) bị set về 0
+          (không xóa users vì có thể cần cho cold start)
+        
+        Args:
+            matrix: Ma trận User-Tour
+            
+        Returns:
+            Ma trận đã xử lý sparse data
+        """
+        if self._is_empty(matrix):
+            return matrix
+        
+        if sp.issparse(matrix):
+            return self._handle_sparse_data_sparse(matrix)
+        
+        # Một lần duyệt: mask các ô có interaction, đếm theo cả users và tours
+        interacted = matrix != 0
+        user_interaction_counts = interacted.sum(axis=1)
+        tour_interaction_counts = interacted.sum(axis=0)
+        del interacted
+        
+        self._warn_if_too_sparse(int(user_interaction_counts.sum()), matrix.shape)
+        
+        matrix[user_interaction_counts < 2, :] = 0
+        matrix[:, tour_interaction_counts < 2] = 0
         
-        # Loại bỏ users quá sparse (ít hơn 2 interactions)
-        user_interaction_counts = np.count_nonzero(matrix, axis=1)
-        sparse_users = user_interaction_counts < 2
+        return matrix
+    
+    def _handle_sparse_data_sparse(self, matrix: sp.csr_matrix) -> sp.csr_matrix:
+        """
+        Phiên bản sparse của _handle_sparse_data
+        Đếm interactions bằng getnnz và zero-out users/tours quá sparse bằng mask
         
-        if np.any(sparse_users):
-            sparse_user_indices = np.where(sparse_users)[0]
-            # Không xóa users, chỉ đánh dấu (vì có thể cần cho cold start)
-            # Thay vào đó, set interactions của họ về 0
-            for user_idx in sparse_user_indices:
-                matrix_processed[user_idx, :] = 0
+        Args:
+            matrix: Ma trận User-Tour dạng CSR (không chứa explicit zeros)
+            
+        Returns:
+            Ma trận CSR đã xử lý sparse data
+        """
+        self._warn_if_too_sparse(matrix.nnz, matrix.shape)
         
-        # Loại bỏ tours quá sparse (ít hơn 2 interactions)
-        tour_interaction_counts = np.count_nonzero(matrix, axis=0)
-        sparse_tours = tour_interaction_counts < 2
+        # Users/tours có ít hơn 2 interactions bị set về 0
+        keep_users = matrix.getnnz(axis=1) >= 2
+        keep_tours = matrix.getnnz(axis=0) >= 2
         
-        if np.any(sparse_tours):
-            sparse_tour_indices = np.where(sparse_tours)[0]
-            # Set interactions của tours này về 0
-            for tour_idx in sparse_tour_indices:
-                matrix_processed[:, tour_idx] = 0
+        row_indices = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        keep = keep_users[row_indices] & keep_tours[matrix.indices]
+        matrix.data[~keep] = 0
+        matrix.eliminate_zeros()
         
-        return matrix_processed
+        return matrix
     
-    def _normalize_matrix(self, matrix: np.ndarray) -> np.ndarray:
+    def _normalize_matrix(self, matrix: Matrix) -> Matrix:
         """
-        Normalize matrix bằng mean centering
-        Trừ đi mean của mỗi user để giảm user bias
+        Normalize matrix bằng mean centering (in-place)
+        Trừ đi mean của mỗi user (chỉ tính và chỉ trừ trên các giá trị > 0) để giảm user bias
         
         Args:
             matrix: Ma trận User-Tour
@@ -355,33 +857,54 @@ class CollaborativeFiltering:
         Returns:
             Ma trận đã được normalize
         """
-        if matrix.size == 0:
+        if self._is_empty(matrix):
             return matrix
         
-        matrix_normalized = matrix.copy()
+        if sp.issparse(matrix):
+            return self._normalize_matrix_sparse(matrix)
         
-        # Tính mean của mỗi user (chỉ tính trên các giá trị > 0)
-        self.user_means = np.zeros(matrix.shape[0])
-        for i in range(matrix.shape[0]):
-            user_ratings = matrix[i, :]
-            non_zero_ratings = user_ratings[user_ratings > 0]
-            if len(non_zero_ratings) > 0:
-                self.user_means[i] = np.mean(non_zero_ratings)
-            else:
-                self.user_means[i] = 0
-        
-        # Mean centering: trừ đi mean của mỗi user
-        for i in range(matrix.shape[0]):
-            if self.user_means[i] > 0:
-                # Chỉ normalize các giá trị > 0
-                mask = matrix[i, :] > 0
-                matrix_normalized[i, mask] = matrix[i, mask] - self.user_means[i]
+        # Masked row means: mean của mỗi user chỉ trên các giá trị > 0
+        positive = matrix > 0
+        counts = positive.sum(axis=1)
+        sums = np.sum(matrix, axis=1, where=positive)
+        self.user_means = np.divide(sums, counts, out=np.zeros(matrix.shape[0]), where=counts > 0)
         
         # Tính global mean (để có thể denormalize sau)
-        non_zero_values = matrix[matrix > 0]
-        self.global_mean = np.mean(non_zero_values) if len(non_zero_values) > 0 else 0
+        total_count = counts.sum()
+        self.global_mean = sums.sum() / total_count if total_count > 0 else 0
         
-        return matrix_normalized
+        # Mean centering in-place, chỉ trên các ô đã quan sát (> 0)
+        np.subtract(matrix, self.user_means[:, None], out=matrix, where=positive)
+        
+        return matrix
+    
+    def _normalize_matrix_sparse(self, matrix: sp.csr_matrix) -> sp.csr_matrix:
+        """
+        Phiên bản sparse của _normalize_matrix
+        Mean của mỗi user chỉ tính trên các giá trị > 0, chỉ trừ mean ở các giá trị > 0
+        
+        Args:
+            matrix: Ma trận User-Tour dạng CSR
+            
+        Returns:
+            Ma trận CSR đã được normalize
+        """
+        n_users = matrix.shape[0]
+        row_indices = np.repeat(np.arange(n_users), np.diff(matrix.indptr))
+        positive = matrix.data > 0
+        
+        sums = np.bincount(row_indices[positive], weights=matrix.data[positive], minlength=n_users)
+        counts = np.bincount(row_indices[positive], minlength=n_users)
+        self.user_means = np.divide(sums, counts, out=np.zeros(n_users), where=counts > 0)
+        
+        positive_count = counts.sum()
+        self.global_mean = sums.sum() / positive_count if positive_count > 0 else 0
+        
+        matrix.data[positive] -= self.user_means[row_indices[positive]]
+        # Giá trị bằng đúng mean trở thành 0, giống bản dense (coi như chưa tương tác)
+        matrix.eliminate_zeros()
+        
+        return matrix
     
     def denormalize_score(self, normalized_score: float, user_id: int) -> float:
         """
@@ -416,19 +939,26 @@ class CollaborativeFiltering:
         Returns:
             User similarity matrix
         """
+        self._flush_row_updates()
         # Lazy loading: Chỉ tính nếu chưa tính hoặc force
         if not force_recalculate and self._user_similarity_calculated and self.user_similarity is not None:
+            # Chỉ cập nhật hàng/cột của các users đã thay đổi
+            if self._dirty_user_indices:
+                with self._cache_lock:
+                    self._update_user_similarity()
             return self.user_similarity
         
         if self.user_tour_matrix is None:
             self.build_user_tour_matrix()
         
-        if self.user_tour_matrix.size == 0:
+        if self._is_empty(self.user_tour_matrix):
             return np.array([])
         
         # Tính cosine similarity giữa các users
         with self._cache_lock:  # Thread-safe
             self.user_similarity = cosine_similarity(self.user_tour_matrix)
+            self._user_norms = self._row_norms(self.user_tour_matrix)
+            self._dirty_user_indices = set()
             self._user_similarity_calculated = True
         
         return self.user_similarity
@@ -444,23 +974,565 @@ class CollaborativeFiltering:
         Returns:
             Tour similarity matrix
         """
+        self._flush_row_updates()
         # Lazy loading: Chỉ tính nếu chưa tính hoặc force
         if not force_recalculate and self._tour_similarity_calculated and self.tour_similarity is not None:
+            # Chỉ cập nhật hàng/cột của các tours đã thay đổi
+            if self._dirty_tour_indices:
+                with self._cache_lock:
+                    self._update_tour_similarity()
             return self.tour_similarity
         
         if self.user_tour_matrix is None:
             self.build_user_tour_matrix()
         
-        if self.user_tour_matrix.size == 0:
+        if self._is_empty(self.user_tour_matrix):
             return np.array([])
         
         # Tính cosine similarity giữa các tours (transpose matrix)
         with self._cache_lock:  # Thread-safe
             self.tour_similarity = cosine_similarity(self.user_tour_matrix.T)
+            self._tour_norms = self._row_norms(self.user_tour_matrix.T)
+            self._dirty_tour_indices = set()
             self._tour_similarity_calculated = True
         
         return self.tour_similarity
     
+    def _update_user_similarity(self):
+        """
+        Cập nhật similarity cho các users đã thay đổi (dirty) với norms đã cache
+        Chi phí O(số users thay đổi × N) thay vì tính lại toàn bộ N × N
+        """
+        dirty = np.array(sorted(self._dirty_user_indices), dtype=np.int64)
+        self._dirty_user_indices = set()
+        
+        dirty_rows = self.user_tour_matrix[dirty]
+        self._user_norms[dirty] = self._row_norms(dirty_rows)
+        similarities = self._cosine_rows(dirty_rows, self.user_tour_matrix, self._user_norms[dirty], self._user_norms)
+        
+        self.user_similarity[dirty, :] = similarities
+        self.user_similarity[:, dirty] = similarities.T
+    
+    def _update_tour_similarity(self):
+        """
+        Cập nhật similarity cho các tours đã thay đổi (dirty) với norms đã cache
+        Chi phí O(số tours thay đổi × M) phép tích vô hướng thay vì tính lại toàn bộ M × M
+        """
+        dirty = np.array(sorted(self._dirty_tour_indices), dtype=np.int64)
+        self._dirty_tour_indices = set()
+        
+        tour_vectors = self.user_tour_matrix.T
+        dirty_vectors = self.user_tour_matrix[:, dirty].T
+        self._tour_norms[dirty] = self._row_norms(dirty_vectors)
+        similarities = self._cosine_rows(dirty_vectors, tour_vectors, self._tour_norms[dirty], self._tour_norms)
+        
+        self.tour_similarity[dirty, :] = similarities
+        self.tour_similarity[:, dirty] = similarities.T
+    
+    @staticmethod
+    def _row_norms(matrix: Matrix) -> np.ndarray:
+        """L2 norm của từng hàng (dense hoặc sparse)"""
+        if sp.issparse(matrix):
+            return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        return np.sqrt(np.einsum("ij,ij->i", matrix, matrix))
+    
+    @staticmethod
+    def _cosine_rows(rows: Matrix, matrix: Matrix, row_norms: np.ndarray, matrix_norms: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity giữa một số hàng và toàn bộ hàng của matrix, dùng norms có sẵn
+        Vector 0 có similarity 0 (giống sklearn cosine_similarity)
+        """
+        return cosine_similarity_rows(rows, matrix, row_norms, matrix_norms)
+    
+    def _tour_vectors(self) -> Matrix:
+        """Vectors của tours (mỗi hàng là một tour), CSR khi ở sparse mode"""
+        tour_vectors = self.user_tour_matrix.T
+        return tour_vectors.tocsr() if sp.issparse(tour_vectors) else tour_vectors
+    
+    def calculate_user_neighbors(self, force_recalculate: bool = False) -> Optional[NeighborIndex]:
+        """
+        Tính top K users tương tự cho mỗi user (thay cho ma trận user similarity dense)
+        
+        Args:
+            force_recalculate: Force tính lại ngay cả khi đã có cache
+            
+        Returns:
+            NeighborIndex của users (None nếu ma trận rỗng)
+        """
+        self._flush_row_updates()
+        if not force_recalculate and self._user_similarity_calculated and self.user_neighbors is not None:
+            # Chỉ tính lại láng giềng liên quan tới các users đã thay đổi
+            if self._dirty_user_indices:
+                with self._cache_lock:
+                    dirty = np.array(sorted(self._dirty_user_indices), dtype=np.int64)
+                    self._dirty_user_indices = set()
+                    self._user_norms[dirty] = self._row_norms(self.user_tour_matrix[dirty])
+                    self.user_neighbors.update(self.user_tour_matrix, self._user_norms, dirty)
+            return self.user_neighbors
+        
+        if self.user_tour_matrix is None:
+            self.build_user_tour_matrix()
+        
+        if self._is_empty(self.user_tour_matrix):
+            return None
+        
+        with self._cache_lock:  # Thread-safe
+            self._user_norms = self._row_norms(self.user_tour_matrix)
+            self.user_neighbors = self._new_neighbor_index(self.user_tour_matrix, self._user_norms)
+            self._dirty_user_indices = set()
+            self._user_similarity_calculated = True
+        
+        return self.user_neighbors
+    
+    def calculate_tour_neighbors(self, force_recalculate: bool = False) -> Optional[NeighborIndex]:
+        """
+        Tính top K tours tương tự cho mỗi tour (thay cho ma trận tour similarity dense)
+        
+        Args:
+            force_recalculate: Force tính lại ngay cả khi đã có cache
+            
+        Returns:
+            NeighborIndex của tours (None nếu ma trận rỗng)
+        """
+        self._flush_row_updates()
+        if not force_recalculate and self._tour_similarity_calculated and self.tour_neighbors is not None:
+            # Chỉ tính lại láng giềng liên quan tới các tours đã thay đổi
+            if self._dirty_tour_indices:
+                with self._cache_lock:
+                    dirty = np.array(sorted(self._dirty_tour_indices), dtype=np.int64)
+                    self._dirty_tour_indices = set()
+                    tour_vectors = self._tour_vectors()
+                    self._tour_norms[dirty] = self._row_norms(tour_vectors[dirty])
+                    self.tour_neighbors.update(tour_vectors, self._tour_norms, dirty)
+            return self.tour_neighbors
+        
+        if self.user_tour_matrix is None:
+            self.build_user_tour_matrix()
+        
+        if self._is_empty(self.user_tour_matrix):
+            return None
+        
+        with self._cache_lock:  # Thread-safe
+            tour_vectors = self._tour_vectors()
+            self._tour_norms = self._row_norms(tour_vectors)
+            self.tour_neighbors = self._new_neighbor_index(tour_vectors, self._tour_norms)
+            self._dirty_tour_indices = set()
+            self._tour_similarity_calculated = True
+        
+        return self.tour_neighbors
+    
+    def build_user_ann_index(self, force_rebuild: bool = False) -> Optional[IVFIndex]:
+        """
+        Build IVF index để tìm users tương tự gần đúng (không tính similarity N × N)
+        
+        Args:
+            force_rebuild: Force build lại (tính lại centroids) ngay cả khi đã có index
+            
+        Returns:
+            IVFIndex của users (None nếu ma trận rỗng)
+        """
+        self._flush_row_updates()
+        if not force_rebuild and self._user_similarity_calculated and self.user_ann_index is not None:
+            # Chỉ gán lại cụm cho các users đã thay đổi
+            if self._dirty_user_indices:
+                with self._cache_lock:
+                    dirty = np.array(sorted(self._dirty_user_indices), dtype=np.int64)
+                    self._dirty_user_indices = set()
+                    self._user_norms[dirty] = self._row_norms(self.user_tour_matrix[dirty])
+                    self.user_ann_index.update(self.user_tour_matrix, self._user_norms, dirty)
+            return self.user_ann_index
+        
+        if self.user_tour_matrix is None:
+            self.build_user_tour_matrix()
+        
+        if self._is_empty(self.user_tour_matrix):
+            return None
+        
+        with self._cache_lock:  # Thread-safe
+            self._user_norms = self._row_norms(self.user_tour_matrix)
+            self.user_ann_index = self._new_ann_index(self.user_tour_matrix, self._user_norms)
+            self._dirty_user_indices = set()
+            self._user_similarity_calculated = True
+        
+        return self.user_ann_index
+    
+    def train_als(self, force_retrain: bool = False) -> Optional[ALSModel]:
+        """
+        Train implicit ALS trên ma trận ratings gốc (đã time decay, giữ max mỗi ô),
+        cắt outliers theo upper bound của lần build gần nhất
+        
+        Args:
+            force_retrain: Force train lại ngay cả khi đã có factors
+            
+        Returns:
+            ALSModel (None nếu ma trận rỗng)
+        """
+        self._flush_row_updates()
+        if not force_retrain and self.als_model is not None:
+            return self.als_model
+        
+        if self.user_tour_matrix is None:
+            self.build_user_tour_matrix()
+        
+        if self._is_empty(self.user_tour_matrix_raw):
+            return None
+        
+        with self._cache_lock:  # Thread-safe
+            self._als_stale_users = set()
+            self.als_model = self._fit_als(self.user_tour_matrix_raw)
+        
+        return self.als_model
+    
+    def _fit_als(self, raw_matrix: Matrix) -> ALSModel:
+        """
+        Train ALSModel trên ma trận ratings gốc theo cấu hình của model
+        (không đọc / ghi state của model, chạy được bên ngoài lock trên bản copy)
+        """
+        ratings = sp.csr_matrix(raw_matrix)
+        ratings.data = self._als_ratings(ratings.data)
+        return ALSModel.fit(
+            ratings,
+            n_factors=self.als_factors,
+            regularization=self.als_regularization,
+            alpha=self.als_alpha,
+            n_iter=self.als_iterations
+        )
+    
+    def _new_neighbor_index(self, vectors: Matrix, norms: np.ndarray) -> NeighborIndex:
+        """NeighborIndex top K láng giềng của các hàng trong vectors theo cấu hình của model"""
+        return NeighborIndex.build(vectors, norms, self.n_neighbors)
+    
+    def _new_ann_index(self, matrix: Matrix, norms: np.ndarray) -> IVFIndex:
+        """IVFIndex của các hàng trong matrix theo cấu hình của model"""
+        return IVFIndex.build(matrix, norms, n_lists=self.ann_n_lists, n_probe=self.ann_n_probe)
+    
+    def _als_ratings(self, ratings: np.ndarray) -> np.ndarray:
+        """Ratings dùng cho ALS: cắt outliers theo upper bound của lần build gần nhất"""
+        if self.remove_outliers and self._outlier_upper_bound is not None:
+            return np.minimum(ratings, self._outlier_upper_bound)
+        return ratings
+    
+    def _fold_in_user(self, user_idx: int):
+        """
+        Fold-in latent vector của một user có interactions mới từ raw matrix hiện tại,
+        kết quả giữ trong user factors đến lần train tiếp theo
+        """
+        with self._cache_lock:
+            if user_idx not in self._als_stale_users:
+                return
+            raw_row = self._get_row(self.user_tour_matrix_raw, user_idx)
+            tours_idx = np.flatnonzero(raw_row)
+            self.als_model.fold_in(user_idx, tours_idx, self._als_ratings(raw_row[tours_idx]))
+            self._als_stale_users.discard(user_idx)
+    
+    def _ensure_user_similarity(self):
+        """Tính (hoặc cập nhật) user similarity theo mode đang dùng"""
+        if self.use_ann:
+            self.build_user_ann_index()
+        elif self.use_neighbor_index:
+            self.calculate_user_neighbors()
+        else:
+            self.calculate_user_similarity()
+    
+    def _ensure_tour_similarity(self):
+        """Tính (hoặc cập nhật) tour similarity theo mode đang dùng"""
+        if self.use_neighbor_index:
+            self.calculate_tour_neighbors()
+        else:
+            self.calculate_tour_similarity()
+
+    def _required_state(self, methods: Sequence[str]) -> Tuple[bool, bool, bool]:
+        """
+        State lazy mà các methods cần: (user similarity, tour similarity, ALS factors)
+        Diversity dùng tour similarity cho mọi method
+        """
+        needs_user = any(method in ("user_based", "hybrid") for method in methods)
+        needs_tour = self.use_diversity or any(method in ("tour_based", "hybrid") for method in methods)
+        needs_als = "als" in methods
+        return needs_user, needs_tour, needs_als
+
+    def _stale_als_users(self, user_ids: Optional[Sequence[int]]) -> set:
+        """Index các users cần fold-in trong user_ids (None: mọi users)"""
+        if user_ids is None:
+            return set(self._als_stale_users)
+        user_indices = {self.user_id_to_idx.get(user_id) for user_id in user_ids}
+        return self._als_stale_users & user_indices
+
+    def is_ready(self, methods: Sequence[str], user_ids: Optional[Sequence[int]] = None) -> bool:
+        """
+        Kiểm tra model có thể phục vụ methods chỉ bằng cách đọc state hay không
+        (không phải tính similarity / train ALS / cập nhật incremental / fold-in)
+
+        Args:
+            methods: Các methods sẽ được gọi
+            user_ids: Users sẽ được tính (None: mọi users)
+        """
+        if not self._matrix_built or self._has_pending_updates():
+            return False
+
+        needs_user, needs_tour, needs_als = self._required_state(methods)
+        if needs_user and (not self._has_user_similarity() or self._dirty_user_indices):
+            return False
+        if needs_tour and (not self._has_tour_similarity() or self._dirty_tour_indices):
+            return False
+        if needs_als and (self.als_model is None or self._stale_als_users(user_ids)):
+            return False
+        if methods and self.tour_cooccurrence_positive is None:
+            return False
+        return True
+
+    def ready_methods(self) -> Tuple[str, ...]:
+        """Các methods mà state đầy đủ (similarity / index / ALS factors) đã được tính"""
+        methods = []
+        if self._has_user_similarity():
+            methods.append("user_based")
+        if self._has_tour_similarity():
+            methods.append("tour_based")
+        if self.als_model is not None:
+            methods.append("als")
+        return tuple(methods)
+
+    def build_missing_state(self, methods: Sequence[str], max_attempts: int = 3) -> bool:
+        """
+        Tính các state đầy đủ mà methods cần nhưng chưa có (similarity / neighbor index /
+        IVF index, ALS factors, co-occurrence) bên ngoài rw_lock, trên bản copy của ma trận
+
+        - Read lock chỉ giữ trong lúc copy ma trận, requests khác vẫn đọc model song song
+        - Phần tính (O(N²) / train ALS) không giữ lock nào của model
+        - Write lock chỉ giữ trong lúc gắn state vừa tính vào model
+
+        Interactions đến trong lúc tính được ghi vào dirty sets / ALS stale users như
+        bình thường, prepare cập nhật incremental chúng sau khi state được gắn.
+        Model được build lại (model_version đổi) trong lúc tính thì bỏ kết quả và tính lại.
+
+        Args:
+            methods: Các methods sẽ được gọi
+            max_attempts: Số lần tính lại tối đa khi model bị thay thế trong lúc tính
+
+        Returns:
+            True nếu không còn state đầy đủ nào bị thiếu
+        """
+        with self._state_build_lock:
+            for _ in range(max_attempts):
+                job = self._copy_missing_state_inputs(methods)
+                if job is None:
+                    return True
+                state = self._compute_missing_state(job)
+                if self._install_missing_state(job, state):
+                    return True
+            return False
+
+    def _copy_missing_state_inputs(self, methods: Sequence[str]) -> Optional[Dict]:
+        """
+        Xác định state còn thiếu và copy các ma trận cần để tính (dưới read lock)
+
+        Returns:
+            Dictionary mô tả job, None nếu không thiếu gì
+        """
+        with self.rw_lock.read():
+            if not self._matrix_built or self._is_empty(self.user_tour_matrix):
+                return None
+
+            needs_user, needs_tour, needs_als = self._required_state(methods)
+            job = {
+                "model_version": self.model_version,
+                "state_revision": self.state_revision,
+                "user": needs_user and not self._has_user_similarity(),
+                "tour": needs_tour and not self._has_tour_similarity(),
+                "als": needs_als and self.als_model is None and not self._is_empty(self.user_tour_matrix_raw),
+                "cooccurrence": bool(methods) and self.tour_cooccurrence_positive is None,
+            }
+            if not (job["user"] or job["tour"] or job["als"] or job["cooccurrence"]):
+                return None
+
+            # Gồm cả các hàng còn trong buffer của apply_interaction
+            merged = self._merged_pending_updates()
+            matrix = merged.get("user_tour_matrix", self.user_tour_matrix)
+            raw_matrix = merged.get("user_tour_matrix_raw", self.user_tour_matrix_raw)
+            if raw_matrix is None:
+                raw_matrix = matrix
+            if job["user"] or job["tour"]:
+                job["matrix"] = matrix.copy()
+            if job["als"] or job["cooccurrence"]:
+                job["raw_matrix"] = sp.csr_matrix(raw_matrix, copy=True)
+
+            # Thay đổi từ thời điểm copy được ghi lại từ đầu (writers đang bị chặn,
+            # readers không dùng các sets này khi state tương ứng chưa có)
+            if job["user"]:
+                self._dirty_user_indices = set()
+            if job["tour"]:
+                self._dirty_tour_indices = set()
+            if job["als"]:
+                self._als_stale_users = set()
+            return job
+
+    def _compute_missing_state(self, job: Dict) -> Dict:
+        """Tính state theo job trên các ma trận đã copy (không giữ lock nào của model)"""
+        state = {}
+        if job["user"]:
+            matrix = job["matrix"]
+            state["_user_norms"] = self._row_norms(matrix)
+            if self.use_ann:
+                state["user_ann_index"] = self._new_ann_index(matrix, state["_user_norms"])
+            elif self.use_neighbor_index:
+                state["user_neighbors"] = self._new_neighbor_index(matrix, state["_user_norms"])
+            else:
+                state["user_similarity"] = cosine_similarity(matrix)
+        if job["tour"]:
+            tour_vectors = job["matrix"].T
+            tour_vectors = tour_vectors.tocsr() if sp.issparse(tour_vectors) else tour_vectors
+            state["_tour_norms"] = self._row_norms(tour_vectors)
+            if self.use_neighbor_index:
+                state["tour_neighbors"] = self._new_neighbor_index(tour_vectors, state["_tour_norms"])
+            else:
+                state["tour_similarity"] = cosine_similarity(tour_vectors)
+        if job["als"]:
+            state["als_model"] = self._fit_als(job["raw_matrix"])
+        if job["cooccurrence"]:
+            state["tour_cooccurrence_positive"], state["tour_cooccurrence_sum"] = (
+                self._compute_tour_cooccurrence(job["raw_matrix"])
+            )
+        return state
+
+    def _install_missing_state(self, job: Dict, state: Dict) -> bool:
+        """
+        Gắn state vừa tính vào model (dưới write lock), mở rộng theo users/tours
+        được thêm trong lúc tính (vector 0, các hàng thay đổi đã nằm trong dirty sets)
+
+        Returns:
+            False nếu model đã được build lại trong lúc tính (bỏ kết quả)
+        """
+        with self.rw_lock.write(), self._cache_lock:
+            if self.model_version != job["model_version"] or not self._matrix_built:
+                return False
+            self._detach_snapshot()
+            n_users, n_tours = len(self.user_ids), len(self.tour_ids)
+
+            if job["user"] and not self._has_user_similarity():
+                norms = state["_user_norms"]
+                self._user_norms = np.concatenate([norms, np.zeros(n_users - len(norms))])
+                if "user_ann_index" in state:
+                    self.user_ann_index = state["user_ann_index"]
+                    self.user_ann_index.add_rows(n_users - len(norms))
+                    self.user_ann_index.add_columns(n_tours - self.user_ann_index.centroids.shape[1])
+                elif "user_neighbors" in state:
+                    self.user_neighbors = state["user_neighbors"]
+                    self.user_neighbors.add_rows(n_users - len(norms))
+                else:
+                    self.user_similarity = self._grow_matrix(state["user_similarity"], n_users, n_users)
+                self._user_similarity_calculated = True
+
+            if job["tour"] and not self._has_tour_similarity():
+                norms = state["_tour_norms"]
+                self._tour_norms = np.concatenate([norms, np.zeros(n_tours - len(norms))])
+                if "tour_neighbors" in state:
+                    self.tour_neighbors = state["tour_neighbors"]
+                    self.tour_neighbors.add_rows(n_tours - len(norms))
+                else:
+                    self.tour_similarity = self._grow_matrix(state["tour_similarity"], n_tours, n_tours)
+                self._tour_similarity_calculated = True
+
+            if job["als"] and self.als_model is None:
+                als_model = state["als_model"]
+                als_model.add_users(n_users - als_model.user_factors.shape[0])
+                als_model.add_tours(n_tours - als_model.tour_factors.shape[0])
+                self.als_model = als_model
+
+            # Co-occurrence không có dirty tracking: chỉ gắn khi không có interaction mới
+            if (
+                job["cooccurrence"] and self.tour_cooccurrence_positive is None
+                and self.state_revision == job["state_revision"]
+            ):
+                self.tour_cooccurrence_positive = state["tour_cooccurrence_positive"]
+                self.tour_cooccurrence_sum = state["tour_cooccurrence_sum"]
+
+            self.state_revision += 1
+            return True
+
+    def prepare(self, methods: Sequence[str], user_ids: Optional[Sequence[int]] = None):
+        """
+        Tính trước mọi state lazy mà methods cần (gọi khi đang giữ write lock),
+        sau đó các lệnh tính recommendations chỉ đọc model
+        
+        Sau build_missing_state chỉ còn phần incremental (cập nhật các hàng dirty,
+        fold-in users có interactions mới); gọi trực tiếp thì tính cả state đầy đủ.
+
+        Args:
+            methods: Các methods sẽ được gọi
+            user_ids: Users sẽ được tính (None: mọi users)
+        """
+        if not self._matrix_built:
+            self.build_user_tour_matrix()
+        self._flush_row_updates()
+        if self._is_empty(self.user_tour_matrix):
+            return
+
+        needs_user, needs_tour, needs_als = self._required_state(methods)
+        if needs_user:
+            self._ensure_user_similarity()
+        if needs_tour:
+            self._ensure_tour_similarity()
+        if needs_als and self.train_als() is not None:
+            for user_idx in self._stale_als_users(user_ids):
+                self._fold_in_user(user_idx)
+        if methods and self.tour_cooccurrence_positive is None:
+            raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
+            self._build_tour_cooccurrence(raw_matrix)
+
+    def serve(
+        self,
+        methods: Sequence[str],
+        user_ids: Optional[Sequence[int]],
+        func: Callable[..., Any],
+        *args,
+        **kwargs
+    ) -> Any:
+        """
+        Chạy func (chỉ đọc model) song song với các requests khác dưới read lock;
+        nếu methods còn state lazy chưa tính: state đầy đủ được tính bên ngoài lock
+        (build_missing_state), write lock chỉ giữ cho phần cập nhật incremental và func.
+        Func phải là lệnh ngắn (một request / một chunk users), job lớn chia thành
+        nhiều lần serve để writers không phải đợi cả job.
+
+        Args:
+            methods: Các methods func sẽ gọi (quyết định state cần tính trước)
+            user_ids: Users func sẽ tính (None: mọi users)
+            func: Hàm tính recommendations của model
+
+        Returns:
+            Kết quả của func
+        """
+        with self.rw_lock.read():
+            if self.is_ready(methods, user_ids):
+                return func(*args, **kwargs)
+
+        self.build_missing_state(methods)
+
+        with self.rw_lock.write():
+            self.prepare(methods, user_ids)
+            return func(*args, **kwargs)
+
+    def _has_user_similarity(self) -> bool:
+        return (
+            self.user_similarity is not None
+            or self.user_neighbors is not None
+            or self.user_ann_index is not None
+        )
+    
+    def _has_tour_similarity(self) -> bool:
+        if self.tour_neighbors is not None:
+            return True
+        return self.tour_similarity is not None and self.tour_similarity.size > 0
+    
+    def _get_tour_similarities(self, tour_idx: int, target_tours_idx: np.ndarray) -> np.ndarray:
+        """
+        Similarity giữa một tour và các tours khác
+        Ở neighbor index mode, tours ngoài top K của nhau có similarity 0
+        """
+        if self.tour_neighbors is not None:
+            return self.tour_neighbors.lookup(tour_idx, target_tours_idx)
+        return self.tour_similarity[tour_idx, target_tours_idx]
+    
     def user_based_recommendations(
         self, 
         user_id: int, 
@@ -471,94 +1543,202 @@ class CollaborativeFiltering:
         User-Based Collaborative Filtering
         Tìm users tương tự → Gợi ý items mà họ đã thích
         """
-        if self.user_similarity is None:
-            self.calculate_user_similarity()
+        # Lazy: chỉ tính lần đầu, sau đó chỉ cập nhật users đã thay đổi
+        self._ensure_user_similarity()
         
         if not self.user_ids or user_id not in self.user_id_to_idx:
             return []
         
         user_idx = self.user_id_to_idx[user_id]
+        predicted_scores = self._user_based_scores(user_idx, n_similar_users)
+        
+        return self._build_recommendations(
+            user_id, predicted_scores, n_recommendations, "user_based_cf"
+        )
+    
+    def _user_based_scores(self, user_idx: int, n_similar_users: int) -> np.ndarray:
+        """
+        Tính điểm dự đoán User-Based cho tất cả tours của một user
+        
+        Điểm = weighted average ratings của top-k users tương tự, tính bằng một
+        phép nhân vector-ma trận thay vì loop qua từng tour.
         
+        Args:
+            user_idx: Index của user trong ma trận
+            n_similar_users: Số users tương tự dùng để dự đoán
+            
+        Returns:
+            Array điểm dự đoán (0 cho tours user đã tương tác)
+        """
         # Lấy top N users tương tự (loại bỏ chính user đó)
-        similar_users_idx = np.argsort(self.user_similarity[user_idx])[::-1][1:n_similar_users+1]
+        similar_users_idx, similar_users_sim = self._get_top_similar_users(user_idx, n_similar_users)
         
-        # Tính điểm dự đoán cho từng tour
-        user_ratings = self.user_tour_matrix[user_idx]
+        # Chỉ gợi ý tours user chưa tương tác
+        user_ratings = self._get_row(self.user_tour_matrix, user_idx)
+        candidate_mask = user_ratings == 0
         predicted_scores = np.zeros(len(self.tour_ids))
         
-        for tour_idx in range(len(self.tour_ids)):
-            if user_ratings[tour_idx] == 0:  # Chỉ gợi ý tours user chưa tương tác
-                # Tính điểm dự đoán dựa trên users tương tự
-                similar_users_ratings = self.user_tour_matrix[similar_users_idx, tour_idx]
-                similar_users_sim = self.user_similarity[user_idx, similar_users_idx]
-                
-                # Weighted average
-                if np.sum(similar_users_sim) > 0:
-                    predicted_scores[tour_idx] = np.sum(
-                        similar_users_ratings * similar_users_sim
-                    ) / np.sum(similar_users_sim)
-                else:
-                    # Fallback: Co-occurrence logic khi similarity = 0
-                    # Dùng raw matrix (không normalize) để tìm interacted tours
-                    # Vì normalized matrix có thể làm mất interacted tours
-                    raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
-                    user_raw_ratings = raw_matrix[user_idx]
-                    interacted_tours_idx = np.where(user_raw_ratings > 0)[0]
-                    if len(interacted_tours_idx) > 0:
-                        # Tìm users đã xem cùng tours
-                        co_occurrence_score = 0
-                        for interacted_tour_idx in interacted_tours_idx:
-                            users_who_saw_this_tour = np.where(
-                                raw_matrix[:, interacted_tour_idx] > 0
-                            )[0]
-                            # Loại bỏ chính user hiện tại
-                            users_who_saw_this_tour = users_who_saw_this_tour[
-                                users_who_saw_this_tour != user_idx
-                            ]
-                            # Xem những users này có xem tour hiện tại không
-                            if len(users_who_saw_this_tour) > 0:
-                                ratings_from_co_users = raw_matrix[
-                                    users_who_saw_this_tour, tour_idx
-                                ]
-                                if np.sum(ratings_from_co_users) > 0:
-                                    # Tính điểm dựa trên số users cùng xem và ratings
-                                    co_occurrence_score += np.mean(
-                                        ratings_from_co_users[ratings_from_co_users > 0]
-                                    ) * len(ratings_from_co_users[ratings_from_co_users > 0])
-                        
-                        if co_occurrence_score > 0:
-                            predicted_scores[tour_idx] = co_occurrence_score / len(interacted_tours_idx)
-        
-        # Lấy top N recommendations
-        top_tours_idx = np.argsort(predicted_scores)[::-1][:n_recommendations * 2]  # Lấy nhiều hơn để apply diversity
+        similarity_sum = np.sum(similar_users_sim)
+        
+        if similarity_sum > 0:
+            # Weighted average: (sim^T · R[neighbors]) / sum(sim)
+            neighbor_ratings = self.user_tour_matrix[similar_users_idx]
+            weighted_sum = np.asarray(neighbor_ratings.T @ similar_users_sim).ravel()
+            predicted_scores[candidate_mask] = weighted_sum[candidate_mask] / similarity_sum
+        else:
+            # Fallback: Co-occurrence logic khi similarity = 0
+            # Dùng raw matrix (không normalize) để tìm interacted tours
+            # Vì normalized matrix có thể làm mất interacted tours
+            raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
+            n_interacted = np.count_nonzero(self._get_row(raw_matrix, user_idx) > 0)
+            if n_interacted > 0:
+                candidate_tours_idx = np.where(candidate_mask)[0]
+                co_occurrence_scores = self._co_occurrence_scores(user_idx, candidate_tours_idx)
+                predicted_scores[candidate_tours_idx] = co_occurrence_scores / n_interacted
+        
+        return predicted_scores
+    
+    def _get_top_similar_users(self, user_idx: int, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Lấy top N users tương tự nhất (không gồm chính user đó)
+        Dùng argpartition (O(N)) thay vì sort toàn bộ hàng similarity,
+        hoặc đọc trực tiếp từ neighbor index (O(K))
+        
+        Args:
+            user_idx: Index của user
+            top_n: Số lượng users tương tự
+            
+        Returns:
+            (indices, similarities), sắp xếp theo similarity giảm dần
+        """
+        if self.user_ann_index is not None:
+            return self.user_ann_index.search(self.user_tour_matrix, self._user_norms, user_idx, top_n)
+        
+        if self.user_neighbors is not None:
+            neighbors_idx, neighbors_sim = self.user_neighbors.neighbors(user_idx)
+            return neighbors_idx[:top_n], neighbors_sim[:top_n]
+        
+        similarities = np.array(self.user_similarity[user_idx], dtype=np.float64)
+        similarities[user_idx] = -np.inf
+        
+        top_n = min(top_n, len(similarities) - 1)
+        if top_n <= 0:
+            return np.array([], dtype=np.int64), np.array([])
+        
+        top_indices = np.argpartition(-similarities, top_n - 1)[:top_n]
+        top_indices = top_indices[np.argsort(-similarities[top_indices], kind="stable")]
+        return top_indices, similarities[top_indices]
+    
+    def _co_occurrence_scores(self, user_idx: int, candidate_tours_idx: np.ndarray) -> np.ndarray:
+        """
+        Điểm co-occurrence (chưa chia) cho các tours ứng viên của một user
+        
+        Với mỗi tour user đã tương tác (raw > 0), lấy các users khác cũng đã tương tác
+        với tour đó; nếu tổng ratings của họ cho tour ứng viên > 0 thì cộng tổng các
+        ratings dương của họ vào điểm.
+        
+        Tra cứu trên ma trận co-occurrence đã tính trước, chỉ trừ phần đóng góp
+        của chính user hiện tại thay vì quét lại các cột của raw matrix.
+        
+        Args:
+            user_idx: Index của user
+            candidate_tours_idx: Index các tours cần tính điểm
+            
+        Returns:
+            Array điểm co-occurrence tương ứng với candidate_tours_idx
+        """
+        raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
+        if self.tour_cooccurrence_positive is None:
+            self._build_tour_cooccurrence(raw_matrix)
+        
+        user_raw_ratings = self._get_row(raw_matrix, user_idx)
+        interacted_tours_idx = np.where(user_raw_ratings > 0)[0]
+        if len(interacted_tours_idx) == 0 or len(candidate_tours_idx) == 0:
+            return np.zeros(len(candidate_tours_idx))
+        
+        # Đóng góp của chính user (đã tương tác với mọi tour trong interacted_tours_idx)
+        own_ratings = user_raw_ratings[candidate_tours_idx]
+        own_positive = np.maximum(own_ratings, 0)
+        
+        positive_sums = self.tour_cooccurrence_positive[interacted_tours_idx][:, candidate_tours_idx].toarray() - own_positive
+        rating_sums = self.tour_cooccurrence_sum[interacted_tours_idx][:, candidate_tours_idx].toarray() - own_ratings
+        
+        return np.where(rating_sums > 0, positive_sums, 0).sum(axis=0)
+    
+    def _build_recommendations(
+        self,
+        user_id: int,
+        predicted_scores: np.ndarray,
+        n_recommendations: int,
+        method: str,
+        denormalize: bool = True
+    ) -> List[Dict]:
+        """
+        Chuyển điểm dự đoán thành danh sách recommendations
+        Lấy top tours, denormalize, apply diversity và explanations
+        
+        Args:
+            user_id: ID của user
+            predicted_scores: Điểm dự đoán cho tất cả tours
+            n_recommendations: Số lượng recommendations
+            method: Tên phương pháp ghi vào kết quả
+            denormalize: Cộng lại mean của user vào điểm (khi đã normalize)
+            
+        Returns:
+            Danh sách recommendations
+        """
+        # Lấy top N recommendations (lấy nhiều hơn để apply diversity)
+        top_tours_idx = self._select_top_indices(predicted_scores, n_recommendations * 2)
         
         recommendations = []
         for tour_idx in top_tours_idx:
             if predicted_scores[tour_idx] > 0:
-                tour = self.db.query(Tour).filter(Tour.id == self.tour_ids[tour_idx]).first()
+                tour = self._get_available_tour(self.tour_ids[tour_idx])
                 if tour:
                     # Denormalize score nếu đã normalize
                     final_score = predicted_scores[tour_idx]
-                    if self.normalize:
+                    if self.normalize and denormalize:
                         final_score = self.denormalize_score(final_score, user_id)
                     
                     recommendations.append({
-                        "tour_id": tour.id,
-                        "tour_title": tour.title,
-                        "tour_slug": tour.slug,
+                        "tour_id": tour["id"],
+                        "tour_title": tour["title"],
+                        "tour_slug": tour["slug"],
                         "predicted_score": float(final_score),
-                        "method": "user_based_cf"
+                        "method": method
                     })
         
-        # Apply diversity và explanations
+        return self._finalize_recommendations(recommendations, user_id, n_recommendations)
+    
+    def _finalize_recommendations(
+        self,
+        recommendations: List[Dict],
+        user_id: int,
+        n_recommendations: int,
+        explain: bool = True
+    ) -> List[Dict]:
+        """Apply diversity và explanations (nếu enabled, explain=False bỏ qua explanations), lấy top N"""
         if self.use_diversity and len(recommendations) > 1:
             recommendations = self._apply_diversity(recommendations, n_recommendations)
         
-        if self.enable_explanation:
+        if self.enable_explanation and explain:
             recommendations = self._add_explanations(recommendations, user_id)
         
         return recommendations[:n_recommendations]
     
+    @staticmethod
+    def _select_top_indices(scores: np.ndarray, top_n: int) -> np.ndarray:
+        """
+        Lấy index của top N phần tử lớn nhất, sắp xếp giảm dần
+        Dùng argpartition thay vì argsort toàn bộ array
+        """
+        top_n = min(top_n, len(scores))
+        if top_n <= 0:
+            return np.array([], dtype=np.int64)
+        
+        top_indices = np.argpartition(-scores, top_n - 1)[:top_n]
+        return top_indices[np.argsort(-scores[top_indices], kind="stable")]
+    
     def tour_based_recommendations(
         self,
         user_id: int,
@@ -568,93 +1748,71 @@ class CollaborativeFiltering:
         Tour-Based Collaborative Filtering
         Tìm tours tương tự với tours user đã tương tác
         """
-        if self.tour_similarity is None:
-            self.calculate_tour_similarity()
+        # Lazy: chỉ tính lần đầu, sau đó chỉ cập nhật tours đã thay đổi
+        self._ensure_tour_similarity()
         
         if not self.user_ids or user_id not in self.user_id_to_idx:
             return []
         
         user_idx = self.user_id_to_idx[user_id]
-        user_ratings = self.user_tour_matrix[user_idx]
-        
-        # Tính điểm dự đoán cho từng tour
-        predicted_scores = np.zeros(len(self.tour_ids))
-        
-        for tour_idx in range(len(self.tour_ids)):
-            if user_ratings[tour_idx] == 0:  # Chỉ gợi ý tours user chưa tương tác
-                # Tính điểm dựa trên tours user đã tương tác
-                interacted_tours_idx = np.where(user_ratings > 0)[0]
-                
-                if len(interacted_tours_idx) > 0:
-                    similarities = self.tour_similarity[tour_idx, interacted_tours_idx]
-                    ratings = user_ratings[interacted_tours_idx]
-                    
-                    if np.sum(similarities) > 0:
-                        predicted_scores[tour_idx] = np.sum(
-                            similarities * ratings
-                        ) / np.sum(similarities)
-                    else:
-                        # Fallback: Co-occurrence logic khi similarity = 0
-                        # Dùng raw matrix (không normalize) để tìm interacted tours
-                        raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
-                        user_raw_ratings = raw_matrix[user_idx]
-                        interacted_tours_idx_raw = np.where(user_raw_ratings > 0)[0]
-                        
-                        # Tìm users đã xem tours user đã xem, xem họ có xem tour này không
-                        co_occurrence_score = 0
-                        for interacted_tour_idx in interacted_tours_idx_raw:
-                            # Tìm users đã xem tour này
-                            users_who_saw_this_tour = np.where(
-                                raw_matrix[:, interacted_tour_idx] > 0
-                            )[0]
-                            # Loại bỏ chính user hiện tại
-                            users_who_saw_this_tour = users_who_saw_this_tour[
-                                users_who_saw_this_tour != user_idx
-                            ]
-                            # Xem những users này có xem tour hiện tại không
-                            if len(users_who_saw_this_tour) > 0:
-                                ratings_from_co_users = raw_matrix[
-                                    users_who_saw_this_tour, tour_idx
-                                ]
-                                if np.sum(ratings_from_co_users) > 0:
-                                    # Tính điểm dựa trên số users cùng xem và ratings
-                                    co_occurrence_score += np.mean(
-                                        ratings_from_co_users[ratings_from_co_users > 0]
-                                    ) * len(ratings_from_co_users[ratings_from_co_users > 0])
-                        
-                        if co_occurrence_score > 0:
-                            predicted_scores[tour_idx] = co_occurrence_score / len(interacted_tours_idx)
-        
-        # Lấy top N recommendations
-        top_tours_idx = np.argsort(predicted_scores)[::-1][:n_recommendations * 2]  # Lấy nhiều hơn để apply diversity
+        predicted_scores = self._tour_based_scores(user_idx)
         
-        recommendations = []
-        for tour_idx in top_tours_idx:
-            if predicted_scores[tour_idx] > 0:
-                tour = self.db.query(Tour).filter(Tour.id == self.tour_ids[tour_idx]).first()
-                if tour:
-                    # Denormalize score nếu đã normalize
-                    final_score = predicted_scores[tour_idx]
-                    if self.normalize:
-                        final_score = self.denormalize_score(final_score, user_id)
-                    
-                    recommendations.append({
-                        "tour_id": tour.id,
-                        "tour_title": tour.title,
-                        "tour_slug": tour.slug,
-                        "predicted_score": float(final_score),
-                        "method": "tour_based_cf"
-                    })
+        return self._build_recommendations(
+            user_id, predicted_scores, n_recommendations, "tour_based_cf"
+        )
+    
+    def _tour_based_scores(self, user_idx: int) -> np.ndarray:
+        """
+        Tính điểm dự đoán Tour-Based cho tất cả tours của một user
         
-        # Apply diversity và explanations
-        if self.use_diversity and len(recommendations) > 1:
-            recommendations = self._apply_diversity(recommendations, n_recommendations)
+        Điểm = (S[:, interacted] · ratings[interacted]) / sum(S[:, interacted]),
+        tính cho mọi tour bằng một phép nhân ma trận con similarity với vector ratings.
         
-        if self.enable_explanation:
-            recommendations = self._add_explanations(recommendations, user_id)
+        Args:
+            user_idx: Index của user trong ma trận
+            
+        Returns:
+            Array điểm dự đoán (0 cho tours user đã tương tác)
+        """
+        user_ratings = self._get_row(self.user_tour_matrix, user_idx)
+        predicted_scores = np.zeros(len(self.tour_ids))
         
-        return recommendations[:n_recommendations]
+        # Tính điểm dựa trên tours user đã tương tác
+        interacted_tours_idx = np.where(user_ratings > 0)[0]
+        if len(interacted_tours_idx) == 0:
+            return predicted_scores
+        
+        # Chỉ gợi ý tours user chưa tương tác
+        candidate_mask = user_ratings == 0
+        
+        if self.tour_neighbors is not None:
+            # Chỉ các tours nằm trong top K láng giềng của tours đã tương tác được cộng điểm
+            neighbor_lists = [self.tour_neighbors.neighbors(idx) for idx in interacted_tours_idx]
+            neighbors_idx = np.concatenate([idx for idx, _ in neighbor_lists])
+            neighbors_sim = np.concatenate([sim for _, sim in neighbor_lists])
+            neighbor_ratings = np.repeat(
+                user_ratings[interacted_tours_idx], [len(idx) for idx, _ in neighbor_lists]
+            )
+            n_tours = len(self.tour_ids)
+            similarity_sums = np.bincount(neighbors_idx, weights=neighbors_sim, minlength=n_tours)
+            weighted_sums = np.bincount(neighbors_idx, weights=neighbors_sim * neighbor_ratings, minlength=n_tours)
+        else:
+            similarity_block = self.tour_similarity[:, interacted_tours_idx]
+            similarity_sums = similarity_block.sum(axis=1)
+            weighted_sums = similarity_block @ user_ratings[interacted_tours_idx]
+        
+        has_similarity = candidate_mask & (similarity_sums > 0)
+        predicted_scores[has_similarity] = weighted_sums[has_similarity] / similarity_sums[has_similarity]
+        
+        # Fallback: Co-occurrence logic cho các tours có similarity = 0
+        fallback_tours_idx = np.where(candidate_mask & (similarity_sums <= 0))[0]
+        if len(fallback_tours_idx) > 0:
+            co_occurrence_scores = self._co_occurrence_scores(user_idx, fallback_tours_idx)
+            predicted_scores[fallback_tours_idx] = co_occurrence_scores / len(interacted_tours_idx)
+        
+        return predicted_scores
     
+
     def hybrid_recommendations(
         self,
         user_id: int,
@@ -667,6 +1825,18 @@ class CollaborativeFiltering:
         user_based = self.user_based_recommendations(user_id, n_recommendations * 2)
         tour_based = self.tour_based_recommendations(user_id, n_recommendations * 2)
         
+        recommendations = self._combine_hybrid(user_based, tour_based, user_weight)
+        return self._finalize_recommendations(recommendations, user_id, n_recommendations)
+    
+    @staticmethod
+    def _combine_hybrid(user_based: List[Dict], tour_based: List[Dict], user_weight: float) -> List[Dict]:
+        """
+        Kết hợp điểm của hai danh sách User-Based và Tour-Based
+        (tour chỉ có trong một danh sách nhận điểm 0 ở danh sách còn lại)
+        
+        Returns:
+            Danh sách hybrid sắp xếp theo điểm giảm dần
+        """
         # Tạo dictionary để combine scores
         combined_scores = {}
         
@@ -708,18 +1878,48 @@ class CollaborativeFiltering:
                 "method": "hybrid_cf"
             })
         
-        # Sắp xếp và lấy top N
+        # Sắp xếp theo điểm giảm dần
         recommendations.sort(key=lambda x: x["predicted_score"], reverse=True)
         
-        # Apply diversity nếu enabled
-        if self.use_diversity and len(recommendations) > 1:
-            recommendations = self._apply_diversity(recommendations, n_recommendations)
+        return recommendations
+    
+    def als_recommendations(
+        self,
+        user_id: int,
+        n_recommendations: int = 10
+    ) -> List[Dict]:
+        """
+        Matrix Factorization (implicit ALS)
+        Điểm dự đoán = user factors · tour factors, không cần similarity matrix
+        """
+        self.train_als()
         
-        # Add explanations nếu enabled
-        if self.enable_explanation:
-            recommendations = self._add_explanations(recommendations, user_id)
+        if self.als_model is None or not self.user_ids or user_id not in self.user_id_to_idx:
+            return []
         
-        return recommendations[:n_recommendations]
+        user_idx = self.user_id_to_idx[user_id]
+        predicted_scores = self._als_scores(user_idx)
+        
+        # Điểm ALS là mức độ ưa thích dự đoán, không phải rating đã mean centering
+        return self._build_recommendations(
+            user_id, predicted_scores, n_recommendations, "als_mf", denormalize=False
+        )
+    
+    def _als_scores(self, user_idx: int) -> np.ndarray:
+        """
+        Tính điểm dự đoán ALS cho tất cả tours của một user
+        User có interactions mới sau lần train được fold-in trước khi tính điểm
+        
+        Returns:
+            Array điểm dự đoán (0 cho tours user đã tương tác)
+        """
+        if user_idx in self._als_stale_users:
+            self._fold_in_user(user_idx)
+        
+        predicted_scores = self.als_model.scores(user_idx).astype(np.float64)
+        raw_matrix = self.user_tour_matrix_raw if self.user_tour_matrix_raw is not None else self.user_tour_matrix
+        predicted_scores[self._get_row(raw_matrix, user_idx) != 0] = 0
+        return predicted_scores
     
     def _calculate_time_decay(self, created_at: datetime) -> float:
         """
@@ -737,30 +1937,49 @@ class CollaborativeFiltering:
         
         try:
             # Tính số ngày từ lúc tạo đến bây giờ
-            now = datetime.now(timezone.utc)
-            
-            # Xử lý timezone: đảm bảo cả 2 datetime đều có timezone
-            if created_at.tzinfo is None:
-                # Nếu không có timezone, giả sử là UTC
-                created_at_aware = created_at.replace(tzinfo=timezone.utc)
-            else:
-                created_at_aware = created_at
-            
-            # Tính số ngày
-            delta = now - created_at_aware
-            days_ago = delta.days + delta.seconds / 86400  # Bao gồm cả phần thập phân
-            
-            # Exponential decay: decay = exp(-days / half_life)
-            # Với half_life = 30 days, sau 30 ngày sẽ còn 50% trọng số
-            decay = np.exp(-days_ago / self.time_decay_half_life_days)
-            
-            # Đảm bảo decay không nhỏ hơn 0.1 (giữ ít nhất 10% trọng số)
-            return max(decay, 0.1)
+            now_timestamp = datetime.now(timezone.utc).timestamp()
+            return self._time_decay_factor(to_epoch_seconds(created_at), now_timestamp)
         except Exception as e:
             # Nếu có lỗi, trả về 1.0 (không decay)
             warnings.warn(f"Lỗi khi tính time decay: {e}. Sử dụng decay = 1.0")
             return 1.0
     
+    def _calculate_time_decay_array(self, created_timestamps: np.ndarray) -> np.ndarray:
+        """
+        Time decay factors cho cả cột timestamps trong một lần
+        
+        Args:
+            created_timestamps: Epoch seconds của các interactions (NaN nếu không có)
+            
+        Returns:
+            Array decay factors (0.1-1), 1.0 cho interactions không có timestamp
+        """
+        now_timestamp = datetime.now(timezone.utc).timestamp()
+        days_ago = np.floor(now_timestamp - created_timestamps) / 86400
+        decay = np.maximum(np.exp(-days_ago / self.time_decay_half_life_days), 0.1)
+        return np.where(np.isnan(created_timestamps), 1.0, decay)
+    
+    def _time_decay_factor(self, created_timestamp: float, now_timestamp: float) -> float:
+        """
+        Time decay factor từ epoch seconds
+        
+        Args:
+            created_timestamp: Thời gian tạo interaction (epoch seconds)
+            now_timestamp: Thời điểm hiện tại (epoch seconds)
+            
+        Returns:
+            Decay factor (0.1-1)
+        """
+        # Số ngày tính theo giây nguyên (bỏ phần microseconds)
+        days_ago = np.floor(now_timestamp - created_timestamp) / 86400
+        
+        # Exponential decay: decay = exp(-days / half_life)
+        # Với half_life = 30 days, sau 30 ngày sẽ còn 50% trọng số
+        decay = np.exp(-days_ago / self.time_decay_half_life_days)
+        
+        # Đảm bảo decay không nhỏ hơn 0.1 (giữ ít nhất 10% trọng số)
+        return max(decay, 0.1)
+    
     def _apply_diversity(self, recommendations: List[Dict], n_recommendations: int) -> List[Dict]:
         """
         Áp dụng diversity để đảm bảo recommendations đa dạng
@@ -776,57 +1995,46 @@ class CollaborativeFiltering:
         if len(recommendations) <= 1:
             return recommendations
         
-        # Nếu tour_similarity chưa được tính, tính nó
-        if self.tour_similarity is None:
-            self.calculate_tour_similarity()
+        # Nếu tour similarity chưa được tính (hoặc có tours thay đổi), tính nó
+        self._ensure_tour_similarity()
         
-        if self.tour_similarity is None or self.tour_similarity.size == 0:
+        if not self._has_tour_similarity():
             return recommendations[:n_recommendations]
         
-        # MMR: Chọn tours có score cao nhưng khác biệt với các tours đã chọn
-        selected = []
-        remaining = recommendations.copy()
-        
-        # Chọn tour đầu tiên (có score cao nhất)
-        if remaining:
-            selected.append(remaining.pop(0))
-        
-        # Chọn các tours tiếp theo dựa trên MMR
-        while len(selected) < n_recommendations and remaining:
-            best_idx = 0
-            best_mmr = -float('inf')
+        # MMR trên arrays: relevance, index tour của từng ứng viên (-1 nếu không có trong model)
+        # và max similarity với các tours đã chọn, cập nhật bằng một hàng similarity mỗi lần chọn
+        n_candidates = len(recommendations)
+        relevance = np.array([rec['predicted_score'] for rec in recommendations], dtype=np.float64)
+        candidate_tours_idx = np.array(
+            [self.tour_id_to_idx.get(rec['tour_id'], -1) for rec in recommendations], dtype=np.int64
+        )
+        in_model = candidate_tours_idx >= 0
+        in_model_tours_idx = candidate_tours_idx[in_model]
+        
+        max_similarity = np.zeros(n_candidates)
+        is_selected = np.zeros(n_candidates, dtype=bool)
+        
+        # MMR = λ * relevance - (1 - λ) * max_similarity, với λ = 1 - diversity_weight
+        lambda_param = 1 - self.diversity_weight
+        
+        # Chọn tour đầu tiên (có score cao nhất), sau đó chọn theo MMR
+        selected_positions = []
+        next_position = 0
+        while True:
+            selected_positions.append(next_position)
+            is_selected[next_position] = True
+            if len(selected_positions) >= n_recommendations or is_selected.all():
+                break
             
-            for idx, rec in enumerate(remaining):
-                # Tính relevance (score)
-                relevance = rec['predicted_score']
-                
-                # Tính max similarity với các tours đã chọn
-                max_similarity = 0.0
-                if selected:
-                    tour_id = rec['tour_id']
-                    if tour_id in self.tour_id_to_idx:
-                        tour_idx = self.tour_id_to_idx[tour_id]
-                        
-                        for selected_rec in selected:
-                            selected_tour_id = selected_rec['tour_id']
-                            if selected_tour_id in self.tour_id_to_idx:
-                                selected_tour_idx = self.tour_id_to_idx[selected_tour_id]
-                                similarity = self.tour_similarity[tour_idx, selected_tour_idx]
-                                max_similarity = max(max_similarity, similarity)
-                
-                # MMR = λ * relevance - (1 - λ) * max_similarity
-                # Với λ = 1 - diversity_weight
-                lambda_param = 1 - self.diversity_weight
-                mmr = lambda_param * relevance - self.diversity_weight * max_similarity
-                
-                if mmr > best_mmr:
-                    best_mmr = mmr
-                    best_idx = idx
+            if in_model[next_position]:
+                similarities = self._get_tour_similarities(candidate_tours_idx[next_position], in_model_tours_idx)
+                max_similarity[in_model] = np.maximum(max_similarity[in_model], similarities)
             
-            # Thêm tour tốt nhất vào selected
-            selected.append(remaining.pop(best_idx))
+            mmr = lambda_param * relevance - self.diversity_weight * max_similarity
+            mmr[is_selected] = -np.inf
+            next_position = int(np.argmax(mmr))
         
-        return selected
+        return [recommendations[position] for position in selected_positions]
     
     def _add_explanations(self, recommendations: List[Dict], user_id: int) -> List[Dict]:
         """
@@ -844,28 +2052,29 @@ class CollaborativeFiltering:
             return recommendations
         
         user_idx = self.user_id_to_idx[user_id]
-        user_ratings = self.user_tour_matrix[user_idx]
+        user_ratings = self._get_row(self.user_tour_matrix, user_idx)
         
         # Lấy tours user đã tương tác
         interacted_tours_idx = np.where(user_ratings > 0)[0]
         interacted_tour_ids = [self.tour_ids[idx] for idx in interacted_tours_idx]
         
+        # Users tương tự không phụ thuộc tour: chỉ tìm một lần cho cả danh sách
+        similar_users = self._get_similar_users(user_id, top_n=3) if self._has_user_similarity() else []
+        
         for rec in recommendations:
             tour_id = rec['tour_id']
             explanation_parts = []
             
             # 1. Explanation từ User-Based CF
-            if self.user_similarity is not None:
-                similar_users = self._get_similar_users(user_id, top_n=3)
-                if similar_users:
-                    similar_user_names = [f"User {uid}" for uid, _ in similar_users]
-                    explanation_parts.append(
-                        f"Được recommend vì {len(similar_user_names)} users tương tự "
-                        f"({', '.join(similar_user_names[:2])}) đã thích tour này"
-                    )
+            if similar_users:
+                similar_user_names = [f"User {uid}" for uid, _ in similar_users]
+                explanation_parts.append(
+                    f"Được recommend vì {len(similar_user_names)} users tương tự "
+                    f"({', '.join(similar_user_names[:2])}) đã thích tour này"
+                )
             
             # 2. Explanation từ Tour-Based CF
-            if self.tour_similarity is not None and interacted_tour_ids:
+            if self._has_tour_similarity() and interacted_tour_ids:
                 similar_tours = self._get_similar_tours(tour_id, interacted_tour_ids, top_n=2)
                 if similar_tours:
                     tour_titles = [t['title'][:30] + "..." if len(t['title']) > 30 else t['title'] 
@@ -875,9 +2084,9 @@ class CollaborativeFiltering:
                     )
             
             # 3. Explanation từ interactions
-            if (user_id, tour_id) in self.interactions_cache:
-                interactions = self.interactions_cache[(user_id, tour_id)]
-                interaction_types = [i['type'] for i in interactions if i['type']]
+            interactions = self._get_interaction_history(user_id, tour_id)
+            if interactions:
+                interaction_types = [interaction_type for interaction_type in interactions if interaction_type]
                 if interaction_types:
                     unique_types = list(set(interaction_types))
                     explanation_parts.append(
@@ -904,10 +2113,18 @@ class CollaborativeFiltering:
         Returns:
             List of (user_id, similarity_score) tuples
         """
-        if self.user_similarity is None or user_id not in self.user_id_to_idx:
+        if not self._has_user_similarity() or user_id not in self.user_id_to_idx:
             return []
         
         user_idx = self.user_id_to_idx[user_id]
+        if self.user_neighbors is not None or self.user_ann_index is not None:
+            neighbors_idx, neighbors_sim = self._get_top_similar_users(user_idx, top_n)
+            return [
+                (self.user_ids[idx], float(sim))
+                for idx, sim in zip(neighbors_idx, neighbors_sim)
+                if sim > 0
+            ]
+        
         similarities = self.user_similarity[user_idx]
         
         # Lấy top N users (loại bỏ chính user đó)
@@ -933,69 +2150,72 @@ class CollaborativeFiltering:
         Returns:
             List of tour dicts với title và similarity
         """
-        if self.tour_similarity is None or tour_id not in self.tour_id_to_idx:
+        if not self._has_tour_similarity() or tour_id not in self.tour_id_to_idx:
             return []
         
         tour_idx = self.tour_id_to_idx[tour_id]
-        similarities = self.tour_similarity[tour_idx]
+        interacted_tour_ids = [tid for tid in interacted_tour_ids if tid in self.tour_id_to_idx]
+        similarities = self._get_tour_similarities(
+            tour_idx, np.array([self.tour_id_to_idx[tid] for tid in interacted_tour_ids], dtype=np.int64)
+        )
         
         # Tìm tours tương tự trong danh sách interacted tours
         similar_tours = []
-        for interacted_tour_id in interacted_tour_ids:
-            if interacted_tour_id in self.tour_id_to_idx:
-                interacted_tour_idx = self.tour_id_to_idx[interacted_tour_id]
-                similarity = similarities[interacted_tour_idx]
-                
-                if similarity > 0:
-                    tour = self.db.query(Tour).filter(Tour.id == interacted_tour_id).first()
-                    if tour:
-                        similar_tours.append({
-                            'id': tour.id,
-                            'title': tour.title,
-                            'similarity': float(similarity)
-                        })
+        for interacted_tour_id, similarity in zip(interacted_tour_ids, similarities):
+            if similarity > 0:
+                tour = self.tour_metadata.get(interacted_tour_id) if self.tour_metadata else None
+                if tour:
+                    similar_tours.append({
+                        'id': tour['id'],
+                        'title': tour['title'],
+                        'similarity': float(similarity)
+                    })
         
         # Sắp xếp theo similarity và lấy top N
         similar_tours.sort(key=lambda x: x['similarity'], reverse=True)
         return similar_tours[:top_n]
     
-    def handle_cold_start_user(self, user_id: int, n_recommendations: int = 10) -> List[Dict]:
+    def handle_cold_start_user(
+        self,
+        user_id: int,
+        n_recommendations: int = 10,
+        db: Optional[Session] = None
+    ) -> List[Dict]:
         """
         Xử lý Cold Start cho user mới (chưa có interactions)
-        Trả về top tours phổ biến nhất
+        Trả về top tours phổ biến nhất (hoặc trending, theo CF_COLD_START_RANKING)
         
         Args:
             user_id: ID của user mới
             n_recommendations: Số lượng recommendations
+            db: Session của request (default: self.db), chỉ dùng khi popularity
+                index chưa được build (không có: index tự mở session riêng)
             
         Returns:
             Danh sách recommendations
         """
-        # Lấy top tours phổ biến nhất (dựa trên view_count, booked_count)
-        popular_tours = self.db.query(Tour).filter(
-            Tour.is_active == True,
-            Tour.is_approved == True,
-            Tour.is_banned == False
-        ).order_by(
-            Tour.view_count.desc(),
-            Tour.booked_count.desc()
-        ).limit(n_recommendations).all()
+        # Top tours phổ biến / trending đọc từ index trong bộ nhớ (không query database)
+        popular_tours = popularity_index.top_tours(n_recommendations, COLD_START_RANKING, db or self.db)
         
         recommendations = []
-        for tour in popular_tours:
-            score = float(tour.view_count + tour.booked_count * 2)
+        for tour, score in popular_tours:
             recommendations.append({
-                "tour_id": tour.id,
-                "tour_title": tour.title,
-                "tour_slug": tour.slug,
+                "tour_id": tour["id"],
+                "tour_title": tour["title"],
+                "tour_slug": tour["slug"],
                 "predicted_score": score,
-                "method": "cold_start_popular",
-                "explanation": "Tour phổ biến nhất - phù hợp cho người dùng mới"
+                "method": f"cold_start_{COLD_START_RANKING}",
+                "explanation": COLD_START_EXPLANATIONS[COLD_START_RANKING]
             })
         
         return recommendations
     
-    def handle_cold_start_tour(self, tour_id: int, n_similar: int = 5) -> List[Dict]:
+    def handle_cold_start_tour(
+        self,
+        tour_id: int,
+        n_similar: int = 5,
+        db: Optional[Session] = None
+    ) -> List[Dict]:
         """
         Xử lý Cold Start cho tour mới (chưa có interactions)
         Trả về tours tương tự dựa trên content features
@@ -1003,17 +2223,24 @@ class CollaborativeFiltering:
         Args:
             tour_id: ID của tour mới
             n_similar: Số lượng tours tương tự
+            db: Session của request (default: self.db / session_factory)
             
         Returns:
             Danh sách tours tương tự
         """
+        with self._db_session(db) as session:
+            return self._cold_start_tour(session, tour_id, n_similar)
+    
+    @staticmethod
+    def _cold_start_tour(db: Session, tour_id: int, n_similar: int) -> List[Dict]:
+        """Phần query của handle_cold_start_tour với session đã chọn"""
         # Lấy tour mới
-        new_tour = self.db.query(Tour).filter(Tour.id == tour_id).first()
+        new_tour = db.query(Tour).filter(Tour.id == tour_id).first()
         if not new_tour:
             return []
         
         # Tìm tours tương tự dựa trên category và các features khác
-        similar_tours = self.db.query(Tour).filter(
+        similar_tours = db.query(Tour).filter(
             Tour.is_active == True,
             Tour.is_approved == True,
             Tour.is_banned == False,
@@ -1036,57 +2263,6 @@ class CollaborativeFiltering:
         
         return recommendations
     
-    def batch_recommendations(
-        self,
-        user_ids: List[int],
-        method: str = "hybrid",
-        n_recommendations: int = 10
-    ) -> Dict[int, List[Dict]]:
-        """
-        Batch processing: Tính recommendations cho nhiều users cùng lúc
-        Tối ưu bằng cách tính similarity một lần và reuse
-        
-        Args:
-            user_ids: Danh sách user IDs
-            method: Phương pháp CF (user_based, tour_based, hybrid)
-            n_recommendations: Số lượng recommendations mỗi user
-            
-        Returns:
-            Dictionary: {user_id: [recommendations]}
-        """
-        # Đảm bảo matrix và similarities đã được tính
-        if self.user_tour_matrix is None:
-            self.build_user_tour_matrix()
-        
-        if method in ["user_based", "hybrid"]:
-            self.calculate_user_similarity()
-        
-        if method in ["tour_based", "hybrid"]:
-            self.calculate_tour_similarity()
-        
-        # Batch process users
-        results = {}
-        
-        # Chia users thành batches
-        for i in range(0, len(user_ids), self.batch_size):
-            batch_user_ids = user_ids[i:i + self.batch_size]
-            
-            for user_id in batch_user_ids:
-                try:
-                    if method == "user_based":
-                        recommendations = self.user_based_recommendations(user_id, n_recommendations)
-                    elif method == "tour_based":
-                        recommendations = self.tour_based_recommendations(user_id, n_recommendations)
-                    else:  # hybrid
-                        recommendations = self.hybrid_recommendations(user_id, n_recommendations)
-                    
-                    results[user_id] = recommendations
-                except Exception as e:
-                    warnings.warn(f"Lỗi khi tính recommendations cho user {user_id}: {e}")
-                    results[user_id] = []
-        
-        return results
-    
     def invalidate_cache(self):
         """
         Invalidate tất cả caches
@@ -1099,9 +2275,26 @@ class CollaborativeFiltering:
             self.user_tour_matrix = None
             self.user_similarity = None
             self.tour_similarity = None
+            self.user_neighbors = None
+            self.tour_neighbors = None
+            self.user_ann_index = None
+            self.als_model = None
+            self._als_stale_users = set()
+            self.tour_cooccurrence_positive = None
+            self.tour_cooccurrence_sum = None
+            self._clear_pending_updates()
+            self._cooccurrence_contributions_cache = None
+            self.tour_metadata = None
+            self._dirty_user_indices = set()
+            self._dirty_tour_indices = set()
             self._matrix_hash = None
+            self.model_version = None
             self._last_matrix_build_time = None
-            self.interactions_cache = None
+            self._last_cache_check_time = None
+            self._interaction_history_keys = None
+            self._interaction_history_type_codes = None
+            self._interaction_types = None
+            self._pending_interaction_history = {}
     
     def get_cache_stats(self) -> Dict:
         """
@@ -1115,7 +2308,8 @@ class CollaborativeFiltering:
             "user_similarity_calculated": self._user_similarity_calculated,
             "tour_similarity_calculated": self._tour_similarity_calculated,
             "cache_enabled": self.enable_caching,
-            "cache_ttl_seconds": self.cache_ttl_seconds
+            "cache_ttl_seconds": self.cache_ttl_seconds,
+            "model_version": self.model_version
         }
         
         if self._last_matrix_build_time:
@@ -1125,7 +2319,8 @@ class CollaborativeFiltering:
         
         if self.user_tour_matrix is not None:
             stats["matrix_shape"] = self.user_tour_matrix.shape
-            stats["matrix_size_mb"] = self.user_tour_matrix.nbytes / (1024 * 1024)
+            stats["matrix_size_mb"] = self._matrix_nbytes(self.user_tour_matrix) / (1024 * 1024)
+            stats["matrix_sparse"] = sp.issparse(self.user_tour_matrix)
         
         if self.user_similarity is not None:
             stats["user_similarity_shape"] = self.user_similarity.shape
@@ -1135,5 +2330,37 @@ class CollaborativeFiltering:
             stats["tour_similarity_shape"] = self.tour_similarity.shape
             stats["tour_similarity_size_mb"] = self.tour_similarity.nbytes / (1024 * 1024)
         
+        if self.user_neighbors is not None:
+            stats["user_neighbors_shape"] = self.user_neighbors.indices.shape
+            stats["user_neighbors_size_mb"] = self.user_neighbors.nbytes / (1024 * 1024)
+        
+        if self.user_ann_index is not None:
+            stats["user_ann_n_lists"] = self.user_ann_index.n_lists
+            stats["user_ann_n_probe"] = self.user_ann_index.n_probe
+            stats["user_ann_size_mb"] = self.user_ann_index.nbytes / (1024 * 1024)
+        
+        if self.als_model is not None:
+            stats["als_n_factors"] = self.als_model.n_factors
+            stats["als_size_mb"] = self.als_model.nbytes / (1024 * 1024)
+            stats["als_pending_fold_in_users"] = len(self._als_stale_users)
+        
+        if self.tour_neighbors is not None:
+            stats["tour_neighbors_shape"] = self.tour_neighbors.indices.shape
+            stats["tour_neighbors_size_mb"] = self.tour_neighbors.nbytes / (1024 * 1024)
+        
+        if self.tour_metadata is not None:
+            stats["tour_metadata_count"] = len(self.tour_metadata)
+        
+        stats["pending_dirty_users"] = len(self._dirty_user_indices)
+        stats["pending_dirty_tours"] = len(self._dirty_tour_indices)
+        stats["pending_buffered_rows"] = len(self._pending_rows["user_tour_matrix_raw"])
+        
+        if self.tour_cooccurrence_positive is not None:
+            stats["tour_cooccurrence_nnz"] = self.tour_cooccurrence_positive.nnz
+            stats["tour_cooccurrence_size_mb"] = (
+                self._matrix_nbytes(self.tour_cooccurrence_positive) +
+                self._matrix_nbytes(self.tour_cooccurrence_sum)
+            ) / (1024 * 1024)
+        
         return stats
 
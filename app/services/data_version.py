@@ -0,0 +1,112 @@
+"""
+Data version của interactions (bảng cf_data_version, một hàng duy nhất)
+Các endpoints thêm / xóa interactions tăng version trong cùng transaction với thay đổi,
+model chỉ cần đọc một hàng theo primary key để biết dữ liệu đã đổi hay chưa
+(bắt được cả update/delete không làm đổi số lượng rows).
+Khi bảng chưa được tạo (init_db), get_data_version trả về None và model
+quay lại cách hash counts của các bảng.
+
+Bảng tour / user_profile do service khác ghi (không tăng version được ở đây) và không
+có cột updated_at, nên hash của model gồm thêm fingerprint của catalog: tổng một hàm
+trộn của (id, trạng thái được recommend) trên mỗi bảng, nên tour mới / bị xóa / bị ban,
+duyệt, ẩn (kể cả đổi chỗ trạng thái giữa hai tours) và user mới / bị xóa đều kích hoạt rebuild.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import select, update, func, case
+from sqlalchemy.orm import Session
+from app.models.schema import DataVersion, Tour, UserProfile
+
+# Primary key của hàng version duy nhất
+_VERSION_ROW_ID = 1
+
+# Hằng số của hàm trộn id trong catalog fingerprint (multiplicative hash modulo số nguyên tố),
+# chỉ dùng phép nhân / modulo số nguyên để chạy được trên SQLite, PostgreSQL và MySQL
+_FINGERPRINT_MULTIPLIER = 2654435761
+_FINGERPRINT_MODULUS = 4294967291
+
+
+def get_data_version(db: Session) -> Optional[int]:
+    """
+    Đọc data version hiện tại
+
+    Returns:
+        Version, None nếu chưa có bảng / hàng version
+    """
+    try:
+        # Savepoint: bảng chưa tồn tại chỉ rollback savepoint, không bỏ thay đổi
+        # đang chờ commit trong session của caller
+        with db.begin_nested():
+            return db.execute(
+                select(DataVersion.version).where(DataVersion.id == _VERSION_ROW_ID)
+            ).scalar_one_or_none()
+    except Exception:
+        return None
+
+
+def _mix(value):
+    """Biểu thức SQL trộn một giá trị nguyên (gần như không có cặp thay đổi nào triệt tiêu nhau khi cộng)"""
+    return (value * _FINGERPRINT_MULTIPLIER) % _FINGERPRINT_MODULUS
+
+
+def get_catalog_fingerprint(db: Session) -> Optional[str]:
+    """
+    Fingerprint của tours được phép recommend và users
+
+    Một query, mỗi bảng một aggregate duy nhất: tổng _mix(2 * id + available) trên tour
+    (primary key và ba cột trạng thái) và tổng _mix(id) trên user_profile (chỉ primary key).
+    Thêm / xóa một hàng hoặc đổi trạng thái được recommend của một tour đều làm đổi tổng.
+
+    Không phát hiện được:
+        - Thay đổi các cột khác của tour / user (title, view_count, ...) - không ảnh hưởng ma trận
+        - Các thay đổi xảy ra rồi hoàn tác giữa hai lần kiểm tra
+        - Va chạm của hàm trộn (tổng thay đổi triệt tiêu đúng bằng 0 modulo), xác suất rất nhỏ
+
+    Returns:
+        Chuỗi fingerprint, None nếu query lỗi
+    """
+    available = case(
+        ((Tour.is_active == True) & (Tour.is_approved == True) & (Tour.is_banned == False), 1),
+        else_=0
+    )
+    try:
+        with db.begin_nested():
+            row = db.execute(select(
+                select(func.coalesce(func.sum(_mix(Tour.id * 2 + available)), 0)).scalar_subquery(),
+                select(func.coalesce(func.sum(_mix(UserProfile.id)), 0)).scalar_subquery(),
+            )).one()
+        return "-".join(str(int(value)) for value in row)
+    except Exception:
+        return None
+
+
+def bump_data_version(db: Session) -> Optional[int]:
+    """
+    Tăng data version trong transaction hiện tại của db (caller commit cùng thay đổi data)
+    UPDATE giữ row lock đến khi commit nên các lần tăng đồng thời được tuần tự hoá
+
+    Returns:
+        Version mới, None nếu không tăng được (bảng chưa tồn tại)
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        # Savepoint: lỗi ở đây không làm hỏng thay đổi data trong cùng transaction
+        with db.begin_nested():
+            updated = db.execute(
+                update(DataVersion)
+                .where(DataVersion.id == _VERSION_ROW_ID)
+                .values(version=DataVersion.version + 1, updated_at=now)
+            )
+            if updated.rowcount == 0:
+                db.add(DataVersion(id=_VERSION_ROW_ID, version=1, updated_at=now))
+                db.flush()
+            return db.execute(
+                select(DataVersion.version).where(DataVersion.id == _VERSION_ROW_ID)
+            ).scalar_one()
+    except Exception:
+        return None
+
+
+def data_version_hash(version: int, catalog: Optional[str] = None) -> str:
+    """Giá trị lưu vào _matrix_hash của model cho một data version và catalog fingerprint"""
+    return f"version:{version}:{catalog or ''}"
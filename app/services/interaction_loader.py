@@ -0,0 +1,178 @@
+"""
+Loader đọc dữ liệu cho Collaborative Filtering theo cột
+Chỉ select các cột cần thiết và stream theo chunk (yield_per / server-side cursor)
+vào NumPy arrays cấp phát trước, không tạo ORM objects
+"""
+import os
+import numpy as np
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+from sqlalchemy import select, func
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+from app.models.schema import UserTourInteraction, UserProfile, Tour
+
+# Số rows mỗi chunk khi stream từ database
+LOAD_CHUNK_SIZE = int(os.getenv("CF_LOAD_CHUNK_SIZE", "50000"))
+
+# Các cột của tour cần cho metadata (không load tour_info, destination_intro...)
+TOUR_METADATA_COLUMNS = [
+    Tour.id,
+    Tour.title,
+    Tour.slug,
+    Tour.tour_category_id,
+    Tour.is_active,
+    Tour.is_approved,
+    Tour.is_banned,
+    Tour.view_count,
+    Tour.booked_count,
+]
+
+
+# Mốc epoch cho datetime không có / có timezone (không có timezone được coi là UTC)
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+
+
+def to_epoch_seconds(created_at: Optional[datetime]) -> float:
+    """
+    Chuyển datetime thành epoch seconds (datetime không có timezone được coi là UTC)
+
+    Returns:
+        Epoch seconds, NaN nếu created_at là None
+    """
+    if created_at is None:
+        return np.nan
+    epoch = _EPOCH if created_at.tzinfo is None else _EPOCH_UTC
+    return (created_at - epoch).total_seconds()
+
+
+def to_epoch_seconds_array(values: Sequence[Optional[datetime]]) -> np.ndarray:
+    """Chuyển cả cột datetime thành array epoch seconds (NaN cho giá trị None)"""
+    return np.fromiter((to_epoch_seconds(value) for value in values), dtype=np.float64, count=len(values))
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """Mở rộng array khi số rows thực tế vượt quá số đã đếm (có insert trong lúc load)"""
+    grown = np.empty(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def load_interaction_arrays(db: Session, chunk_size: int = LOAD_CHUNK_SIZE) -> Dict:
+    """
+    Load toàn bộ interactions dạng cột
+
+    Args:
+        db: Database session
+        chunk_size: Số rows mỗi chunk
+
+    Returns:
+        Dictionary:
+            user_ids, tour_ids (int64), scores (float64),
+            created_at (float64 epoch seconds, NaN nếu không có),
+            type_codes (int16, index vào types), types (list interaction_type)
+    """
+    capacity = db.execute(select(func.count(UserTourInteraction.id))).scalar() or 0
+    user_ids = np.empty(capacity, dtype=np.int64)
+    tour_ids = np.empty(capacity, dtype=np.int64)
+    scores = np.empty(capacity, dtype=np.float64)
+    created_at = np.empty(capacity, dtype=np.float64)
+    type_codes = np.empty(capacity, dtype=np.int16)
+    type_vocabulary: Dict[Optional[str], int] = {}
+
+    stmt = select(
+        UserTourInteraction.user_id,
+        UserTourInteraction.tour_id,
+        UserTourInteraction.score,
+        UserTourInteraction.interaction_type,
+        UserTourInteraction.created_at,
+    ).execution_options(yield_per=chunk_size)
+
+    n_rows = 0
+    for partition in db.execute(stmt).partitions():
+        end = n_rows + len(partition)
+        if end > len(user_ids):
+            user_ids, tour_ids, scores, created_at, type_codes = (
+                _grow(array, end) for array in (user_ids, tour_ids, scores, created_at, type_codes)
+            )
+
+        chunk_user_ids, chunk_tour_ids, chunk_scores, chunk_types, chunk_created_at = zip(*partition)
+        user_ids[n_rows:end] = chunk_user_ids
+        tour_ids[n_rows:end] = chunk_tour_ids
+        scores[n_rows:end] = chunk_scores
+        created_at[n_rows:end] = to_epoch_seconds_array(chunk_created_at)
+        type_codes[n_rows:end] = [
+            type_vocabulary.setdefault(interaction_type, len(type_vocabulary))
+            for interaction_type in chunk_types
+        ]
+        n_rows = end
+
+    return {
+        "user_ids": user_ids[:n_rows],
+        "tour_ids": tour_ids[:n_rows],
+        "scores": scores[:n_rows],
+        "created_at": created_at[:n_rows],
+        "type_codes": type_codes[:n_rows],
+        "types": list(type_vocabulary),
+    }
+
+
+def load_user_ids(db: Session, chunk_size: int = LOAD_CHUNK_SIZE) -> np.ndarray:
+    """Load ID của tất cả users (chỉ cột id)"""
+    stmt = select(UserProfile.id).execution_options(yield_per=chunk_size)
+    return np.fromiter(db.execute(stmt).scalars(), dtype=np.int64)
+
+
+def load_available_tours(db: Session) -> List[Row]:
+    """
+    Load metadata của các tours được phép recommend (active, approved, không bị banned)
+    Chỉ select các cột trong TOUR_METADATA_COLUMNS
+
+    Returns:
+        List rows, truy cập theo tên cột (row.id, row.title, ...)
+    """
+    stmt = select(*TOUR_METADATA_COLUMNS).where(
+        Tour.is_active == True,
+        Tour.is_approved == True,
+        Tour.is_banned == False
+    )
+    return db.execute(stmt).all()
+
+
+def tour_to_metadata(tour) -> Dict:
+    """
+    Chuyển tour (row của load_available_tours hoặc Tour ORM object) thành metadata
+    gọn nhẹ dạng dict, an toàn để truyền sang thread khác (không lazy-load)
+
+    Returns:
+        Dictionary với các cột trong TOUR_METADATA_COLUMNS
+    """
+    return {column.key: getattr(tour, column.key) for column in TOUR_METADATA_COLUMNS}
+
+
+def load_recent_interactions(db: Session, since: datetime, chunk_size: int = LOAD_CHUNK_SIZE) -> Dict:
+    """
+    Load các interactions tạo từ thời điểm since (chỉ tour_id, score, created_at)
+
+    Returns:
+        Dictionary: tour_ids (int64), scores (float64), created_at (float64 epoch seconds)
+    """
+    stmt = select(
+        UserTourInteraction.tour_id,
+        UserTourInteraction.score,
+        UserTourInteraction.created_at,
+    ).where(UserTourInteraction.created_at >= since).execution_options(yield_per=chunk_size)
+
+    tour_ids, scores, created_at = [], [], []
+    for partition in db.execute(stmt).partitions():
+        chunk_tour_ids, chunk_scores, chunk_created_at = zip(*partition)
+        tour_ids.append(np.asarray(chunk_tour_ids, dtype=np.int64))
+        scores.append(np.asarray(chunk_scores, dtype=np.float64))
+        created_at.append(to_epoch_seconds_array(chunk_created_at))
+
+    return {
+        "tour_ids": np.concatenate(tour_ids) if tour_ids else np.zeros(0, dtype=np.int64),
+        "scores": np.concatenate(scores) if scores else np.zeros(0),
+        "created_at": np.concatenate(created_at) if created_at else np.zeros(0),
+    }
@@ -0,0 +1,479 @@
+"""
+Model Registry cho Collaborative Filtering
+Giữ các model đã build (matrix, similarities, ID maps) sống xuyên suốt process
+thay vì tạo CollaborativeFiltering mới cho mỗi request
+"""
+import os
+import threading
+import warnings
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.services.collaborative_filtering import CollaborativeFiltering
+from app.services.recommendation_store import (
+    RecommendationStore, PRECOMPUTED_DIR, PRECOMPUTED_METHODS, PRECOMPUTED_TOP_N
+)
+from app.services.model_snapshot import SNAPSHOT_DIR
+from app.services.result_cache import result_cache
+from app.services.popularity_index import popularity_index
+from app.utils.database import SessionLocal
+from app.utils.executors import build_executor
+
+# Cấu hình mặc định của model phục vụ API
+DEFAULT_MODEL_CONFIG = {
+    "normalize": True,
+    "handle_sparse": True,
+    "remove_outliers": True,
+    "use_time_decay": True,
+    "time_decay_half_life_days": 30,
+    "use_diversity": True,
+    "diversity_weight": 0.3,
+    "enable_explanation": True,
+    "enable_caching": True,
+    "cache_ttl_seconds": 3600,
+    # Bật sparse mode (CSR) cho catalog lớn: CF_USE_SPARSE=true
+    "use_sparse": os.getenv("CF_USE_SPARSE", "false").lower() == "true",
+    # Chỉ giữ top K láng giềng thay vì ma trận similarity N × N: CF_USE_NEIGHBOR_INDEX=true
+    "use_neighbor_index": os.getenv("CF_USE_NEIGHBOR_INDEX", "false").lower() == "true",
+    "n_neighbors": int(os.getenv("CF_N_NEIGHBORS", "50")),
+    # Tìm users tương tự gần đúng bằng IVF index khi số users rất lớn: CF_USE_ANN=true
+    "use_ann": os.getenv("CF_USE_ANN", "false").lower() == "true",
+    "ann_n_probe": int(os.getenv("CF_ANN_N_PROBE", "8")),
+    # Số latent factors và số vòng train của method ALS
+    "als_factors": int(os.getenv("CF_ALS_FACTORS", "32")),
+    "als_iterations": int(os.getenv("CF_ALS_ITERATIONS", "15")),
+    # Snapshot dùng chung giữa các workers (memory-map read-only)
+    "snapshot_dir": SNAPSHOT_DIR,
+}
+
+# Tự động tính lại store top-N (background thread) mỗi khi model được build lại:
+# CF_MATERIALIZE_ON_BUILD=true
+MATERIALIZE_ON_BUILD = os.getenv("CF_MATERIALIZE_ON_BUILD", "false").lower() == "true"
+
+# Lưu snapshot của model (background thread) mỗi khi model được build lại,
+# worker mới load snapshot lúc startup thay vì quét database: CF_SNAPSHOT_ON_BUILD=true
+SNAPSHOT_ON_BUILD = os.getenv("CF_SNAPSHOT_ON_BUILD", "false").lower() == "true"
+
+# Methods mặc định được tính sẵn state trước khi lưu snapshot
+SNAPSHOT_METHODS = ("user_based", "tour_based")
+
+
+class ModelRegistry:
+    """
+    Registry chứa các CollaborativeFiltering model dùng chung giữa các requests
+
+    Mỗi model được định danh bởi cấu hình preprocessing/features của nó.
+    DB session của request chỉ được dùng trong lần gọi (kiểm tra / build model),
+    không được giữ lại trên model: model sống xuyên process tự mở session riêng
+    qua SessionLocal khi cần đọc database.
+
+    Refresh theo kiểu copy-on-write: model mới được build trong background bên cạnh
+    model cũ rồi thay thế trong registry, requests tiếp tục dùng model cũ trong lúc build.
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple, CollaborativeFiltering] = {}
+        self._lock = threading.Lock()
+        # Mỗi cấu hình chỉ có một thread build tại một thời điểm
+        self._build_locks: Dict[Tuple, threading.Lock] = {}
+        # Cập nhật incremental áp dụng lên model cũ trong lúc model mới đang build,
+        # được áp dụng lại lên model mới khi thay thế (tên method của CollaborativeFiltering:
+        # apply_interaction / remove_interactions, kwargs, data_version)
+        self._pending_interactions: Dict[Tuple, List[Tuple[str, Dict, Optional[int]]]] = {}
+        # Store top-N đã tính trước (load lazy từ PRECOMPUTED_DIR)
+        self._store: Optional[RecommendationStore] = None
+        self._store_loaded_path: Optional[str] = None
+        self._store_lock = threading.Lock()
+        self._post_build_running = False
+        # Tăng mỗi lần drop_all: model build từ data đọc trước đó không được đăng ký
+        self._drop_generation = 0
+        # Store top-N bị bỏ bởi drop_all, không load lại cho đến lần materialize sau
+        self._dropped_store_path: Optional[str] = None
+
+    @staticmethod
+    def _make_key(config: Dict) -> Tuple:
+        """Tạo key hashable từ cấu hình model"""
+        return tuple(sorted(config.items()))
+
+    def get_model(self, db: Session, **config) -> CollaborativeFiltering:
+        """
+        Lấy model dùng chung cho cấu hình đã cho, build nếu chưa có hoặc đã hết hạn
+
+        Chỉ lần build đầu tiên chạy đồng bộ (mọi requests của cấu hình đó đợi).
+        Khi model hiện tại cần refresh, model mới được build trên build_executor
+        và thay thế khi xong; trong lúc đó requests vẫn nhận model hiện tại.
+
+        Args:
+            db: Database session (chỉ dùng để refresh model)
+            **config: Các tham số của CollaborativeFiltering (ghi đè DEFAULT_MODEL_CONFIG)
+
+        Returns:
+            CollaborativeFiltering instance đã sẵn sàng phục vụ
+        """
+        model_config = {**DEFAULT_MODEL_CONFIG, **config}
+        key = self._make_key(model_config)
+
+        with self._lock:
+            model = self._models.get(key)
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        if model is not None:
+            # Đang có lần rebuild khác: không cần kiểm tra lại
+            if not build_lock.acquire(blocking=False):
+                return model
+            try:
+                refresh_needed = model.refresh_needed(db)
+            except Exception:
+                build_lock.release()
+                raise
+            if refresh_needed:
+                # build_lock được giải phóng khi rebuild xong
+                build_executor.submit(self._rebuild_in_background, key, build_lock, model_config)
+            else:
+                build_lock.release()
+            return model
+
+        with build_lock:
+            with self._lock:
+                model = self._models.get(key)
+            if model is None:
+                model = self._rebuild(key, db, model_config)
+            return model
+
+    def _rebuild_in_background(self, key: Tuple, build_lock: threading.Lock, model_config: Dict):
+        """Build lại model với session riêng (session của request có thể đã đóng)"""
+        db = SessionLocal()
+        try:
+            self._rebuild(key, db, model_config)
+        except Exception as e:
+            warnings.warn(f"Lỗi khi build lại model: {e}")
+        finally:
+            db.close()
+            build_lock.release()
+
+    def _rebuild(self, key: Tuple, db: Session, model_config: Dict) -> CollaborativeFiltering:
+        """
+        Build model mới (gọi khi đang giữ build lock của key) rồi thay thế model cũ,
+        các interactions đến trong lúc build được áp dụng lại lên model mới
+
+        State đầy đủ (similarities, ALS) mà model cũ đã tính được tính trên model mới
+        trước khi thay thế, requests đầu tiên sau khi thay không phải đợi tính lại.
+        """
+        with self._lock:
+            self._pending_interactions[key] = []
+            drop_generation = self._drop_generation
+            old_model = self._models.get(key)
+
+        try:
+            model = CollaborativeFiltering(None, session_factory=SessionLocal, **model_config)
+            model.build_user_tour_matrix(db=db)
+            if old_model is not None:
+                model.build_missing_state(old_model.ready_methods())
+        except Exception:
+            with self._lock:
+                self._pending_interactions.pop(key, None)
+            raise
+
+        with self._lock:
+            pending = self._pending_interactions.pop(key, [])
+            # drop_all trong lúc build: data vừa đọc có thể đã bị xóa, không đăng ký
+            # (request tiếp theo build lại từ đầu)
+            registered = drop_generation == self._drop_generation
+            if registered:
+                self._models[key] = model
+
+        # Áp dụng lại là an toàn kể cả khi thay đổi đã có trong data vừa load
+        # (mỗi ô giữ max score, counts chỉ đổi khi ô đổi giữa 0 và khác 0)
+        for method, kwargs, data_version in pending:
+            getattr(model, method)(**kwargs)
+            model.advance_data_version(data_version)
+
+        if registered and (MATERIALIZE_ON_BUILD or SNAPSHOT_ON_BUILD):
+            self._start_post_build(model)
+        return model
+
+    def load_snapshot(self, directory: str = SNAPSHOT_DIR, **config) -> bool:
+        """
+        Đăng ký model từ snapshot trên disk (gọi lúc startup),
+        request đầu tiên dùng ngay model đã load thay vì build từ database
+
+        Args:
+            directory: Thư mục snapshot
+            **config: Cấu hình model (ghi đè DEFAULT_MODEL_CONFIG)
+
+        Returns:
+            True nếu đã load snapshot
+        """
+        model_config = {**DEFAULT_MODEL_CONFIG, **config}
+        model = CollaborativeFiltering(None, session_factory=SessionLocal, **model_config)
+        if not model.load_snapshot(directory):
+            return False
+
+        with self._lock:
+            self._models[self._make_key(model_config)] = model
+        return True
+
+    def save_snapshot(
+        self,
+        db: Session,
+        directory: str = SNAPSHOT_DIR,
+        methods: Tuple[str, ...] = SNAPSHOT_METHODS,
+        **config
+    ) -> bool:
+        """
+        Build (nếu cần) model, tính state các methods cần (similarities, ALS) và lưu snapshot
+
+        Args:
+            db: Database session
+            directory: Thư mục snapshot
+            methods: Các methods mà snapshot phải phục vụ được chỉ bằng cách đọc
+            **config: Cấu hình model (ghi đè DEFAULT_MODEL_CONFIG)
+
+        Returns:
+            True nếu đã lưu
+        """
+        model = self.get_model(db, **config)
+        return self._save_model_snapshot(model, directory, methods)
+
+    @staticmethod
+    def _save_model_snapshot(
+        model: CollaborativeFiltering,
+        directory: str = SNAPSHOT_DIR,
+        methods: Tuple[str, ...] = SNAPSHOT_METHODS
+    ) -> bool:
+        # Tính state trước để worker load snapshot không phải tính lại
+        # (state đầy đủ tính bên ngoài lock, write lock chỉ cho phần incremental)
+        model.build_missing_state(methods)
+        with model.rw_lock.write():
+            model.prepare(methods)
+
+        # Ghi ra disk dưới read lock: requests vẫn đọc model trong lúc ghi
+        with model.rw_lock.read():
+            state_revision = model.state_revision
+            if not model.save_snapshot(directory):
+                return False
+
+        # Sau khi lưu chính worker này cũng chuyển sang dùng bản memory-map
+        # (thay arrays của model nên giữ write lock), trừ khi model đã thay đổi
+        with model.rw_lock.write():
+            model.remap_snapshot(directory, state_revision)
+        return True
+
+    def get_recommendation_store(self) -> Optional[RecommendationStore]:
+        """
+        Lấy store top-N đã tính trước, load lại khi symlink trỏ sang version mới
+
+        Returns:
+            RecommendationStore hoặc None nếu chưa materialize
+        """
+        if not os.path.exists(PRECOMPUTED_DIR):
+            return self._store
+        store_path = os.path.realpath(PRECOMPUTED_DIR)
+
+        with self._store_lock:
+            if store_path == self._dropped_store_path:
+                return None
+            if self._store is None or store_path != self._store_loaded_path:
+                self._store = RecommendationStore.load(store_path)
+                self._store_loaded_path = store_path
+            return self._store
+
+    def materialize(
+        self,
+        db: Session,
+        methods: Tuple[str, ...] = PRECOMPUTED_METHODS,
+        top_n: int = PRECOMPUTED_TOP_N,
+        **config
+    ) -> RecommendationStore:
+        """
+        Tính trước top-N recommendations cho mọi users và ghi ra PRECOMPUTED_DIR
+
+        Args:
+            db: Database session
+            methods: Các methods cần tính trước
+            top_n: Số tours lưu cho mỗi user
+            **config: Cấu hình model (ghi đè DEFAULT_MODEL_CONFIG)
+
+        Returns:
+            RecommendationStore vừa ghi
+        """
+        model = self.get_model(db, **config)
+        return self._materialize_model(model, methods, top_n)
+
+    def _materialize_model(
+        self,
+        model: CollaborativeFiltering,
+        methods: Tuple[str, ...] = PRECOMPUTED_METHODS,
+        top_n: int = PRECOMPUTED_TOP_N
+    ) -> RecommendationStore:
+        # materialize_recommendations tự chạy từng chunk users qua serve
+        store = model.materialize_recommendations(methods, top_n)
+        store.save(PRECOMPUTED_DIR)
+        return self.get_recommendation_store()
+
+    def _start_post_build(self, model: CollaborativeFiltering):
+        """
+        Chạy các bước sau build trong background thread (bỏ qua nếu đang chạy):
+        materialize store top-N và/hoặc lưu snapshot của model
+        """
+        with self._store_lock:
+            if self._post_build_running:
+                return
+            self._post_build_running = True
+
+        def run():
+            try:
+                if MATERIALIZE_ON_BUILD:
+                    self._materialize_model(model)
+                if SNAPSHOT_ON_BUILD:
+                    self._save_model_snapshot(model)
+            except Exception as e:
+                warnings.warn(f"Lỗi khi chạy các bước sau build model: {e}")
+            finally:
+                with self._store_lock:
+                    self._post_build_running = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def apply_interaction(
+        self,
+        user_id: int,
+        tour_id: int,
+        score: float,
+        interaction_type: Optional[str] = None,
+        created_at: Optional[datetime] = None,
+        tour: Optional[Dict] = None,
+        data_version: Optional[int] = None
+    ) -> int:
+        """
+        Áp dụng interaction mới lên tất cả models đã build (incremental update)
+        để hành vi mới được phản ánh ngay mà không cần rebuild toàn bộ
+
+        Chỉ nhận giá trị thuần: ORM objects của request đã expire sau commit và
+        session có thể đã đóng khi hàm chạy trên model_executor.
+
+        Args:
+            user_id: ID của user
+            tour_id: ID của tour
+            score: Điểm của interaction
+            interaction_type: Loại interaction
+            created_at: Thời điểm tạo interaction
+            tour: Metadata của tour (tour_to_metadata)
+            data_version: Data version được tăng khi lưu interaction; model đang ở
+                version liền trước chuyển sang version này thay vì phải rebuild
+
+        Returns:
+            Số models đã được cập nhật
+        """
+        interaction = {
+            "user_id": user_id,
+            "tour_id": tour_id,
+            "score": score,
+            "interaction_type": interaction_type,
+            "created_at": created_at,
+            "tour": tour,
+        }
+        return self._apply_update("apply_interaction", interaction, data_version)
+
+    def remove_interactions(
+        self,
+        user_id: Optional[int] = None,
+        tour_id: Optional[int] = None,
+        data_version: Optional[int] = None
+    ) -> int:
+        """
+        Bỏ các interactions đã xoá của một user / một tour khỏi tất cả models đã build
+        (incremental, không rebuild): models và store top-N tiếp tục phục vụ
+
+        Args:
+            user_id: User đã bị xoá interactions
+            tour_id: Tour đã bị xoá interactions
+            data_version: Data version được tăng khi xoá
+
+        Returns:
+            Số models đã được cập nhật
+        """
+        return self._apply_update(
+            "remove_interactions", {"user_id": user_id, "tour_id": tour_id}, data_version
+        )
+
+    def _apply_update(self, method: str, kwargs: Dict, data_version: Optional[int]) -> int:
+        """
+        Gọi method cập nhật incremental trên mọi models, ghi lại để áp dụng lại
+        lên các models đang build
+        """
+        with self._lock:
+            models = list(self._models.values())
+            for pending in self._pending_interactions.values():
+                pending.append((method, kwargs, data_version))
+
+        updated = 0
+        for model in models:
+            if getattr(model, method)(**kwargs):
+                updated += 1
+            model.advance_data_version(data_version)
+        return updated
+
+    def invalidate_all(self):
+        """
+        Invalidate tất cả models
+        Request tiếp theo kích hoạt rebuild, model cũ tiếp tục phục vụ
+        cho đến khi model mới build xong
+        """
+        with self._lock:
+            for model in self._models.values():
+                model.mark_stale()
+
+    def drop_all(self):
+        """
+        Bỏ tất cả models và store top-N đã tính trước (sau khi xóa toàn bộ interactions):
+        khác invalidate_all, không tiếp tục phục vụ data đã bị xóa trong lúc build lại.
+        Request tiếp theo build model mới đồng bộ; lần build đang chạy (đọc data
+        trước khi xóa) không được đăng ký.
+        """
+        with self._lock:
+            self._models.clear()
+            self._drop_generation += 1
+
+        with self._store_lock:
+            self._store = None
+            self._store_loaded_path = None
+            if os.path.exists(PRECOMPUTED_DIR):
+                self._dropped_store_path = os.path.realpath(PRECOMPUTED_DIR)
+
+    def get_cache_stats(self) -> Dict:
+        """
+        Lấy thống kê cache của tất cả models trong registry
+
+        Returns:
+            Dictionary với số lượng models và stats của từng model
+        """
+        with self._lock:
+            models: List[Dict] = []
+            for key, model in self._models.items():
+                stats = model.get_cache_stats()
+                stats["config"] = dict(key)
+                models.append(stats)
+
+        stats = {
+            "registered_models": len(models),
+            "models": models,
+            "result_cache": result_cache.get_stats(),
+            "popularity_index": popularity_index.get_stats()
+        }
+
+        store = self.get_recommendation_store()
+        if store is not None:
+            stats["precomputed_store"] = {
+                "methods": list(store.methods),
+                "n_users": len(store.user_ids),
+                "top_n": store.top_n,
+                "saved_at": store.meta.get("saved_at"),
+                "size_mb": store.nbytes / (1024 * 1024),
+            }
+
+        return stats
+
+
+# Registry dùng chung cho toàn bộ process
+model_registry = ModelRegistry()
@@ -0,0 +1,159 @@
+"""
+Lưu / load snapshot của model Collaborative Filtering
+Mỗi array là một file .npy (ma trận CSR tách thành data/indices/indptr),
+metadata (version, config, hash, timestamp, tour metadata...) trong meta.json.
+Worker mới load snapshot thay vì quét lại toàn bộ database.
+
+Arrays được load bằng np.load(mmap_mode='r'): mọi workers map cùng các file nên
+chỉ có một bản vật lý của model trong page cache. Mỗi lần ghi tạo một thư mục
+version mới rồi đổi symlink directory → version mới (atomic), worker đang map
+version cũ vẫn đọc được cho đến khi load lại.
+"""
+import os
+import json
+import time
+import shutil
+import numpy as np
+import scipy.sparse as sp
+from typing import Callable, Dict, Optional, Tuple, Union
+
+# Thư mục lưu snapshot của model (symlink tới thư mục version hiện tại)
+SNAPSHOT_DIR = os.getenv("CF_SNAPSHOT_DIR", "data/snapshot")
+
+# Mode memory-map khi load: "r" (read-only, chia sẻ giữa workers), "c" (copy-on-write)
+# hoặc rỗng để đọc toàn bộ vào bộ nhớ riêng của process
+SNAPSHOT_MMAP_MODE = os.getenv("CF_SNAPSHOT_MMAP_MODE", "r") or None
+
+# Số version giữ lại trên disk (version hiện tại + version trước cho workers chưa load lại)
+_KEEP_VERSIONS = 2
+
+# Tăng khi format snapshot thay đổi, snapshot khác version sẽ bị bỏ qua
+SNAPSHOT_VERSION = 1
+
+_META_FILE = "meta.json"
+
+SnapshotArray = Union[np.ndarray, sp.csr_matrix]
+
+
+def replace_directory(directory: str, write: Callable[[str], None]):
+    """
+    Ghi nội dung mới vào một thư mục version riêng rồi đổi symlink directory
+    sang version đó (os.replace, atomic), reader không bao giờ thấy thư mục ghi dở
+
+    Args:
+        directory: Đường dẫn symlink
+        write: Hàm ghi nội dung, nhận đường dẫn thư mục version mới
+    """
+    directory = os.path.abspath(directory)
+    parent, name = os.path.dirname(directory), os.path.basename(directory)
+    os.makedirs(parent, exist_ok=True)
+
+    version_name = f"{name}.v{time.time_ns()}-{os.getpid()}"
+    version_directory = os.path.join(parent, version_name)
+    os.makedirs(version_directory)
+    write(version_directory)
+
+    tmp_link = os.path.join(parent, f".{name}.link-{os.getpid()}")
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(version_name, tmp_link)
+
+    # Thư mục thường (không phải symlink) từ format cũ: không thể swap atomic, xoá trước
+    if os.path.isdir(directory) and not os.path.islink(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_link, directory)
+
+    # Xoá các version cũ, giữ lại _KEEP_VERSIONS version mới nhất
+    versions = sorted(
+        (entry for entry in os.listdir(parent) if entry.startswith(f"{name}.v")),
+        key=lambda entry: os.path.getmtime(os.path.join(parent, entry))
+    )
+    for entry in versions[:-_KEEP_VERSIONS]:
+        if entry != version_name:
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+
+def write_snapshot(directory: str, arrays: Dict[str, Optional[SnapshotArray]], meta: Dict):
+    """
+    Ghi snapshot ra thư mục
+
+    Args:
+        directory: Thư mục snapshot
+        arrays: Các arrays cần lưu (dense hoặc CSR), giá trị None được bỏ qua
+        meta: Metadata (phải serialize được bằng JSON)
+    """
+    def write(version_directory: str):
+        dense_names, sparse_shapes = [], {}
+        for name, array in arrays.items():
+            if array is None:
+                continue
+            if sp.issparse(array):
+                array = sp.csr_matrix(array)
+                np.save(os.path.join(version_directory, f"{name}.data.npy"), array.data)
+                np.save(os.path.join(version_directory, f"{name}.indices.npy"), array.indices)
+                np.save(os.path.join(version_directory, f"{name}.indptr.npy"), array.indptr)
+                sparse_shapes[name] = list(array.shape)
+            else:
+                np.save(os.path.join(version_directory, f"{name}.npy"), np.asarray(array))
+                dense_names.append(name)
+
+        snapshot_meta = {
+            **meta,
+            "version": SNAPSHOT_VERSION,
+            "arrays": dense_names,
+            "sparse_arrays": sparse_shapes,
+        }
+        with open(os.path.join(version_directory, _META_FILE), "w", encoding="utf-8") as f:
+            json.dump(snapshot_meta, f)
+
+    replace_directory(directory, write)
+
+
+def read_snapshot_meta(directory: str) -> Optional[Dict]:
+    """
+    Chỉ đọc meta.json của snapshot (version, data hash, build timestamp...)
+
+    Returns:
+        Metadata, None nếu chưa có snapshot hoặc khác SNAPSHOT_VERSION
+    """
+    meta_path = os.path.join(directory, _META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != SNAPSHOT_VERSION:
+        return None
+    return meta
+
+
+def read_snapshot(
+    directory: str,
+    mmap_mode: Optional[str] = SNAPSHOT_MMAP_MODE
+) -> Optional[Tuple[Dict[str, SnapshotArray], Dict]]:
+    """
+    Đọc snapshot từ thư mục
+
+    Args:
+        directory: Thư mục snapshot
+        mmap_mode: Mode memory-map của np.load (None: đọc vào bộ nhớ)
+
+    Returns:
+        (arrays, meta), None nếu chưa có snapshot hoặc khác SNAPSHOT_VERSION
+    """
+    # Resolve symlink một lần để meta và arrays cùng thuộc một version
+    directory = os.path.realpath(directory)
+    meta = read_snapshot_meta(directory)
+    if meta is None:
+        return None
+
+    def load(filename: str) -> np.ndarray:
+        return np.load(os.path.join(directory, filename), mmap_mode=mmap_mode)
+
+    arrays: Dict[str, SnapshotArray] = {name: load(f"{name}.npy") for name in meta["arrays"]}
+    for name, shape in meta["sparse_arrays"].items():
+        arrays[name] = sp.csr_matrix(
+            (load(f"{name}.data.npy"), load(f"{name}.indices.npy"), load(f"{name}.indptr.npy")),
+            shape=tuple(shape)
+        )
+    return arrays, meta
@@ -0,0 +1,198 @@
+"""
+Top-K Neighbor Index cho Collaborative Filtering
+Lưu K láng giềng gần nhất của mỗi hàng (indices int32 + scores float32)
+thay vì ma trận similarity dense N × N
+"""
+import numpy as np
+import scipy.sparse as sp
+from typing import Tuple, Union
+
+# Vectors có thể là dense (np.ndarray) hoặc sparse (CSR/CSC)
+Vectors = Union[np.ndarray, sp.spmatrix]
+
+
+def cosine_similarity_rows(
+    rows: Vectors,
+    vectors: Vectors,
+    row_norms: np.ndarray,
+    vector_norms: np.ndarray
+) -> np.ndarray:
+    """
+    Cosine similarity giữa một số hàng và toàn bộ vectors, dùng norms có sẵn
+    Vector 0 có similarity 0 (giống sklearn cosine_similarity)
+
+    Args:
+        rows: Các vectors cần tính (R × D)
+        vectors: Toàn bộ vectors (N × D)
+        row_norms: L2 norms của rows
+        vector_norms: L2 norms của vectors
+
+    Returns:
+        Dense array similarity (R × N)
+    """
+    dots = rows @ vectors.T
+    if sp.issparse(dots):
+        dots = dots.toarray()
+    denominators = np.outer(row_norms, vector_norms)
+    return np.divide(dots, denominators, out=np.zeros(denominators.shape), where=denominators > 0)
+
+
+def _top_k_per_row(similarities: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lấy top K cột lớn nhất của mỗi hàng bằng argpartition, sắp xếp giảm dần
+
+    Returns:
+        (indices, scores) cùng shape (R × K)
+    """
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class NeighborIndex:
+    """
+    Index K láng giềng gần nhất theo cosine similarity
+
+    Mỗi hàng i lưu indices[i] (int32) và scores[i] (float32) của K hàng tương tự nhất
+    (không gồm chính nó), sắp xếp giảm dần. Ô trống có index -1.
+    Bộ nhớ O(N × K) thay vì O(N²), tra cứu láng giềng O(K).
+    """
+
+    def __init__(self, indices: np.ndarray, scores: np.ndarray):
+        self.indices = indices
+        self.scores = scores
+
+    @property
+    def k(self) -> int:
+        return self.indices.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.indices.nbytes + self.scores.nbytes
+
+    @classmethod
+    def build(
+        cls,
+        vectors: Vectors,
+        norms: np.ndarray,
+        k: int,
+        block_size: int = 1024
+    ) -> "NeighborIndex":
+        """
+        Build index theo từng block hàng, chỉ giữ block_size × N similarities trong bộ nhớ
+
+        Args:
+            vectors: Ma trận vectors (N × D), mỗi hàng là một user/tour
+            norms: L2 norms của từng hàng
+            k: Số láng giềng cần giữ
+            block_size: Số hàng tính similarity mỗi lần
+
+        Returns:
+            NeighborIndex
+        """
+        n_rows = vectors.shape[0]
+        k = max(0, min(k, n_rows - 1))
+        indices = np.full((n_rows, k), -1, dtype=np.int32)
+        scores = np.zeros((n_rows, k), dtype=np.float32)
+
+        if k == 0:
+            return cls(indices, scores)
+
+        for start in range(0, n_rows, block_size):
+            stop = min(start + block_size, n_rows)
+            similarities = cosine_similarity_rows(vectors[start:stop], vectors, norms[start:stop], norms)
+            # Loại bỏ chính hàng đó
+            similarities[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+            top_indices, top_scores = _top_k_per_row(similarities, k)
+            indices[start:stop] = top_indices
+            scores[start:stop] = top_scores
+
+        return cls(indices, scores)
+
+    def neighbors(self, row_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Lấy láng giềng của một hàng
+
+        Returns:
+            (indices, scores) đã sắp xếp giảm dần, bỏ các ô trống
+        """
+        indices = self.indices[row_idx]
+        valid = indices >= 0
+        return indices[valid].astype(np.int64), self.scores[row_idx][valid].astype(np.float64)
+
+    def lookup(self, row_idx: int, targets: np.ndarray) -> np.ndarray:
+        """
+        Tra similarity giữa một hàng và các targets trong O(len(targets) × K)
+        Cosine đối xứng nên tìm cả trong láng giềng của hàng và láng giềng của target;
+        cặp không nằm trong top K của nhau được coi là similarity 0
+
+        Args:
+            row_idx: Index của hàng
+            targets: Index các hàng cần tra
+
+        Returns:
+            Array similarity tương ứng với targets
+        """
+        targets = np.asarray(targets, dtype=np.int64)
+        forward_matches = self.indices[row_idx][None, :] == targets[:, None]
+        forward = np.where(forward_matches, self.scores[row_idx][None, :], 0).sum(axis=1)
+
+        reverse_matches = self.indices[targets] == row_idx
+        reverse = np.where(reverse_matches, self.scores[targets], 0).sum(axis=1)
+
+        return np.where(forward_matches.any(axis=1), forward, reverse).astype(np.float64)
+
+    def add_rows(self, n_new_rows: int):
+        """Thêm các hàng mới chưa có láng giềng (vector 0)"""
+        self.indices = np.vstack([self.indices, np.full((n_new_rows, self.k), -1, dtype=np.int32)])
+        self.scores = np.vstack([self.scores, np.zeros((n_new_rows, self.k), dtype=np.float32)])
+
+    def update(self, vectors: Vectors, norms: np.ndarray, dirty: np.ndarray):
+        """
+        Cập nhật index khi một số hàng (dirty) thay đổi, kết quả giống build lại từ đầu
+
+        - Hàng dirty và hàng đang có láng giềng dirty: tính lại top K
+          (similarity của láng giềng cũ có thể giảm, cần xét lại toàn bộ)
+        - Hàng còn lại: similarity với các hàng khác không đổi, chỉ cần cho
+          các hàng dirty cạnh tranh với top K hiện tại
+
+        Args:
+            vectors: Ma trận vectors sau khi thay đổi
+            norms: L2 norms đã cập nhật
+            dirty: Index các hàng đã thay đổi
+        """
+        if self.k == 0 or len(dirty) == 0:
+            return
+
+        n_rows = vectors.shape[0]
+        is_dirty = np.zeros(n_rows, dtype=bool)
+        is_dirty[dirty] = True
+
+        has_dirty_neighbor = np.zeros(n_rows, dtype=bool)
+        valid = self.indices >= 0
+        has_dirty_neighbor[np.flatnonzero((is_dirty[self.indices] & valid).any(axis=1))] = True
+        recompute = np.flatnonzero(is_dirty | has_dirty_neighbor)
+
+        # Hàng còn lại: gộp top K hiện tại với similarity mới tới các hàng dirty
+        others = np.flatnonzero(~(is_dirty | has_dirty_neighbor))
+        if len(others) > 0:
+            dirty_similarities = cosine_similarity_rows(vectors[dirty], vectors[others], norms[dirty], norms[others]).T
+
+            current_scores = np.where(valid[others], self.scores[others].astype(np.float64), -np.inf)
+            candidate_indices = np.hstack([self.indices[others], np.broadcast_to(dirty, (len(others), len(dirty)))])
+            candidate_scores = np.hstack([current_scores, dirty_similarities])
+            top, top_scores = _top_k_per_row(candidate_scores, self.k)
+
+            merged_indices = np.take_along_axis(candidate_indices, top, axis=1)
+            empty = np.isneginf(top_scores)
+            merged_indices[empty] = -1
+            self.indices[others] = merged_indices
+            self.scores[others] = np.where(empty, 0, top_scores)
+
+        for start in range(0, len(recompute), 1024):
+            rows = recompute[start:start + 1024]
+            similarities = cosine_similarity_rows(vectors[rows], vectors, norms[rows], norms)
+            similarities[np.arange(len(rows)), rows] = -np.inf
+            self.indices[rows], self.scores[rows] = _top_k_per_row(similarities, self.k)
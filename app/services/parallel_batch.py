@@ -0,0 +1,122 @@
+"""
+Batch recommendations song song trên nhiều process cho các job toàn bộ users (refresh hằng đêm)
+
+Process chính build model, tính trước mọi state method cần rồi lưu snapshot.
+Mỗi worker load snapshot bằng memory-map read-only nên các workers dùng chung một bản
+vật lý của model trong page cache; users được chia thành chunks và phân phối cho
+workers, mỗi chunk chạy batch_recommendations (tính điểm theo ma trận).
+"""
+import os
+import time
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Sequence
+from sqlalchemy.orm import Session
+from app.services.collaborative_filtering import CollaborativeFiltering
+from app.services.model_registry import DEFAULT_MODEL_CONFIG, model_registry
+from app.services.model_snapshot import SNAPSHOT_DIR
+
+# Số worker processes và số users mỗi chunk gửi cho một worker
+PARALLEL_WORKERS = int(os.getenv("CF_PARALLEL_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_CHUNK_SIZE = int(os.getenv("CF_PARALLEL_CHUNK_SIZE", "1000"))
+
+# Model của worker process (load từ snapshot trong _init_worker)
+_worker_model: Optional[CollaborativeFiltering] = None
+
+
+def _init_worker(directory: str, model_config: Dict):
+    """Load snapshot (memory-map) một lần cho mỗi worker process"""
+    global _worker_model
+    warnings.filterwarnings("ignore", category=RuntimeWarning)
+
+    model = CollaborativeFiltering(None, **model_config)
+    if not model.load_snapshot(directory):
+        raise RuntimeError(f"Không load được snapshot từ {directory}")
+    _worker_model = model
+
+
+def _score_chunk(user_ids: List[int], method: str, n_recommendations: int) -> Dict[int, List[Dict]]:
+    """Tính recommendations cho một chunk users trên model của worker"""
+    return _worker_model.batch_recommendations(user_ids, method, n_recommendations)
+
+
+def run_parallel_batch(
+    db: Session,
+    user_ids: Optional[Sequence[int]] = None,
+    method: str = "hybrid",
+    n_recommendations: int = 10,
+    workers: int = PARALLEL_WORKERS,
+    chunk_size: int = PARALLEL_CHUNK_SIZE,
+    directory: str = SNAPSHOT_DIR,
+    on_chunk: Optional[Callable[[Dict[int, List[Dict]]], None]] = None,
+    **config
+) -> Dict:
+    """
+    Tính recommendations cho nhiều users (mặc định mọi users) trên process pool
+
+    Args:
+        db: Database session (build model nếu registry chưa có)
+        user_ids: Users cần tính (None: mọi users của model)
+        method: user_based, tour_based, hybrid hoặc als
+        n_recommendations: Số recommendations mỗi user
+        workers: Số worker processes (<= 1: chạy trong process hiện tại)
+        chunk_size: Số users mỗi chunk gửi cho worker
+        directory: Thư mục snapshot dùng chung giữa các workers
+        on_chunk: Nhận kết quả từng chunk khi xong (khi có, results không được gom lại)
+        **config: Cấu hình model (ghi đè DEFAULT_MODEL_CONFIG)
+
+    Returns:
+        Dictionary với results (user_id → recommendations) và stats
+        (số users, thời gian snapshot / scoring, users/sec)
+    """
+    model_config = {**DEFAULT_MODEL_CONFIG, **config}
+
+    start = time.time()
+    model = model_registry.get_model(db, **config)
+    if not model_registry.save_snapshot(db, directory, methods=(method,), **config):
+        raise RuntimeError("Model chưa có dữ liệu, không thể lưu snapshot")
+    if user_ids is None:
+        user_ids = list(model.user_ids or [])
+    snapshot_seconds = time.time() - start
+
+    chunks = [list(user_ids[i:i + chunk_size]) for i in range(0, len(user_ids), chunk_size)]
+    results: Dict[int, List[Dict]] = {}
+
+    def collect(chunk_results: Dict[int, List[Dict]]):
+        if on_chunk is not None:
+            on_chunk(chunk_results)
+        else:
+            results.update(chunk_results)
+
+    start = time.time()
+    if workers <= 1:
+        _init_worker(directory, model_config)
+        for chunk in chunks:
+            collect(_score_chunk(chunk, method, n_recommendations))
+    else:
+        # spawn: không fork process đang có threads (registry, executors) giữ locks
+        with ProcessPoolExecutor(
+            max_workers=min(workers, max(len(chunks), 1)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(directory, model_config)
+        ) as executor:
+            futures = [executor.submit(_score_chunk, chunk, method, n_recommendations) for chunk in chunks]
+            for future in as_completed(futures):
+                collect(future.result())
+    scoring_seconds = time.time() - start
+
+    return {
+        "results": results,
+        "stats": {
+            "method": method,
+            "n_users": len(user_ids),
+            "n_chunks": len(chunks),
+            "workers": workers,
+            "chunk_size": chunk_size,
+            "snapshot_seconds": snapshot_seconds,
+            "scoring_seconds": scoring_seconds,
+            "users_per_second": len(user_ids) / scoring_seconds if scoring_seconds > 0 else 0.0,
+        }
+    }
@@ -0,0 +1,250 @@
+"""
+Bảng xếp hạng tours phổ biến / trending giữ trong bộ nhớ
+Cold start và fallback đọc top tours từ các arrays đã sắp xếp sẵn thay vì
+query ORDER BY view_count trên bảng tour ở mỗi request.
+
+- popular: tours được phép recommend theo view_count, booked_count giảm dần
+- trending: tổng score interactions trong TRENDING_WINDOW_DAYS gần nhất,
+  mỗi interaction giảm trọng số theo exponential decay (half life TRENDING_HALF_LIFE_DAYS)
+
+Index được tính lại mỗi POPULARITY_REFRESH_SECONDS bởi một thread nền
+(start_periodic_refresh, gọi lúc startup), requests tiếp tục đọc bảng xếp hạng cũ
+trong lúc tính. Khi không có thread nền (scripts, tests), ensure_fresh tính lại
+lazy: request đầu tiên sau khi index quá hạn kích hoạt refresh trên build_executor
+và vẫn nhận bảng xếp hạng cũ.
+"""
+import os
+import time
+import threading
+import warnings
+import numpy as np
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.services.interaction_loader import load_available_tours, load_recent_interactions
+from app.utils.executors import build_executor
+
+# Chu kỳ tính lại index
+POPULARITY_REFRESH_SECONDS = float(os.getenv("CF_POPULARITY_REFRESH_SECONDS", "300"))
+
+# Cửa sổ thời gian và half life (ngày) của điểm trending
+TRENDING_WINDOW_DAYS = float(os.getenv("CF_TRENDING_WINDOW_DAYS", "7"))
+TRENDING_HALF_LIFE_DAYS = float(os.getenv("CF_TRENDING_HALF_LIFE_DAYS", "2"))
+
+# Các bảng xếp hạng index tính
+RANKINGS = ("popular", "trending")
+
+# Bảng xếp hạng dùng cho user mới (cold start): popular hoặc trending
+COLD_START_RANKING = os.getenv("CF_COLD_START_RANKING", "popular").lower()
+if COLD_START_RANKING not in RANKINGS:
+    warnings.warn(
+        f"CF_COLD_START_RANKING={COLD_START_RANKING!r} không hợp lệ "
+        f"(chỉ hỗ trợ {', '.join(RANKINGS)}), dùng 'popular'"
+    )
+    COLD_START_RANKING = "popular"
+
+
+class PopularityIndex:
+    """
+    Top tours phổ biến / trending, tra cứu không cần database
+
+    - rankings[kind] = (tour_ids, scores) đã sắp xếp theo thứ hạng
+    - Toàn bộ state được thay bằng một lần gán khi refresh (readers không cần lock)
+    """
+
+    def __init__(self, refresh_seconds: float = POPULARITY_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        # (tour metadata theo id, rankings, thời điểm build)
+        self._state: Optional[Tuple[Dict[int, Dict], Dict[str, Tuple[np.ndarray, np.ndarray]], float]] = None
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    @property
+    def n_tours(self) -> int:
+        """Số tours được phép recommend ở lần refresh gần nhất"""
+        return len(self._state[0]) if self._state else 0
+
+    def ensure_fresh(self, db: Optional[Session] = None):
+        """
+        Build index nếu chưa có (đồng bộ, dùng db), hoặc tính lại trong background
+        khi đã quá refresh_seconds (lazy: chỉ khi có request, thread nền của
+        start_periodic_refresh thường đã refresh trước đó)
+
+        Args:
+            db: Session của request (chỉ dùng cho lần build đầu tiên)
+        """
+        if self._state is None:
+            with self._refresh_lock:
+                if self._state is None:
+                    if db is not None:
+                        self.refresh(db)
+                    else:
+                        self._refresh_with_new_session()
+            return
+
+        if time.monotonic() - self._state[2] < self.refresh_seconds:
+            return
+        if self._refresh_lock.acquire(blocking=False):
+            # _refresh_lock được giải phóng khi refresh xong
+            build_executor.submit(self._refresh_in_background)
+
+    def start_periodic_refresh(self):
+        """
+        Chạy thread nền tính lại index mỗi refresh_seconds (gọi lúc startup),
+        không phụ thuộc vào việc có request hay không. Gọi lại khi đang chạy không có tác dụng.
+        """
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(
+            target=self._periodic_refresh, name="cf-popularity-refresh", daemon=True
+        )
+        self._refresh_thread.start()
+
+    def stop_periodic_refresh(self):
+        """Dừng thread nền (gọi lúc shutdown)"""
+        self._stop_event.set()
+
+    def _periodic_refresh(self):
+        """Vòng lặp của thread nền: đợi refresh_seconds rồi tính lại index"""
+        while not self._stop_event.wait(self.refresh_seconds):
+            # Bỏ qua chu kỳ này nếu đang có lần refresh khác (lazy hoặc build đầu tiên)
+            if not self._refresh_lock.acquire(blocking=False):
+                continue
+            self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        """Tính lại index trên build_executor / thread nền (đang giữ _refresh_lock)"""
+        try:
+            self._refresh_with_new_session()
+        except Exception as e:
+            warnings.warn(f"Lỗi khi tính lại popularity index: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh_with_new_session(self):
+        """Tính lại index với session riêng (session của request có thể đã đóng)"""
+        from app.utils.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            self.refresh(db)
+        finally:
+            db.close()
+
+    def refresh(self, db: Session):
+        """
+        Tính lại bảng xếp hạng popular và trending từ database
+
+        Args:
+            db: Database session
+        """
+        tours = load_available_tours(db)
+        metadata = {
+            tour.id: {
+                "id": tour.id,
+                "title": tour.title,
+                "slug": tour.slug,
+                "view_count": tour.view_count,
+                "booked_count": tour.booked_count,
+            }
+            for tour in tours
+        }
+        tour_ids = np.array([tour.id for tour in tours], dtype=np.int64)
+        view_counts = np.array([tour.view_count or 0 for tour in tours], dtype=np.float64)
+        booked_counts = np.array([tour.booked_count or 0 for tour in tours], dtype=np.float64)
+
+        # Giống ORDER BY view_count DESC, booked_count DESC (hoà thì theo id)
+        order = np.lexsort((tour_ids, -booked_counts, -view_counts))
+        rankings = {"popular": (tour_ids[order], (view_counts + booked_counts * 2)[order])}
+        rankings["trending"] = self._trending_ranking(db, tour_ids)
+
+        self._state = (metadata, rankings, time.monotonic())
+
+    @staticmethod
+    def _trending_ranking(db: Session, tour_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Xếp hạng trending: tổng score * 0.5^(tuổi / half life) của interactions
+        trong cửa sổ gần nhất, chỉ giữ tours được phép recommend có điểm dương
+        """
+        now = datetime.now(timezone.utc)
+        recent = load_recent_interactions(db, now - timedelta(days=TRENDING_WINDOW_DAYS))
+
+        age_days = (now.timestamp() - recent["created_at"]) / 86400
+        weights = np.where(np.isnan(age_days), 1.0, 0.5 ** (np.maximum(age_days, 0) / TRENDING_HALF_LIFE_DAYS))
+
+        sorted_tour_ids = np.sort(tour_ids)
+        positions = np.searchsorted(sorted_tour_ids, recent["tour_ids"])
+        positions = np.minimum(positions, max(len(sorted_tour_ids) - 1, 0))
+        available = (
+            sorted_tour_ids[positions] == recent["tour_ids"]
+            if len(sorted_tour_ids) else np.zeros(len(positions), dtype=bool)
+        )
+
+        scores = np.bincount(
+            positions[available],
+            weights=(recent["scores"] * weights)[available],
+            minlength=len(sorted_tour_ids)
+        )
+        trending = np.flatnonzero(scores > 0)
+        order = np.lexsort((sorted_tour_ids[trending], -scores[trending]))
+        return sorted_tour_ids[trending][order], scores[trending][order]
+
+    def top_tours(
+        self,
+        n: int,
+        ranking: str = "popular",
+        db: Optional[Session] = None
+    ) -> List[Tuple[Dict, float]]:
+        """
+        Lấy top N tours theo bảng xếp hạng
+
+        Args:
+            n: Số tours
+            ranking: popular hoặc trending (trending thiếu tours thì bổ sung từ popular,
+                giá trị khác dùng popular)
+            db: Session của request (chỉ dùng khi index chưa được build)
+
+        Returns:
+            Danh sách (tour metadata, score) theo thứ hạng
+        """
+        self.ensure_fresh(db)
+        metadata, rankings, _ = self._state
+
+        if ranking not in rankings:
+            ranking = "popular"
+        tour_ids, scores = rankings[ranking]
+        top = [(metadata[tour_id], score) for tour_id, score in zip(tour_ids[:n].tolist(), scores[:n].tolist())]
+
+        if ranking != "popular" and len(top) < n:
+            selected = {tour["id"] for tour, _ in top}
+            for tour, score in self.top_tours(n, "popular"):
+                if len(top) >= n:
+                    break
+                if tour["id"] not in selected:
+                    top.append((tour, score))
+        return top
+
+    def get_stats(self) -> Dict:
+        """
+        Lấy thống kê của index
+
+        Returns:
+            Dictionary với số tours, số tours trending, tuổi của index
+        """
+        if self._state is None:
+            return {"built": False}
+
+        _, rankings, built_at = self._state
+        return {
+            "built": True,
+            "n_tours": self.n_tours,
+            "n_trending_tours": len(rankings["trending"][0]),
+            "age_seconds": time.monotonic() - built_at,
+            "refresh_seconds": self.refresh_seconds,
+        }
+
+
+# Index dùng chung cho toàn bộ process
+popularity_index = PopularityIndex()
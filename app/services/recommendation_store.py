@@ -0,0 +1,112 @@
+"""
+Store chứa top-N ứng viên recommendations đã tính trước cho mọi users
+Mỗi method lưu hai ma trận N_users × top_n (tour IDs int64, -1 là ô trống; scores float64,
+cùng điểm với live path) dưới dạng file .npy, được memory-map khi load nên request
+chỉ đọc đúng một hàng. Hybrid được kết hợp từ hàng của user_based và tour_based.
+"""
+import os
+import json
+import numpy as np
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from app.services.model_snapshot import replace_directory
+
+# Thư mục lưu store và số tours tính trước cho mỗi user
+PRECOMPUTED_DIR = os.getenv("CF_PRECOMPUTED_DIR", "data/precomputed")
+PRECOMPUTED_TOP_N = int(os.getenv("CF_PRECOMPUTED_TOP_N", "100"))
+
+# Các methods được tính trước
+PRECOMPUTED_METHODS = ("user_based", "tour_based", "hybrid", "als")
+
+_META_FILE = "meta.json"
+
+
+class RecommendationStore:
+    """
+    Top-N recommendations đã tính trước, tra cứu theo user ID
+
+    - methods[method] = (tour_ids, scores), hàng thứ i ứng với user_ids[i]
+    - Tours trong mỗi hàng sắp xếp theo score giảm dần, phần thiếu là tour_id = -1
+    """
+
+    def __init__(self, user_ids: np.ndarray, methods: Dict[str, Tuple[np.ndarray, np.ndarray]], meta: Optional[Dict] = None):
+        self.user_ids = user_ids
+        self.methods = methods
+        self.meta = meta or {}
+        self._user_id_to_row = {int(user_id): row for row, user_id in enumerate(user_ids.tolist())}
+
+    @property
+    def top_n(self) -> int:
+        return self.meta.get("top_n", 0)
+
+    @property
+    def nbytes(self) -> int:
+        return self.user_ids.nbytes + sum(
+            tour_ids.nbytes + scores.nbytes for tour_ids, scores in self.methods.values()
+        )
+
+    def lookup(self, method: str, user_id: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Lấy danh sách tours đã tính trước của một user
+
+        Returns:
+            (tour_ids, scores) đã bỏ các ô trống, None nếu store không có user/method
+        """
+        row = self._user_id_to_row.get(user_id)
+        if row is None or method not in self.methods:
+            return None
+
+        tour_ids, scores = self.methods[method]
+        row_tour_ids = np.asarray(tour_ids[row])
+        valid = row_tour_ids >= 0
+        return row_tour_ids[valid], np.asarray(scores[row])[valid]
+
+    def save(self, directory: str = PRECOMPUTED_DIR):
+        """
+        Ghi store ra thư mục (mỗi array một file .npy + meta.json)
+        Ghi vào thư mục version mới rồi đổi symlink, reader không bao giờ thấy store ghi dở
+        """
+        meta = {
+            **self.meta,
+            "methods": list(self.methods),
+            "n_users": len(self.user_ids),
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+        def write(version_directory: str):
+            np.save(os.path.join(version_directory, "user_ids.npy"), self.user_ids)
+            for method, (tour_ids, scores) in self.methods.items():
+                np.save(os.path.join(version_directory, f"{method}.tour_ids.npy"), tour_ids)
+                np.save(os.path.join(version_directory, f"{method}.scores.npy"), scores)
+            with open(os.path.join(version_directory, _META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+        replace_directory(directory, write)
+        self.meta = meta
+
+    @classmethod
+    def load(cls, directory: str = PRECOMPUTED_DIR) -> Optional["RecommendationStore"]:
+        """
+        Load store từ thư mục, các ma trận được memory-map (mmap_mode='r')
+
+        Returns:
+            RecommendationStore hoặc None nếu thư mục chưa có store
+        """
+        # Resolve symlink một lần để meta và arrays cùng thuộc một version
+        directory = os.path.realpath(directory)
+        meta_path = os.path.join(directory, _META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+
+        user_ids = np.load(os.path.join(directory, "user_ids.npy"))
+        methods = {
+            method: (
+                np.load(os.path.join(directory, f"{method}.tour_ids.npy"), mmap_mode="r"),
+                np.load(os.path.join(directory, f"{method}.scores.npy"), mmap_mode="r"),
+            )
+            for method in meta["methods"]
+        }
+        return cls(user_ids, methods, meta)
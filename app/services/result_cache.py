@@ -0,0 +1,201 @@
+"""
+Cache kết quả recommendations trong process (LRU + TTL)
+Key: (user_id, method, limit, model_version), request lặp lại của cùng user
+(reload trang, phân trang) không phải tính lại scoring, diversity (MMR) và explanations.
+
+- model_version đổi sau mỗi lần build lại model nên kết quả của model cũ tự hết hiệu lực
+- Cập nhật incremental không đổi model_version: endpoints ghi interactions
+  invalidate các kết quả của user bị ảnh hưởng (hoặc toàn bộ cache)
+- Chỉ cache kết quả tính từ model: cold start / popular fallback không phụ thuộc
+  model_version và phải đổi ngay khi user có interaction đầu tiên
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Số kết quả tối đa (0: tắt cache) và thời gian sống của mỗi kết quả
+RESULT_CACHE_SIZE = int(os.getenv("CF_RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("CF_RESULT_CACHE_TTL_SECONDS", "300"))
+
+CacheKey = Tuple[int, str, int, Optional[int]]
+
+# Lấy trước khi tính kết quả, truyền lại cho put: (số thứ tự invalidate, thời điểm lấy)
+Generation = Tuple[int, float]
+
+
+class RecommendationResultCache:
+    """
+    LRU cache có TTL cho danh sách recommendations của từng user
+
+    - Mỗi user giữ tập keys của mình để invalidate theo user không phải quét cache
+    - Mỗi lần invalidate nhận một số thứ tự tăng dần, lưu theo user (clear: cho mọi users);
+      kết quả của user được tính xong sau khi chính user đó bị invalidate (có thể dựa
+      trên model trước khi cập nhật) không được ghi vào cache, users khác không bị ảnh hưởng
+    - Kết quả tính lâu hơn ttl_seconds không được ghi, nên chỉ cần nhớ các lần
+      invalidate trong ttl_seconds gần nhất
+    """
+
+    def __init__(self, max_size: int = RESULT_CACHE_SIZE, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._user_keys: Dict[int, set] = {}
+        self._lock = threading.Lock()
+        self._sequence = 0
+        # user_id → (số thứ tự, thời điểm) của lần invalidate gần nhất, theo thứ tự thời gian
+        self._user_invalidations: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+        self._cleared_sequence = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def generation(self) -> Generation:
+        """Lấy trước khi tính kết quả, truyền lại cho put"""
+        with self._lock:
+            return self._sequence, time.monotonic()
+
+    def get(self, key: CacheKey) -> Optional[List[Dict]]:
+        """
+        Lấy kết quả đã cache
+
+        Returns:
+            Danh sách recommendations, None nếu chưa có hoặc đã hết hạn
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            expires_at, recommendations = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return recommendations
+
+    def put(self, key: CacheKey, recommendations: List[Dict], generation: Generation):
+        """
+        Lưu kết quả, bỏ qua nếu user (hoặc toàn bộ cache) đã bị invalidate
+        kể từ lúc lấy generation
+
+        Args:
+            key: (user_id, method, limit, model_version)
+            recommendations: Kết quả trả về cho user
+            generation: Giá trị generation() lấy trước khi tính kết quả
+        """
+        if not self.enabled or key[3] is None:
+            return
+
+        sequence, started_at = generation
+        with self._lock:
+            now = time.monotonic()
+            if now - started_at >= self.ttl_seconds:
+                return
+            if sequence < self._cleared_sequence:
+                return
+            invalidation = self._user_invalidations.get(key[0])
+            if invalidation is not None and sequence < invalidation[0]:
+                return
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, recommendations)
+            self._user_keys.setdefault(key[0], set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._evictions += 1
+
+            self._prune_invalidations(now)
+
+    def invalidate_user(self, user_id: int) -> int:
+        """
+        Xóa mọi kết quả của một user (sau khi interactions của user thay đổi)
+
+        Returns:
+            Số kết quả đã xóa
+        """
+        with self._lock:
+            self._sequence += 1
+            now = time.monotonic()
+            self._user_invalidations.pop(user_id, None)
+            self._user_invalidations[user_id] = (self._sequence, now)
+            self._prune_invalidations(now)
+            keys = self._user_keys.pop(user_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            self._invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """Xóa toàn bộ cache (thay đổi ảnh hưởng nhiều users)"""
+        with self._lock:
+            self._sequence += 1
+            self._cleared_sequence = self._sequence
+            self._user_invalidations.clear()
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._user_keys.clear()
+
+    def _prune_invalidations(self, now: float):
+        """
+        Bỏ các lần invalidate cũ hơn ttl_seconds (gọi khi đang giữ lock):
+        mọi generation lấy trước đó đều đã quá hạn ghi
+        """
+        while self._user_invalidations:
+            user_id, (_, invalidated_at) = next(iter(self._user_invalidations.items()))
+            if now - invalidated_at < self.ttl_seconds:
+                break
+            del self._user_invalidations[user_id]
+
+    def _remove(self, key: CacheKey):
+        """Xóa một entry (gọi khi đang giữ lock)"""
+        self._entries.pop(key, None)
+        user_keys = self._user_keys.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._user_keys[key[0]]
+
+    def get_stats(self) -> Dict:
+        """
+        Lấy thống kê của cache
+
+        Returns:
+            Dictionary với size, hits, misses, hit rate, evictions, expirations, invalidations
+        """
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / requests if requests else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+# Cache dùng chung cho toàn bộ process
+result_cache = RecommendationResultCache()
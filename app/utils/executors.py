@@ -0,0 +1,42 @@
+"""
+Thread pools cho các API handlers async
+Query database và tính toán model đều là code đồng bộ (SQLAlchemy session, numpy),
+gọi trực tiếp trong handler async sẽ chặn event loop và mọi request khác (kể cả /health).
+Handlers await run_db / run_model để chạy chúng trên các thread pool giới hạn số workers:
+- db_executor: query database, số workers bằng pool_size của engine
+- model_executor: tính recommendations (CPU), tách riêng khỏi database
+- build_executor: build lại model trong background (copy-on-write), một lần rebuild
+  chậm không chiếm workers đang phục vụ requests
+
+Dùng threads thay vì processes vì model nằm chung trong bộ nhớ của process và được
+cập nhật incremental tại chỗ (apply_interaction); process pool phải copy / đồng bộ
+ma trận và similarity giữa các processes ở mỗi lần cập nhật. Phần tốn CPU (phép nhân
+ma trận numpy / scipy, BLAS) nhả GIL nên các threads vẫn chạy song song.
+Job cho toàn bộ users chạy bằng scripts/parallel_batch.py trên process pool.
+"""
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+# Số workers của từng pool
+DB_WORKERS = int(os.getenv("CF_DB_WORKERS", "10"))
+MODEL_WORKERS = int(os.getenv("CF_MODEL_WORKERS", str(min(4, os.cpu_count() or 1))))
+BUILD_WORKERS = int(os.getenv("CF_BUILD_WORKERS", "1"))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="cf-db")
+model_executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="cf-model")
+build_executor = ThreadPoolExecutor(max_workers=BUILD_WORKERS, thread_name_prefix="cf-build")
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Chạy hàm đồng bộ truy cập database trên db_executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
+
+
+async def run_model(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Chạy hàm tính recommendations trên model_executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(model_executor, partial(func, *args, **kwargs))
@@ -1,17 +1,23 @@
-from app.utils.database import engine, Base
+from app.utils.database import engine, Base, SessionLocal
 # Import models để đăng ký với Base
-from app.models.schema import UserProfile, Tour, UserTourInteraction
+from app.models.schema import UserProfile, Tour, UserTourInteraction, DataVersion
 
 def init_db():
     """
     Tạo các tables trong database
     Lưu ý: Bảng user_profile và tour đã tồn tại, chỉ tạo user_tour_interaction
+    và cf_data_version (version dữ liệu để model biết khi nào cần build lại)
     """
     try:
-        # Chỉ tạo bảng user_tour_interaction (các bảng khác đã có)
+        # Chỉ tạo bảng user_tour_interaction và cf_data_version (các bảng khác đã có)
         UserTourInteraction.__table__.create(bind=engine, checkfirst=True)
+        DataVersion.__table__.create(bind=engine, checkfirst=True)
+        with SessionLocal() as db:
+            if db.get(DataVersion, 1) is None:
+                db.add(DataVersion(id=1, version=0))
+                db.commit()
         print("✅ Database tables created/verified successfully!")
-        print("📋 Bảng user_tour_interaction đã sẵn sàng")
+        print("📋 Bảng user_tour_interaction và cf_data_version đã sẵn sàng")
     except Exception as e:
         print(f"❌ Lỗi: {e}")
 
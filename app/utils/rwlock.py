@@ -0,0 +1,47 @@
+"""
+Read-write lock cho model dùng chung giữa các worker threads
+Nhiều requests đọc model cùng lúc, cập nhật incremental (ghi) chạy độc quyền.
+Ưu tiên writer: khi có writer đang chờ, reader mới phải đợi để writer không bị đói.
+Lock không reentrant: không lấy lại read/write khi đang giữ lock.
+"""
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """Giữ lock đọc (dùng chung với các readers khác)"""
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Giữ lock ghi (độc quyền)"""
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
@@ -0,0 +1,93 @@
+"""
+Benchmark ANN (IVF index) so với tìm users tương tự chính xác
+Đo recall@k và latency trên dữ liệu synthetic (không cần database)
+Chạy: python scripts/benchmark_ann.py [n_users] [n_tours]
+"""
+import sys
+import os
+import time
+import numpy as np
+import scipy.sparse as sp
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ann_index import IVFIndex
+from app.services.neighbor_index import cosine_similarity_rows
+
+
+def make_synthetic_matrix(n_users: int, n_tours: int, n_groups: int = 200, interactions_per_user: int = 20, seed: int = 42) -> sp.csr_matrix:
+    """
+    Tạo ma trận User-Tour sparse: mỗi user thuộc một nhóm sở thích,
+    phần lớn interactions rơi vào tập tours ưa thích của nhóm
+    """
+    rng = np.random.default_rng(seed)
+    group_tours = [rng.choice(n_tours, size=50, replace=False) for _ in range(n_groups)]
+    user_groups = rng.integers(0, n_groups, size=n_users)
+
+    rows, cols = [], []
+    for user_idx, group in enumerate(user_groups):
+        n_group = int(interactions_per_user * 0.8)
+        cols.append(rng.choice(group_tours[group], size=n_group, replace=False))
+        cols.append(rng.integers(0, n_tours, size=interactions_per_user - n_group))
+        rows.append(np.full(interactions_per_user, user_idx))
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    ratings = rng.choice([1.0, 2.0, 5.0, 6.0], size=len(rows))
+    matrix = sp.csr_matrix((ratings, (rows, cols)), shape=(n_users, n_tours))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def exact_top_k(matrix, norms, row_idx, k):
+    similarities = cosine_similarity_rows(matrix[[row_idx]], matrix, norms[[row_idx]], norms).ravel()
+    similarities[row_idx] = -np.inf
+    top = np.argpartition(-similarities, k - 1)[:k]
+    return top[np.argsort(-similarities[top], kind="stable")]
+
+
+def benchmark_ann(n_users: int = 50000, n_tours: int = 2000, k: int = 20, n_queries: int = 300):
+    """So sánh recall@k và latency của IVF index với nhiều n_probe khác nhau"""
+    print("🚀 Benchmark ANN (IVF) cho User Similarity")
+    print("=" * 60)
+
+    matrix = make_synthetic_matrix(n_users, n_tours)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    print(f"   Ma trận: {n_users} users × {n_tours} tours, {matrix.nnz} interactions")
+
+    rng = np.random.default_rng(0)
+    queries = rng.choice(n_users, size=n_queries, replace=False)
+
+    # Exact: cosine với toàn bộ users
+    start = time.time()
+    exact_results = [set(exact_top_k(matrix, norms, row_idx, k).tolist()) for row_idx in queries]
+    exact_ms = (time.time() - start) / n_queries * 1000
+    print(f"\n1️⃣ Exact: {exact_ms:.2f} ms/query")
+
+    # Build IVF index
+    start = time.time()
+    index = IVFIndex.build(matrix, norms)
+    build_time = time.time() - start
+    print(f"\n2️⃣ IVF build: {build_time:.2f}s ({index.n_lists} cụm)")
+
+    print(f"\n3️⃣ Recall@{k} và latency theo n_probe:")
+    print(f"   {'n_probe':>8} {'recall':>8} {'ms/query':>10} {'speedup':>8}")
+    for n_probe in [1, 2, 4, 8, 16, 32]:
+        if n_probe > index.n_lists:
+            break
+
+        start = time.time()
+        ann_results = [index.search(matrix, norms, row_idx, k, n_probe=n_probe)[0] for row_idx in queries]
+        ann_ms = (time.time() - start) / n_queries * 1000
+
+        recall = np.mean([
+            len(exact & set(ann.tolist())) / len(exact)
+            for exact, ann in zip(exact_results, ann_results)
+        ])
+        print(f"   {n_probe:>8} {recall:>8.3f} {ann_ms:>10.2f} {exact_ms / ann_ms:>7.1f}x")
+
+    print("\n✅ Benchmark hoàn thành!")
+
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    n_tours = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    benchmark_ann(n_users, n_tours)
@@ -0,0 +1,78 @@
+"""
+Benchmark thời gian từng bước preprocessing (outliers, sparse data, normalize)
+trên ma trận synthetic (không cần database)
+Chạy: python scripts/benchmark_preprocessing.py [n_users] [n_tours] [dense_n_users] [dense_n_tours]
+
+Sparse (CSR) chạy trên n_users × n_tours (default 100k × 10k).
+Dense chạy trên kích thước nhỏ hơn (default 20k × 2k) vì 100k × 10k float64 cần 8 GB.
+"""
+import sys
+import os
+import time
+import warnings
+import numpy as np
+import scipy.sparse as sp
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.collaborative_filtering import CollaborativeFiltering
+
+
+def make_synthetic_matrix(n_users: int, n_tours: int, interactions_per_user: int = 20, seed: int = 42) -> sp.csr_matrix:
+    """Tạo ma trận User-Tour CSR với điểm đã time decay và một ít ratings âm"""
+    rng = np.random.default_rng(seed)
+    n_interactions = n_users * interactions_per_user
+    rows = np.repeat(np.arange(n_users), interactions_per_user)
+    cols = rng.integers(0, n_tours, size=n_interactions)
+    scores = rng.choice([1.0, 2.0, 5.0, 6.0, 10.0, -3.0], size=n_interactions, p=[0.4, 0.2, 0.15, 0.1, 0.05, 0.1])
+    values = scores * rng.uniform(0.1, 1.0, size=n_interactions)
+
+    matrix = sp.csr_matrix((values, (rows, cols)), shape=(n_users, n_tours))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def time_stages(cf: CollaborativeFiltering, matrix):
+    """Chạy từng bước preprocessing (in-place) và in thời gian"""
+    stages = [
+        ("Remove outliers", cf._remove_outliers),
+        ("Handle sparse data", cf._handle_sparse_data),
+        ("Normalize", cf._normalize_matrix),
+    ]
+
+    total = 0.0
+    for name, stage in stages:
+        start = time.time()
+        matrix = stage(matrix)
+        elapsed = time.time() - start
+        total += elapsed
+        print(f"   {name:<20} {elapsed * 1000:>10.1f} ms")
+    print(f"   {'Tổng':<20} {total * 1000:>10.1f} ms")
+
+
+def benchmark_preprocessing(n_users: int, n_tours: int, dense_n_users: int, dense_n_tours: int):
+    print("🚀 Benchmark Preprocessing Pipeline")
+    print("=" * 60)
+    warnings.simplefilter("ignore")
+
+    cf = CollaborativeFiltering(db=None)
+
+    # Sparse (CSR)
+    matrix = make_synthetic_matrix(n_users, n_tours)
+    print(f"\n1️⃣ Sparse (CSR): {n_users} users × {n_tours} tours, {matrix.nnz} interactions")
+    time_stages(cf, matrix)
+
+    # Dense
+    dense_matrix = make_synthetic_matrix(dense_n_users, dense_n_tours).toarray()
+    print(f"\n2️⃣ Dense: {dense_n_users} users × {dense_n_tours} tours "
+          f"({dense_matrix.nbytes / (1024 * 1024):.0f} MB)")
+    time_stages(cf, dense_matrix)
+
+    print("\n✅ Benchmark hoàn thành!")
+
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_tours = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    dense_n_users = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+    dense_n_tours = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+    benchmark_preprocessing(n_users, n_tours, dense_n_users, dense_n_tours)
@@ -0,0 +1,43 @@
+"""
+Tính trước top-N recommendations cho mọi users (mọi methods) và ghi ra store
+Server đọc store này khi gọi API với serving_mode=precomputed
+Chạy: python scripts/materialize_recommendations.py [top_n]
+
+Thư mục store: CF_PRECOMPUTED_DIR (default: data/precomputed)
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.database import SessionLocal
+from app.services.model_registry import model_registry
+from app.services.recommendation_store import PRECOMPUTED_DIR, PRECOMPUTED_METHODS, PRECOMPUTED_TOP_N
+
+
+def materialize_recommendations(top_n: int):
+    db = SessionLocal()
+
+    try:
+        print("🚀 Materialize Recommendations")
+        print("=" * 60)
+
+        start = time.time()
+        model = model_registry.get_model(db)
+        print(f"\n1️⃣ Build model: {time.time() - start:.2f}s "
+              f"({len(model.user_ids or [])} users × {len(model.tour_ids or [])} tours)")
+
+        start = time.time()
+        store = model_registry.materialize(db, PRECOMPUTED_METHODS, top_n)
+        elapsed = time.time() - start
+        print(f"\n2️⃣ Tính top {top_n} cho {len(store.user_ids)} users, methods {', '.join(store.methods)}: {elapsed:.2f}s")
+        print(f"   Store: {PRECOMPUTED_DIR} ({store.nbytes / (1024 * 1024):.1f} MB)")
+
+        print("\n✅ Materialize hoàn thành!")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    top_n = int(sys.argv[1]) if len(sys.argv) > 1 else PRECOMPUTED_TOP_N
+    materialize_recommendations(top_n)
@@ -0,0 +1,65 @@
+"""
+Tính recommendations cho mọi users trên process pool (job refresh hằng đêm)
+và báo throughput (users/sec) để ước lượng phần cứng
+Chạy: python scripts/parallel_batch.py [method] [limit] [workers] [chunk_size] [output.jsonl]
+
+Workers / chunk size mặc định: CF_PARALLEL_WORKERS, CF_PARALLEL_CHUNK_SIZE
+Snapshot dùng chung giữa các workers: CF_SNAPSHOT_DIR (default: data/snapshot)
+"""
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.database import SessionLocal
+from app.services.parallel_batch import run_parallel_batch, PARALLEL_WORKERS, PARALLEL_CHUNK_SIZE
+
+
+def parallel_batch(method: str, limit: int, workers: int, chunk_size: int, output_path: str = None):
+    db = SessionLocal()
+    output = open(output_path, "w", encoding="utf-8") if output_path else None
+
+    def write_chunk(chunk_results):
+        for user_id, recommendations in chunk_results.items():
+            output.write(json.dumps({"user_id": user_id, "recommendations": recommendations}, ensure_ascii=False) + "\n")
+
+    try:
+        print("🚀 Parallel Batch Recommendations")
+        print("=" * 60)
+        print(f"   Method: {method}, limit: {limit}, workers: {workers}, chunk size: {chunk_size}")
+
+        result = run_parallel_batch(
+            db,
+            method=method,
+            n_recommendations=limit,
+            workers=workers,
+            chunk_size=chunk_size,
+            on_chunk=write_chunk if output else None
+        )
+        stats = result["stats"]
+
+        print(f"\n1️⃣ Build model + lưu snapshot: {stats['snapshot_seconds']:.2f}s")
+        print(f"\n2️⃣ Tính recommendations cho {stats['n_users']} users ({stats['n_chunks']} chunks): "
+              f"{stats['scoring_seconds']:.2f}s")
+        print(f"   Throughput: {stats['users_per_second']:.1f} users/sec")
+
+        if output:
+            print(f"   Kết quả: {output_path}")
+        else:
+            with_recommendations = sum(1 for recommendations in result["results"].values() if recommendations)
+            print(f"   Users có recommendations: {with_recommendations}/{stats['n_users']}")
+
+        print("\n✅ Parallel batch hoàn thành!")
+    finally:
+        if output:
+            output.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    method = sys.argv[1] if len(sys.argv) > 1 else "hybrid"
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else PARALLEL_WORKERS
+    chunk_size = int(sys.argv[4]) if len(sys.argv) > 4 else PARALLEL_CHUNK_SIZE
+    output_path = sys.argv[5] if len(sys.argv) > 5 else None
+    parallel_batch(method, limit, workers, chunk_size, output_path)
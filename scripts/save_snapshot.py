@@ -0,0 +1,41 @@
+"""
+Build model từ database và lưu snapshot, worker mới load snapshot lúc startup
+thay vì quét lại toàn bộ database
+Chạy: python scripts/save_snapshot.py
+
+Thư mục snapshot: CF_SNAPSHOT_DIR (default: data/snapshot)
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.database import SessionLocal
+from app.services.model_registry import ModelRegistry
+from app.services.model_snapshot import SNAPSHOT_DIR
+
+
+def save_snapshot():
+    db = SessionLocal()
+
+    try:
+        print("🚀 Save Model Snapshot")
+        print("=" * 60)
+
+        registry = ModelRegistry()
+        start = time.time()
+        registry.save_snapshot(db)
+        print(f"\n1️⃣ Build model + similarities + lưu snapshot: {time.time() - start:.2f}s")
+        print(f"   Snapshot: {SNAPSHOT_DIR}")
+
+        start = time.time()
+        loaded = ModelRegistry().load_snapshot()
+        print(f"\n2️⃣ Load snapshot: {time.time() - start:.2f}s ({'OK' if loaded else 'FAILED'})")
+
+        print("\n✅ Snapshot hoàn thành!")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    save_snapshot()
@@ -0,0 +1,129 @@
+"""
+Fixtures cho tests của Collaborative Filtering
+Database SQLite tạm với dữ liệu sinh ngẫu nhiên (seed cố định), chỉ tạo các bảng
+mà model đọc. DATABASE_URL phải được đặt trước khi import app (app.utils.database
+tạo engine lúc import).
+"""
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "app.db"))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+N_USERS = 60
+N_TOURS = 30
+N_INTERACTIONS = 700
+
+INTERACTION_TYPES = [
+    ("view", 1), ("click", 1), ("favorite", 2), ("book", 5),
+    ("paid", 6), ("rating", 4), ("rating", 3), ("rating", -3),
+]
+
+SCHEMA = """
+create table user_profile(
+    id integer primary key, first_name text, last_name text, phone text, ward text,
+    district text, province text, address text, avatar text, account_id integer, is_verified boolean
+);
+create table tour(
+    id integer primary key, title text, poster_url text, provider_id int, capacity int,
+    transportation text, accommodation text, destination_intro text, tour_info text,
+    view_count int, slug text, tour_category_id int, is_active boolean, total_star int,
+    review_count int, live_commentary text, duration text, booked_count int,
+    starting_point text, is_approved boolean, is_banned boolean
+);
+create table user_tour_interaction(
+    id integer primary key, user_id int, tour_id int, score int,
+    interaction_type text, created_at timestamp
+);
+"""
+
+
+def _create_database(path: str, seed: int = 7):
+    """Tạo database với N_USERS users, N_TOURS tours (vài tour inactive) và N_INTERACTIONS interactions"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.executemany(
+        "insert into user_profile values (?,?,?,?,?,?,?,?,?,?,?)",
+        [(u, "First", "Last", "", "", "", "", "", "", u, False) for u in range(1, N_USERS + 1)]
+    )
+    connection.executemany(
+        "insert into tour values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+        [
+            (t, f"Tour {t}", "poster", 1, 10, "bus", "hotel", "intro", "info",
+             rng.randint(0, 1000), f"tour-{t}", rng.randint(1, 4), t % 10 != 0,
+             0, 0, "", "3d", rng.randint(0, 100), "HN", True, False)
+            for t in range(1, N_TOURS + 1)
+        ]
+    )
+    rows = []
+    for _ in range(N_INTERACTIONS):
+        interaction_type, score = rng.choice(INTERACTION_TYPES)
+        rows.append((
+            rng.randint(1, N_USERS), rng.randint(1, N_TOURS), score, interaction_type,
+            now - timedelta(days=rng.random() * 90)
+        ))
+    connection.executemany(
+        "insert into user_tour_interaction(user_id, tour_id, score, interaction_type, created_at) values (?,?,?,?,?)",
+        rows
+    )
+    connection.commit()
+    connection.close()
+
+
+@pytest.fixture(scope="session")
+def database_template(tmp_path_factory) -> str:
+    """Database dùng chung, tests copy ra file riêng trước khi ghi"""
+    path = str(tmp_path_factory.mktemp("cf") / "template.db")
+    _create_database(path)
+    return path
+
+
+@pytest.fixture
+def db(database_template, tmp_path):
+    """Session tới bản copy riêng của database cho từng test"""
+    path = str(tmp_path / "cf.db")
+    shutil.copy(database_template, path)
+    engine = create_engine(f"sqlite:///{path}")
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+class _FrozenDatetime(datetime):
+    """datetime với now() cố định: time decay không đổi giữa các lần build trong một test"""
+    frozen = datetime.now(timezone.utc)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.frozen if tz is not None else cls.frozen.replace(tzinfo=None)
+
+
+@pytest.fixture(autouse=True)
+def frozen_now(monkeypatch):
+    """Cố định thời điểm hiện tại của model"""
+    import app.services.collaborative_filtering as collaborative_filtering
+    monkeypatch.setattr(collaborative_filtering, "datetime", _FrozenDatetime)
+    return _FrozenDatetime.frozen
+
+
+@pytest.fixture
+def build_model(db):
+    """Factory tạo CollaborativeFiltering đã build ma trận trên database của test"""
+    from app.services.collaborative_filtering import CollaborativeFiltering
+
+    def build(**kwargs) -> CollaborativeFiltering:
+        model = CollaborativeFiltering(db, **kwargs)
+        model.build_user_tour_matrix()
+        return model
+
+    return build
@@ -0,0 +1,79 @@
+"""
+Tests ALS: fold-in so với nghiệm least squares chính xác, thêm users / tours
+"""
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from app.services.als import ALSModel, _conjugate_gradient_step
+
+N_FACTORS = 8
+
+
+@pytest.fixture
+def ratings() -> sp.csr_matrix:
+    rng = np.random.default_rng(0)
+    values = rng.choice([-3.0, 1.0, 2.0, 4.0, 5.0], size=(50, 20))
+    values[rng.random((50, 20)) < 0.7] = 0
+    return sp.csr_matrix(values)
+
+
+@pytest.fixture
+def model(ratings) -> ALSModel:
+    return ALSModel.fit(ratings, n_factors=N_FACTORS, regularization=0.1, alpha=5.0, n_iter=5)
+
+
+def _exact_user_factors(model: ALSModel, row: np.ndarray) -> np.ndarray:
+    """Nghiệm của (YᵀCᵤY + λI) xᵤ = YᵀCᵤpᵤ với Cᵤ dense trên mọi tours"""
+    factors = model.tour_factors.astype(np.float64)
+    confidence = 1 + model.alpha * np.abs(row)
+    preference = (row > 0).astype(np.float64)
+    system = factors.T @ (confidence[:, None] * factors) + model.regularization * np.eye(model.n_factors)
+    return np.linalg.solve(system, factors.T @ (confidence * preference))
+
+
+def test_fold_in_matches_exact_solve(model, ratings):
+    dense = ratings.toarray()
+    for user_idx in range(ratings.shape[0]):
+        row = ratings[user_idx]
+        folded = model.fold_in(user_idx, row.indices, row.data.astype(np.float64))
+        np.testing.assert_allclose(folded, _exact_user_factors(model, dense[user_idx]), rtol=1e-4, atol=1e-5)
+
+
+def test_fold_in_matches_converged_batch_step(model, ratings):
+    # Conjugate Gradient hội tụ sau F bước: nửa vòng ALS của fit cho cùng nghiệm với fold-in
+    confidence, preference_confidence = ALSModel._confidence_matrices(ratings, model.alpha)
+    tour_factors = model.tour_factors.astype(np.float64)
+    batch = _conjugate_gradient_step(
+        model.user_factors.astype(np.float64), tour_factors, confidence, preference_confidence,
+        model.regularization, cg_steps=3 * N_FACTORS, chunk_size=64
+    )
+    for user_idx in range(ratings.shape[0]):
+        row = ratings[user_idx]
+        folded = model.fold_in(user_idx, row.indices, row.data.astype(np.float64))
+        np.testing.assert_allclose(folded, batch[user_idx], rtol=1e-3, atol=1e-4)
+
+
+def test_add_users_and_tours_keep_shapes(model, ratings):
+    n_users, n_tours = ratings.shape
+    # Cache YᵀY trước khi thêm tours: tours mới có factors 0 nên cache vẫn đúng
+    model.fold_in(0, ratings[0].indices, ratings[0].data.astype(np.float64))
+
+    model.add_users(2)
+    model.add_tours(3)
+    assert model.user_factors.shape == (n_users + 2, N_FACTORS)
+    assert model.tour_factors.shape == (n_tours + 3, N_FACTORS)
+    assert model.user_factors.dtype == model.tour_factors.dtype == np.float32
+
+    for user_idx in (0, n_users, n_users + 1):
+        assert model.scores(user_idx).shape == (n_tours + 3,)
+    np.testing.assert_array_equal(model.scores(n_users), 0)
+    np.testing.assert_array_equal(model.scores(0)[n_tours:], 0)
+
+    # Fold-in user mới với tour mới (chưa có factors) và tour cũ
+    tours_idx = np.array([1, n_tours + 1])
+    folded = model.fold_in(n_users, tours_idx, np.array([4.0, 5.0]))
+    row = np.zeros(n_tours + 3)
+    row[tours_idx] = [4.0, 5.0]
+    np.testing.assert_allclose(folded, _exact_user_factors(model, row), rtol=1e-4, atol=1e-5)
+    assert model.scores(n_users).shape == (n_tours + 3,)
@@ -0,0 +1,87 @@
+"""
+Tests IVF index: recall so với tìm chính xác
+"""
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from app.services.ann_index import IVFIndex
+from app.services.neighbor_index import cosine_similarity_rows
+
+K = 10
+
+
+def _clustered_vectors(n_rows: int = 400, n_dims: int = 40, n_clusters: int = 8, seed: int = 0) -> sp.csr_matrix:
+    """Vectors không âm, thưa, tập trung quanh n_clusters tâm (giống hành vi theo nhóm sở thích)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.random((n_clusters, n_dims)) * (rng.random((n_clusters, n_dims)) < 0.3)
+    rows = centers[rng.integers(n_clusters, size=n_rows)] + rng.random((n_rows, n_dims)) * 0.3
+    rows[rng.random((n_rows, n_dims)) < 0.5] = 0
+    rows[:5] = 0  # Users chưa có interaction
+    return sp.csr_matrix(rows)
+
+
+def _norms(vectors) -> np.ndarray:
+    return np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+
+
+def _exact_search(vectors, norms: np.ndarray, row_idx: int, k: int):
+    similarities = cosine_similarity_rows(vectors[[row_idx]], vectors, norms[[row_idx]], norms).ravel()
+    similarities[row_idx] = -np.inf
+    similarities[norms == 0] = -np.inf
+    top = np.argsort(-similarities, kind="stable")[:k]
+    return top, similarities[top]
+
+
+def test_recall_against_exact_search():
+    vectors = _clustered_vectors()
+    norms = _norms(vectors)
+    index = IVFIndex.build(vectors, norms, n_lists=8, n_probe=3)
+
+    hits = total = 0
+    for row_idx in range(5, vectors.shape[0]):
+        expected, _ = _exact_search(vectors, norms, row_idx, K)
+        found, similarities = index.search(vectors, norms, row_idx, K)
+        assert np.all(np.diff(similarities) <= 0)
+        hits += len(set(found.tolist()) & set(expected.tolist()))
+        total += K
+    assert hits / total >= 0.9
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_probing_every_list_is_exact(sparse):
+    vectors = _clustered_vectors(seed=1)
+    norms = _norms(vectors)
+    if not sparse:
+        vectors = vectors.toarray()
+    index = IVFIndex.build(vectors, norms, n_lists=8, n_probe=2)
+
+    for row_idx in range(vectors.shape[0]):
+        found, similarities = index.search(vectors, norms, row_idx, K, n_probe=index.n_lists)
+        if norms[row_idx] == 0:
+            assert len(found) == 0
+            continue
+        expected, expected_similarities = _exact_search(vectors, norms, row_idx, K)
+        np.testing.assert_allclose(similarities, expected_similarities, atol=1e-12)
+        np.testing.assert_array_equal(found, expected)
+
+
+def test_update_reassigns_changed_rows():
+    vectors = _clustered_vectors(seed=2).tolil()
+    norms = _norms(vectors.tocsr())
+    index = IVFIndex.build(vectors.tocsr(), norms, n_lists=8)
+
+    # Hàng 0 có interaction đầu tiên, hàng 10 chuyển sang giống hàng 200, hàng 20 bị xoá hết
+    vectors[0] = vectors[100]
+    vectors[10] = vectors[200]
+    vectors[20] = 0
+    vectors = vectors.tocsr()
+    norms = _norms(vectors)
+    changed = np.array([0, 10, 20])
+    index.update(vectors, norms, changed)
+
+    assert index.assignments[0] == index.assignments[100]
+    assert index.assignments[10] == index.assignments[200]
+    assert index.assignments[20] == -1
+    for list_idx, rows in enumerate(index._lists):
+        np.testing.assert_array_equal(np.sort(rows), np.flatnonzero(index.assignments == list_idx))
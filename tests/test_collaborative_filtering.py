@@ -0,0 +1,290 @@
+"""
+Tests tương đương giữa các đường tính của CollaborativeFiltering
+"""
+import random
+from datetime import datetime
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sqlalchemy import text
+
+from app.models.schema import Tour, UserTourInteraction
+from app.services.interaction_loader import tour_to_metadata
+from app.services.neighbor_index import NeighborIndex
+from tests.conftest import INTERACTION_TYPES, N_TOURS, N_USERS
+
+CF_METHODS = ["user_based", "tour_based", "hybrid"]
+ALL_METHODS = CF_METHODS + ["als"]
+
+
+def _dense(matrix) -> np.ndarray:
+    return matrix.toarray() if sp.issparse(matrix) else np.asarray(matrix)
+
+
+def _recommend(model, method: str, user_id: int, n: int = 10):
+    return getattr(model, f"{method}_recommendations")(user_id, n)
+
+
+def _assert_same_recommendations(expected, actual, tolerance: float = 1e-6):
+    assert [r["tour_id"] for r in actual] == [r["tour_id"] for r in expected]
+    assert [r.get("explanation") for r in actual] == [r.get("explanation") for r in expected]
+    np.testing.assert_allclose(
+        [r["predicted_score"] for r in actual],
+        [r["predicted_score"] for r in expected],
+        rtol=tolerance, atol=tolerance
+    )
+
+
+def test_sparse_matches_dense(build_model):
+    dense = build_model(use_sparse=False)
+    sparse = build_model(use_sparse=True)
+
+    assert sp.issparse(sparse.user_tour_matrix)
+    np.testing.assert_allclose(_dense(sparse.user_tour_matrix_raw), dense.user_tour_matrix_raw)
+    np.testing.assert_allclose(_dense(sparse.user_tour_matrix), dense.user_tour_matrix, atol=1e-12)
+    np.testing.assert_allclose(
+        sparse.calculate_user_similarity(), dense.calculate_user_similarity(), atol=1e-12
+    )
+    np.testing.assert_allclose(
+        sparse.calculate_tour_similarity(), dense.calculate_tour_similarity(), atol=1e-12
+    )
+
+    for method in CF_METHODS:
+        for user_id in dense.user_ids[:20]:
+            _assert_same_recommendations(
+                _recommend(dense, method, user_id), _recommend(sparse, method, user_id)
+            )
+
+
+@pytest.mark.parametrize("use_sparse", [False, True])
+@pytest.mark.parametrize("method", ALL_METHODS)
+def test_batch_matches_single_user(build_model, method, use_sparse):
+    model = build_model(use_sparse=use_sparse)
+    user_ids = list(model.user_ids) + [N_USERS + 1000]  # user không có trong ma trận
+
+    batch = model.batch_recommendations(user_ids, method, 10)
+
+    assert set(batch) == set(user_ids)
+    for user_id in user_ids:
+        _assert_same_recommendations(_recommend(model, method, user_id), batch[user_id], tolerance=1e-5)
+
+
+@pytest.mark.parametrize("use_sparse", [False, True])
+def test_neighbor_index_matches_dense_similarity(build_model, use_sparse):
+    dense = build_model(use_sparse=use_sparse)
+    # K không nhỏ hơn số users / tours: top K chứa mọi láng giềng
+    indexed = build_model(use_sparse=use_sparse, use_neighbor_index=True, n_neighbors=N_USERS)
+
+    user_similarity = dense.calculate_user_similarity()
+    user_neighbors = indexed.calculate_user_neighbors()
+    assert user_neighbors.k == len(indexed.user_ids) - 1
+    for user_idx in range(0, len(indexed.user_ids), 7):
+        others = np.delete(np.arange(len(indexed.user_ids)), user_idx)
+        np.testing.assert_allclose(
+            user_neighbors.lookup(user_idx, others), user_similarity[user_idx, others], atol=1e-6
+        )
+
+    for method in CF_METHODS:
+        for user_id in dense.user_ids[:20]:
+            _assert_same_recommendations(
+                _recommend(dense, method, user_id), _recommend(indexed, method, user_id), tolerance=1e-5
+            )
+
+
+def test_neighbor_index_update_matches_build(build_model):
+    model = build_model(use_sparse=True, use_neighbor_index=True, n_neighbors=5)
+    model.calculate_user_neighbors()
+    model.calculate_tour_neighbors()
+
+    rng = random.Random(5)
+    for _ in range(40):
+        interaction_type, score = rng.choice(INTERACTION_TYPES)
+        model.apply_interaction(rng.choice(model.user_ids), rng.choice(model.tour_ids), score, interaction_type)
+        if rng.random() < 0.3:
+            model.calculate_user_neighbors()
+            model.calculate_tour_neighbors()
+
+    for updated, vectors in (
+        (model.calculate_user_neighbors(), model.user_tour_matrix),
+        (model.calculate_tour_neighbors(), model._tour_vectors()),
+    ):
+        rebuilt = NeighborIndex.build(vectors, model._row_norms(vectors), 5)
+        np.testing.assert_allclose(updated.scores, rebuilt.scores, atol=1e-6)
+        # Láng giềng có similarity 0 hoà nhau nên thứ tự không xác định
+        positive = rebuilt.scores > 1e-6
+        np.testing.assert_array_equal(updated.indices[positive], rebuilt.indices[positive])
+
+
+@pytest.mark.parametrize("use_sparse", [False, True])
+def test_incremental_updates_match_full_rebuild(db, build_model, use_sparse):
+    model = build_model(use_sparse=use_sparse)
+    model.calculate_user_similarity()
+    model.calculate_tour_similarity()
+
+    new_user_id, new_tour_id = N_USERS + 1, N_TOURS + 1
+    db.execute(text(
+        "insert into user_profile(id, first_name, last_name, account_id, is_verified) "
+        "values (:id, 'New', 'User', :id, 0)"
+    ), {"id": new_user_id})
+    db.execute(text(
+        "insert into tour(id, title, poster_url, provider_id, capacity, transportation, accommodation, "
+        "destination_intro, tour_info, view_count, slug, tour_category_id, is_active, total_star, "
+        "review_count, live_commentary, duration, booked_count, starting_point, is_approved, is_banned) "
+        "values (:id, 'New tour', 'poster', 1, 10, '', '', '', '', 0, 'new-tour', 1, 1, 0, 0, '', '', 0, '', 1, 0)"
+    ), {"id": new_tour_id})
+    db.commit()
+
+    rng = random.Random(3)
+    for step in range(120):
+        user_id = new_user_id if step in (0, 3) else rng.randint(1, new_user_id)
+        tour_id = new_tour_id if step in (0, 5) else rng.randint(1, new_tour_id)
+        interaction_type, score = rng.choice(INTERACTION_TYPES)
+        interaction = UserTourInteraction(
+            user_id=user_id, tour_id=tour_id, score=score,
+            interaction_type=interaction_type, created_at=datetime.utcnow()
+        )
+        db.add(interaction)
+        db.commit()
+        tour = db.query(Tour).filter(Tour.id == tour_id).first()
+        model.apply_interaction(
+            user_id, tour_id, score, interaction_type, interaction.created_at, tour_to_metadata(tour)
+        )
+        if step % 10 == 0:
+            model.user_based_recommendations(user_id, 5)
+
+    model.prepare(CF_METHODS)
+    assert not model._has_pending_updates()
+
+    rebuilt = build_model(use_sparse=use_sparse)
+    assert set(model.user_ids) == set(rebuilt.user_ids)
+    assert set(model.tour_ids) == set(rebuilt.tour_ids)
+
+    users = [model.user_id_to_idx[user_id] for user_id in rebuilt.user_ids]
+    tours = [model.tour_id_to_idx[tour_id] for tour_id in rebuilt.tour_ids]
+    np.testing.assert_allclose(
+        _dense(model.user_tour_matrix_raw)[np.ix_(users, tours)],
+        _dense(rebuilt.user_tour_matrix_raw),
+        rtol=1e-6
+    )
+    for name in ("tour_cooccurrence_positive", "tour_cooccurrence_sum"):
+        np.testing.assert_allclose(
+            _dense(getattr(model, name))[np.ix_(tours, tours)],
+            _dense(getattr(rebuilt, name)),
+            atol=1e-9
+        )
+
+    # Similarity cập nhật incremental giống tính lại từ ma trận đã cập nhật
+    incremental_similarity = model.calculate_user_similarity().copy()
+    np.testing.assert_allclose(
+        incremental_similarity, model.calculate_user_similarity(force_recalculate=True), atol=1e-9
+    )
+
+
+@pytest.mark.parametrize("method", ALL_METHODS)
+def test_precomputed_matches_live(build_model, method):
+    model = build_model()
+    store = model.materialize_recommendations(top_n=20)
+    stored_methods = () if method == "als" else (method,)
+
+    compared = 0
+    for user_id in model.user_ids[:30]:
+        live = model.serve((method,), [user_id], _recommend, model, method, user_id, 5)
+        precomputed = model.serve(
+            stored_methods, [user_id], model.precomputed_recommendations, store, user_id, method, 5
+        )
+        if precomputed is None:
+            continue
+        _assert_same_recommendations(live, precomputed, tolerance=1e-4)
+        compared += 1
+    assert compared > 0
+
+
+def test_snapshot_round_trip(build_model, db, tmp_path):
+    model = build_model(use_sparse=True, use_neighbor_index=True)
+    model.prepare(ALL_METHODS)
+    assert model.save_snapshot(str(tmp_path / "snapshot"))
+
+    from app.services.collaborative_filtering import CollaborativeFiltering
+    loaded = CollaborativeFiltering(db, use_sparse=True, use_neighbor_index=True)
+    assert loaded.load_snapshot(str(tmp_path / "snapshot"))
+    assert loaded.model_version != model.model_version
+
+    np.testing.assert_array_equal(_dense(loaded.user_tour_matrix), _dense(model.user_tour_matrix))
+    for method in ALL_METHODS:
+        for user_id in model.user_ids[:10]:
+            _assert_same_recommendations(
+                _recommend(model, method, user_id), _recommend(loaded, method, user_id)
+            )
+
+
+
+def test_snapshot_remap_and_detach(build_model, tmp_path):
+    model = build_model(use_sparse=True)
+    model.prepare(CF_METHODS)
+    user_id = model.user_ids[0]
+    expected = {method: _recommend(model, method, user_id) for method in CF_METHODS}
+    directory = str(tmp_path / "snapshot")
+
+    assert model.save_snapshot(directory, remap=True)
+    assert model._snapshot_mapped
+    assert not model.user_tour_matrix.data.flags.writeable
+    for method in CF_METHODS:
+        _assert_same_recommendations(expected[method], _recommend(model, method, user_id))
+
+    # Cập nhật in-place copy các arrays ra bộ nhớ riêng trước khi ghi
+    revision = model.state_revision
+    model.apply_interaction(user_id, model.tour_ids[0], 6, "paid")
+    assert not model._snapshot_mapped
+    assert model.user_tour_matrix.data.flags.writeable
+
+    # Model đã thay đổi sau lần lưu: remap bị bỏ qua để không mất thay đổi
+    assert not model.remap_snapshot(directory, state_revision=revision)
+    assert not model._snapshot_mapped
+
+
+@pytest.mark.parametrize("use_sparse", [False, True])
+def test_removed_interactions_match_full_rebuild(db, build_model, use_sparse):
+    model = build_model(use_sparse=use_sparse)
+    model.prepare(CF_METHODS)
+    removed_user_id = model.user_ids[0]
+    removed_tour_id = model.tour_ids[0]
+
+    db.query(UserTourInteraction).filter(UserTourInteraction.user_id == removed_user_id).delete()
+    db.query(UserTourInteraction).filter(UserTourInteraction.tour_id == removed_tour_id).delete()
+    db.commit()
+    assert model.remove_interactions(user_id=removed_user_id)
+    assert model.remove_interactions(tour_id=removed_tour_id)
+    model.prepare(CF_METHODS)
+
+    rebuilt = build_model(use_sparse=use_sparse)
+    assert list(model.user_ids) == list(rebuilt.user_ids)
+    assert list(model.tour_ids) == list(rebuilt.tour_ids)
+    np.testing.assert_allclose(_dense(model.user_tour_matrix_raw), _dense(rebuilt.user_tour_matrix_raw))
+    for name in ("tour_cooccurrence_positive", "tour_cooccurrence_sum"):
+        np.testing.assert_allclose(_dense(getattr(model, name)), _dense(getattr(rebuilt, name)), atol=1e-9)
+    np.testing.assert_array_equal(model._user_interaction_counts, rebuilt._user_interaction_counts)
+    np.testing.assert_array_equal(model._tour_interaction_counts, rebuilt._tour_interaction_counts)
+    for user_id, tour_id in zip(rebuilt.user_ids, rebuilt.tour_ids):
+        for key in ((removed_user_id, tour_id), (user_id, removed_tour_id), (user_id, tour_id)):
+            assert model._get_interaction_history(*key) == rebuilt._get_interaction_history(*key)
+
+    # User không còn interactions: không có láng giềng để recommend
+    assert model.user_based_recommendations(removed_user_id, 5) == []
+
+
+@pytest.mark.parametrize("config", [{}, {"use_sparse": True, "use_neighbor_index": True}])
+def test_missing_state_built_outside_lock_matches_locked_path(build_model, config):
+    outside = build_model(**config)
+    outside.tour_cooccurrence_positive = outside.tour_cooccurrence_sum = None
+    assert outside.build_missing_state(ALL_METHODS)
+    locked = build_model(**config)
+    locked.prepare(ALL_METHODS)
+
+    for name in ("tour_cooccurrence_positive", "tour_cooccurrence_sum"):
+        np.testing.assert_allclose(_dense(getattr(outside, name)), _dense(getattr(locked, name)))
+    np.testing.assert_allclose(outside.als_model.user_factors, locked.als_model.user_factors, atol=1e-6)
+    np.testing.assert_allclose(outside.als_model.tour_factors, locked.als_model.tour_factors, atol=1e-6)
+    for method in ALL_METHODS:
+        for user_id in locked.user_ids[:10]:
+            _assert_same_recommendations(_recommend(locked, method, user_id), _recommend(outside, method, user_id))
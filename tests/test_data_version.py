@@ -0,0 +1,57 @@
+"""
+Tests catalog fingerprint của data version
+"""
+from sqlalchemy import text
+
+from app.services.data_version import get_catalog_fingerprint
+
+
+def _update_tours(db, column: str, value: bool, tour_ids):
+    db.execute(
+        text(f"update tour set {column} = :value where id in ({', '.join(map(str, tour_ids))})"),
+        {"value": value}
+    )
+    db.commit()
+
+
+def test_fingerprint_stable_without_catalog_changes(db):
+    fingerprint = get_catalog_fingerprint(db)
+    assert fingerprint is not None
+
+    db.execute(text(
+        "insert into user_tour_interaction(user_id, tour_id, score, interaction_type, created_at) "
+        "values (1, 1, 1, 'view', '2024-01-01')"
+    ))
+    db.execute(text("update tour set view_count = view_count + 1"))
+    db.commit()
+    assert get_catalog_fingerprint(db) == fingerprint
+
+
+def test_fingerprint_detects_status_swaps(db):
+    # Số tours được recommend và tổng id giữ nguyên: 10 + 20 == 13 + 17
+    fingerprint = get_catalog_fingerprint(db)
+    _update_tours(db, "is_active", True, [10, 20])
+    _update_tours(db, "is_banned", True, [13, 17])
+    swapped = get_catalog_fingerprint(db)
+    assert swapped != fingerprint
+
+    # Chỉ trạng thái được recommend có ý nghĩa: unban nhưng bỏ duyệt giữ nguyên fingerprint
+    _update_tours(db, "is_banned", False, [13, 17])
+    _update_tours(db, "is_approved", False, [13, 17])
+    assert get_catalog_fingerprint(db) == swapped
+
+    _update_tours(db, "is_approved", True, [13, 17])
+    _update_tours(db, "is_active", False, [10, 20])
+    assert get_catalog_fingerprint(db) == fingerprint
+
+
+def test_fingerprint_detects_user_replaced_below_max_id(db):
+    # Số users và id lớn nhất giữ nguyên
+    fingerprint = get_catalog_fingerprint(db)
+    db.execute(text("delete from user_profile where id = 5"))
+    db.execute(text(
+        "insert into user_profile(id, first_name, last_name, account_id, is_verified) "
+        "values (:id, 'New', 'User', :id, 0)"
+    ), {"id": 0})
+    db.commit()
+    assert get_catalog_fingerprint(db) != fingerprint
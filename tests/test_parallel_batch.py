@@ -0,0 +1,47 @@
+"""
+Tests batch song song: kết quả chia chunks trên process pool giống batch_recommendations
+"""
+import sys
+
+import pytest
+
+from app.services.parallel_batch import run_parallel_batch
+from tests.conftest import N_USERS
+from tests.test_collaborative_filtering import _assert_same_recommendations
+
+
+@pytest.fixture
+def registry():
+    """Registry dùng chung của process, xóa models sau test (database của test bị xóa theo)"""
+    registry = sys.modules["app.services.model_registry"].model_registry
+    registry.drop_all()
+    yield registry
+    registry.drop_all()
+
+
+@pytest.mark.parametrize("method", ["hybrid", "als"])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_sharded_matches_batch(db, registry, tmp_path, workers, method):
+    user_ids = list(range(1, N_USERS + 1)) + [N_USERS + 1000]  # user không có trong ma trận
+    run = run_parallel_batch(
+        db, user_ids, method, 5, workers=workers, chunk_size=7, directory=str(tmp_path / "snapshot")
+    )
+
+    expected = registry.get_model(db).batch_recommendations(user_ids, method, 5)
+    assert run["stats"]["n_chunks"] == 9
+    assert set(run["results"]) == set(user_ids)
+    for user_id in user_ids:
+        _assert_same_recommendations(expected[user_id], run["results"][user_id])
+
+
+def test_on_chunk_receives_every_chunk(db, registry, tmp_path):
+    chunks = []
+    run = run_parallel_batch(
+        db, None, "hybrid", 5, workers=1, chunk_size=25,
+        directory=str(tmp_path / "snapshot"), on_chunk=chunks.append
+    )
+
+    model = registry.get_model(db)
+    assert run["results"] == {}
+    assert [len(chunk) for chunk in chunks] == [25, 25, len(model.user_ids) - 50]
+    assert {user_id for chunk in chunks for user_id in chunk} == set(model.user_ids)
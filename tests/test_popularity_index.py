@@ -0,0 +1,131 @@
+"""
+Tests bảng xếp hạng popular / trending trong bộ nhớ
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import app.services.popularity_index as popularity_module
+from app.models.schema import Tour, UserTourInteraction
+from app.services.popularity_index import PopularityIndex, TRENDING_HALF_LIFE_DAYS, TRENDING_WINDOW_DAYS
+from tests.conftest import _FrozenDatetime
+
+
+class _Clock:
+    """Thay time của module index: thời gian chỉ trôi khi test gọi advance"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(popularity_module, "time", clock)
+    monkeypatch.setattr(popularity_module, "datetime", _FrozenDatetime)
+    return clock
+
+
+def _available_tours(db):
+    return db.query(Tour).filter(Tour.is_active == True, Tour.is_approved == True, Tour.is_banned == False)
+
+
+def test_popular_matches_order_by(db, clock):
+    # Tạo các cặp hoà view_count để kiểm tra thứ tự theo booked_count rồi id
+    db.execute(text("update tour set view_count = 500 where id in (1, 2, 3, 4)"))
+    db.execute(text("update tour set booked_count = 7 where id in (2, 4)"))
+    db.commit()
+    index = PopularityIndex(refresh_seconds=60)
+    index.refresh(db)
+
+    expected = _available_tours(db).order_by(
+        Tour.view_count.desc(), Tour.booked_count.desc(), Tour.id
+    ).all()
+    top = index.top_tours(len(expected) + 5)
+
+    assert index.n_tours == len(expected)
+    assert [tour["id"] for tour, _ in top] == [tour.id for tour in expected]
+    assert [score for _, score in top] == [tour.view_count + tour.booked_count * 2 for tour in expected]
+
+
+def test_trending_decays_recent_scores(db, clock):
+    now = _FrozenDatetime.now()
+    available = {tour.id for tour in _available_tours(db)}
+    expected = defaultdict(float)
+    for interaction in db.query(UserTourInteraction):
+        age_days = (now - interaction.created_at).total_seconds() / 86400
+        if age_days <= TRENDING_WINDOW_DAYS and interaction.tour_id in available:
+            expected[interaction.tour_id] += interaction.score * 0.5 ** (max(age_days, 0) / TRENDING_HALF_LIFE_DAYS)
+    expected = sorted(
+        ((tour_id, score) for tour_id, score in expected.items() if score > 0),
+        key=lambda item: (-item[1], item[0])
+    )
+    assert expected
+
+    index = PopularityIndex(refresh_seconds=60)
+    index.refresh(db)
+    tour_ids, scores = index._state[1]["trending"]
+
+    assert tour_ids.tolist() == [tour_id for tour_id, _ in expected]
+    np.testing.assert_allclose(scores, [score for _, score in expected], rtol=1e-9)
+
+    # Cùng score: interaction cũ một half life chỉ được nửa trọng số
+    before = dict(zip(tour_ids.tolist(), scores.tolist()))
+    for tour_id, days in ((1, 0), (2, TRENDING_HALF_LIFE_DAYS)):
+        db.add(UserTourInteraction(
+            user_id=1, tour_id=tour_id, score=1000, interaction_type="paid",
+            created_at=now - timedelta(days=days)
+        ))
+    db.commit()
+    index.refresh(db)
+    after = {tour["id"]: score for tour, score in index.top_tours(2, "trending")}
+    assert list(after) == [1, 2]
+    assert after[1] - before.get(1, 0) == pytest.approx(1000)
+    assert after[2] - before.get(2, 0) == pytest.approx(500)
+
+
+def test_trending_filled_from_popular(db, clock):
+    db.execute(text("delete from user_tour_interaction"))
+    db.commit()
+    index = PopularityIndex(refresh_seconds=60)
+    index.refresh(db)
+    assert len(index._state[1]["trending"][0]) == 0
+    assert index.top_tours(5, "trending") == index.top_tours(5, "popular")
+
+
+def test_ensure_fresh_refreshes_in_background(db, clock, monkeypatch):
+    import app.utils.database as database
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=db.get_bind()))
+
+    index = PopularityIndex(refresh_seconds=60)
+    assert index.get_stats() == {"built": False}
+    index.ensure_fresh(db)
+    first = index.top_tours(1)[0][0]["id"]
+    assert first != 3
+
+    db.execute(text("update tour set view_count = 100000 where id = :id"), {"id": 3})
+    db.commit()
+
+    # Chưa quá hạn: giữ bảng xếp hạng cũ
+    clock.advance(59)
+    index.ensure_fresh(db)
+    assert index.top_tours(1)[0][0]["id"] == first
+    assert index.get_stats()["age_seconds"] == 59
+
+    # Quá hạn: refresh trên build_executor với session riêng
+    clock.advance(1)
+    index.ensure_fresh(db)
+    with index._refresh_lock:
+        pass
+    assert index.top_tours(1)[0][0]["id"] == 3
+    assert index.get_stats()["age_seconds"] == 0
@@ -0,0 +1,163 @@
+"""
+Tests cache kết quả recommendations (LRU, TTL, invalidate theo user, counters)
+"""
+import asyncio
+
+import pytest
+
+import app.services.result_cache as result_cache_module
+from app.services.result_cache import RecommendationResultCache
+
+MODEL_VERSION = 1
+
+
+class _Clock:
+    """Thay time của module cache: thời gian chỉ trôi khi test gọi advance"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(result_cache_module, "time", clock)
+    return clock
+
+
+def _key(user_id: int, method: str = "hybrid", limit: int = 10):
+    return user_id, method, limit, MODEL_VERSION
+
+
+def _put(cache: RecommendationResultCache, key, recommendations=None):
+    cache.put(key, recommendations or [{"tour_id": key[0]}], cache.generation())
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = RecommendationResultCache(max_size=3, ttl_seconds=60)
+    for user_id in (1, 2, 3):
+        _put(cache, _key(user_id))
+
+    # Đọc user 1: user 2 trở thành entry ít dùng gần đây nhất
+    assert cache.get(_key(1)) == [{"tour_id": 1}]
+    _put(cache, _key(4))
+    assert cache.get(_key(2)) is None
+    _put(cache, _key(5))
+    assert cache.get(_key(3)) is None
+
+    for user_id in (1, 4, 5):
+        assert cache.get(_key(user_id)) == [{"tour_id": user_id}]
+    stats = cache.get_stats()
+    assert stats["size"] == 3
+    assert stats["evictions"] == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = RecommendationResultCache(max_size=10, ttl_seconds=60)
+    _put(cache, _key(1))
+    clock.advance(59)
+    assert cache.get(_key(1)) is not None
+    clock.advance(1)
+    assert cache.get(_key(1)) is None
+    assert cache.get_stats()["expirations"] == 1
+
+    # Kết quả tính lâu hơn ttl không được ghi
+    generation = cache.generation()
+    clock.advance(60)
+    cache.put(_key(2), [{"tour_id": 2}], generation)
+    assert cache.get(_key(2)) is None
+
+
+def test_invalidate_user_only_affects_that_user(clock):
+    cache = RecommendationResultCache(max_size=10, ttl_seconds=60)
+    _put(cache, _key(1, "hybrid"))
+    _put(cache, _key(1, "user_based", 5))
+    _put(cache, _key(2))
+
+    # Generation lấy trước khi invalidate: kết quả của user 1 có thể dựa trên model cũ
+    generation = cache.generation()
+    assert cache.invalidate_user(1) == 2
+    assert cache.get(_key(1, "hybrid")) is None
+    assert cache.get(_key(1, "user_based", 5)) is None
+
+    cache.put(_key(1), [{"tour_id": 1}], generation)
+    cache.put(_key(3), [{"tour_id": 3}], generation)
+    assert cache.get(_key(1)) is None
+    assert cache.get(_key(3)) == [{"tour_id": 3}]
+    assert cache.get(_key(2)) == [{"tour_id": 2}]
+
+    # Generation lấy sau khi invalidate được ghi bình thường
+    _put(cache, _key(1))
+    assert cache.get(_key(1)) == [{"tour_id": 1}]
+
+    # Hết ttl: lần invalidate cũ được bỏ, không chặn generation mới
+    clock.advance(60)
+    _put(cache, _key(4))
+    assert not cache._user_invalidations
+
+
+def test_clear_rejects_results_started_before(clock):
+    cache = RecommendationResultCache(max_size=10, ttl_seconds=60)
+    _put(cache, _key(1))
+    generation = cache.generation()
+    cache.clear()
+    cache.put(_key(2), [{"tour_id": 2}], generation)
+    assert cache.get(_key(1)) is None
+    assert cache.get(_key(2)) is None
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_stats_counters(clock):
+    cache = RecommendationResultCache(max_size=2, ttl_seconds=60)
+    assert cache.get(_key(1)) is None
+    _put(cache, _key(1))
+    assert cache.get(_key(1)) is not None
+    assert cache.get(_key(1)) is not None
+    _put(cache, _key(2))
+    _put(cache, _key(3))
+    cache.invalidate_user(3)
+    # Không có model_version (model chưa build): không cache
+    cache.put((4, "hybrid", 10, None), [], cache.generation())
+
+    stats = cache.get_stats()
+    assert stats == {
+        "enabled": True,
+        "size": 1,
+        "max_size": 2,
+        "ttl_seconds": 60,
+        "hits": 2,
+        "misses": 1,
+        "hit_rate": pytest.approx(2 / 3),
+        "evictions": 1,
+        "expirations": 0,
+        "invalidations": 1,
+    }
+
+
+def test_disabled_cache_stores_nothing(clock):
+    cache = RecommendationResultCache(max_size=0, ttl_seconds=60)
+    _put(cache, _key(1))
+    assert cache.get(_key(1)) is None
+    assert cache.get_stats()["size"] == 0
+
+
+def test_create_interaction_invalidates_user(db, monkeypatch):
+    from app.api import interactions
+
+    cache = RecommendationResultCache(max_size=10, ttl_seconds=60)
+    monkeypatch.setattr(interactions, "result_cache", cache)
+    _put(cache, _key(1))
+    _put(cache, _key(2))
+
+    payload = interactions.InteractionCreate(user_id=1, tour_id=1, interaction_type="book")
+    response = asyncio.run(interactions.create_interaction(payload, db))
+
+    assert response["success"]
+    assert cache.get(_key(1)) is None
+    assert cache.get(_key(2)) == [{"tour_id": 2}]